@@ -1,89 +1,222 @@
 """API clients for OpenAI and Stability AI."""
 import os
 import base64
-import requests
-from openai import OpenAI
+import asyncio
+import hashlib
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+from cache import DiskCache, make_key
+import http_client
+from metrics import track_provider_call, timed, PROVIDER_RESPONSE_BYTES, CACHE_LOOKUPS, ERRORS
 
 load_dotenv()
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# Initialize OpenAI clients (the SDK keeps its own keep-alive pool)
+# Base URLs can point at a local stub server (see benchmarks/stub_server.py)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+STABILITY_BASE_URL = os.getenv('STABILITY_BASE_URL', 'https://api.stability.ai').rstrip('/')
 
-def generate_image(prompt: str) -> bytes:
+# Retries and timeouts come from http_client's guard instead of the SDK's own
+openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=OPENAI_BASE_URL, max_retries=0)
+async_openai_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=OPENAI_BASE_URL, max_retries=0)
+
+# Image generation parameters (part of the cache key)
+IMAGE_MODEL = "dall-e-3"
+IMAGE_SIZE = "1024x1024"
+IMAGE_QUALITY = "hd"
+
+# Generated PNGs keyed by prompt and model parameters
+image_cache = DiskCache('images', int(os.getenv('IMAGE_CACHE_MAX_MB', 512)) * 1024 * 1024, suffix='.png')
+
+# Generated GLBs keyed by image digest, endpoint and parameters
+model_cache = DiskCache('models', int(os.getenv('MODEL_CACHE_MAX_MB', 1024)) * 1024 * 1024, suffix='.glb')
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace and case so trivially different prompts share a cache entry."""
+    return ' '.join(prompt.split()).casefold()
+
+def _image_cache_key(prompt: str) -> str:
+    return make_key(
+        prompt=normalize_prompt(prompt),
+        model=IMAGE_MODEL,
+        size=IMAGE_SIZE,
+        quality=IMAGE_QUALITY
+    )
+
+def _image_request(prompt: str) -> dict:
+    return {
+        'model': IMAGE_MODEL,
+        'prompt': prompt,
+        'size': IMAGE_SIZE,
+        'quality': IMAGE_QUALITY,
+        'n': 1,
+        'response_format': "b64_json"
+    }
+
+def _cache_get(cache: DiskCache, name: str, key: str) -> bytes | None:
+    data = cache.get(key)
+    CACHE_LOOKUPS.inc(cache=name, result='hit' if data is not None else 'miss')
+    return data
+
+def cached_image(prompt: str) -> bytes | None:
+    """Return the cached image for prompt, or None if it would have to be generated."""
+    return _cache_get(image_cache, 'images', _image_cache_key(prompt))
+
+async def cached_image_async(prompt: str) -> bytes | None:
+    """Async version of cached_image."""
+    return await asyncio.to_thread(cached_image, prompt)
+
+def _check_status(response, operation: str):
+    if response.status_code != 200:
+        ERRORS.inc(operation=operation, type=f'HTTP {response.status_code}')
+        raise Exception(f"API returned status code {response.status_code}: {response.text}")
+
+@timed('generate_image')
+def generate_image(prompt: str, check_cache: bool = True) -> bytes:
     """
     Generate a 2D image using OpenAI's DALL-E model.
+    Repeated prompts are served from the on-disk image cache; pass
+    check_cache=False when the caller has just looked it up with cached_image.
     Returns the image as bytes.
     """
     try:
-        response = openai_client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="hd",
-            n=1,
-            response_format="b64_json"
-        )
-        
+        cache_key = _image_cache_key(prompt)
+        cached = _cache_get(image_cache, 'images', cache_key) if check_cache else None
+        if cached is not None:
+            return cached
+
+        with track_provider_call('openai', 'generate_image', IMAGE_MODEL):
+            response = http_client.get_guard('openai').call(
+                lambda timeout: openai_client.images.generate(**_image_request(prompt), timeout=timeout)
+            )
+
         # Decode base64 image
         image_data = base64.b64decode(response.data[0].b64_json)
+        PROVIDER_RESPONSE_BYTES.observe(len(image_data), provider='openai', operation='generate_image', model_type=IMAGE_MODEL)
+        image_cache.put(cache_key, image_data)
+        return image_data
+
+    except Exception as e:
+        raise Exception(f"Failed to generate image: {str(e)}")
+
+@timed('generate_image')
+async def generate_image_async(prompt: str, check_cache: bool = True) -> bytes:
+    """Async version of generate_image for use directly in UI handlers."""
+    try:
+        cache_key = _image_cache_key(prompt)
+        cached = await asyncio.to_thread(_cache_get, image_cache, 'images', cache_key) if check_cache else None
+        if cached is not None:
+            return cached
+
+        with track_provider_call('openai', 'generate_image', IMAGE_MODEL):
+            response = await http_client.get_guard('openai').call_async(
+                lambda timeout: async_openai_client.images.generate(**_image_request(prompt), timeout=timeout)
+            )
+
+        image_data = base64.b64decode(response.data[0].b64_json)
+        PROVIDER_RESPONSE_BYTES.observe(len(image_data), provider='openai', operation='generate_image', model_type=IMAGE_MODEL)
+        await asyncio.to_thread(image_cache.put, cache_key, image_data)
         return image_data
-        
+
     except Exception as e:
         raise Exception(f"Failed to generate image: {str(e)}")
 
-def generate_3d_model(image_bytes: bytes, model_type: str = 'point-aware') -> bytes:
+def _build_3d_request(image_bytes: bytes, model_type: str) -> tuple[str, dict, dict, dict, str]:
+    """Return (endpoint, headers, files, data, cache_key) for a 3D generation call."""
+    if model_type == 'fast':
+        # Stable Fast 3D - Premium quality, faster generation
+        endpoint = f'{STABILITY_BASE_URL}/v2beta/3d/stable-fast-3d'
+        data = {}
+    else:
+        # Stable Point Aware 3D - Cost-effective, good quality
+        endpoint = f'{STABILITY_BASE_URL}/v2beta/3d/stable-point-aware-3d'
+        data = {
+            'texture_resolution': '2048',      # Maximum texture resolution
+            'foreground_ratio': '1.0',         # Full foreground focus
+            'remesh': 'quad',                  # Quad remeshing for better topology
+            'vertex_count': '10000',           # Higher vertex count for detail
+            'output_format': 'glb'             # GLB format output
+        }
+
+    # Same image + same parameters always yields a reusable model
+    cache_key = make_key(
+        image_sha256=hashlib.sha256(image_bytes).hexdigest(),
+        endpoint=endpoint,
+        params=data
+    )
+
+    api_key = os.getenv('STABILITY_API_KEY')
+
+    # Prepare the multipart/form-data request
+    files = {
+        'image': ('image.png', image_bytes, 'image/png')
+    }
+
+    headers = {
+        'Authorization': f'Bearer {api_key}'
+    }
+    return endpoint, headers, files, data, cache_key
+
+def cached_3d_model(image_bytes: bytes, model_type: str = 'point-aware') -> bytes | None:
+    """Return the cached model for this image and model type, or None if it would have to be generated."""
+    cache_key = _build_3d_request(image_bytes, model_type)[-1]
+    return _cache_get(model_cache, 'models', cache_key)
+
+async def cached_3d_model_async(image_bytes: bytes, model_type: str = 'point-aware') -> bytes | None:
+    """Async version of cached_3d_model; hashing a large image happens off the event loop."""
+    return await asyncio.to_thread(cached_3d_model, image_bytes, model_type)
+
+@timed('generate_3d_model')
+def generate_3d_model(image_bytes: bytes, model_type: str = 'point-aware', check_cache: bool = True) -> bytes:
     """
     Generate a 3D model from an image using Stability AI's 3D APIs.
-    
+
     Args:
         image_bytes: Image data as bytes
         model_type: Either 'point-aware' (1 credit) or 'fast' (3 credits)
-    
+        check_cache: False when the caller has just looked it up with cached_3d_model
+
+    Results are cached on disk, so converting an unchanged image again
+    with the same model type returns immediately.
     Returns the .glb file as bytes.
     """
     try:
-        api_key = os.getenv('STABILITY_API_KEY')
-        
-        # Prepare the multipart/form-data request
-        files = {
-            'image': ('image.png', image_bytes, 'image/png')
-        }
-        
-        headers = {
-            'Authorization': f'Bearer {api_key}'
-        }
-        
-        if model_type == 'fast':
-            # Stable Fast 3D - Premium quality, faster generation
-            endpoint = 'https://api.stability.ai/v2beta/3d/stable-fast-3d'
-            data = {}
-            timeout = 120
-        else:
-            # Stable Point Aware 3D - Cost-effective, good quality
-            endpoint = 'https://api.stability.ai/v2beta/3d/stable-point-aware-3d'
-            data = {
-                'texture_resolution': '2048',      # Maximum texture resolution
-                'foreground_ratio': '1.0',         # Full foreground focus
-                'remesh': 'quad',                  # Quad remeshing for better topology
-                'vertex_count': '10000',           # Higher vertex count for detail
-                'output_format': 'glb'             # GLB format output
-            }
-            timeout = 120
-        
-        # Make the API request
-        response = requests.post(
-            endpoint,
-            headers=headers,
-            files=files,
-            data=data,
-            timeout=timeout
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"API returned status code {response.status_code}: {response.text}")
-        
+        endpoint, headers, files, data, cache_key = _build_3d_request(image_bytes, model_type)
+        cached = _cache_get(model_cache, 'models', cache_key) if check_cache else None
+        if cached is not None:
+            return cached
+
+        # Make the API request over the shared keep-alive session
+        with track_provider_call('stability', 'generate_3d_model', model_type):
+            response = http_client.post('stability', endpoint, headers=headers, files=files, data=data)
+
+        _check_status(response, 'generate_3d_model')
+        PROVIDER_RESPONSE_BYTES.observe(len(response.content), provider='stability', operation='generate_3d_model', model_type=model_type)
+
+        model_cache.put(cache_key, response.content)
+        return response.content
+
+    except Exception as e:
+        raise Exception(f"Failed to generate 3D model: {str(e)}")
+
+@timed('generate_3d_model')
+async def generate_3d_model_async(image_bytes: bytes, model_type: str = 'point-aware', check_cache: bool = True) -> bytes:
+    """Async version of generate_3d_model for use directly in UI handlers."""
+    try:
+        # Hashing the image and reading a cached model take a while for large files
+        endpoint, headers, files, data, cache_key = await asyncio.to_thread(_build_3d_request, image_bytes, model_type)
+        cached = await asyncio.to_thread(_cache_get, model_cache, 'models', cache_key) if check_cache else None
+        if cached is not None:
+            return cached
+
+        with track_provider_call('stability', 'generate_3d_model', model_type):
+            response = await http_client.async_post('stability', endpoint, headers=headers, files=files, data=data)
+
+        _check_status(response, 'generate_3d_model')
+        PROVIDER_RESPONSE_BYTES.observe(len(response.content), provider='stability', operation='generate_3d_model', model_type=model_type)
+
+        await asyncio.to_thread(model_cache.put, cache_key, response.content)
         return response.content
-        
+
     except Exception as e:
         raise Exception(f"Failed to generate 3D model: {str(e)}")
@@ -0,0 +1,165 @@
+"""Per-user artifact store for generated images and models."""
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ARTIFACT_DIR = Path(os.getenv('SCULPTOR_ARTIFACT_DIR', 'generated/artifacts'))
+ARTIFACT_TTL = float(os.getenv('ARTIFACT_TTL_HOURS', 24)) * 3600
+ARTIFACT_MAX_BYTES = int(float(os.getenv('ARTIFACT_MAX_MB', 2048)) * 1024 * 1024)
+
+# Artifact IDs look like image-<hex> or image-<hex>-preview; anything else never touches the disk
+_ARTIFACT_ID = re.compile(r'[a-z]+-[0-9a-f]{32}(-[a-z]+)?')
+
+CONTENT_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.webp': 'image/webp',
+    '.glb': 'model/gltf-binary',
+}
+
+@dataclass
+class Artifact:
+    """Metadata for a stored payload; the bytes themselves stay on disk."""
+    id: str
+    user_id: int
+    kind: str
+    path: Path
+    size: int
+    sha256: str
+    created_at: float
+    last_access: float
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES.get(self.path.suffix, 'application/octet-stream')
+
+class ArtifactStore:
+    """
+    Artifacts keyed by (user_id, artifact_id).
+    Only metadata is kept in memory; entries expire after ttl seconds and the
+    least recently used ones are evicted once max_bytes is exceeded.
+    When several processes share root, artifacts written by another process
+    are picked up from disk on first access.
+    """
+
+    def __init__(self, root: Path = ARTIFACT_DIR, ttl: float = ARTIFACT_TTL, max_bytes: int = ARTIFACT_MAX_BYTES):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._artifacts = OrderedDict()
+        self._total_bytes = 0
+        self._load_existing()
+
+    def _load_existing(self):
+        """Rebuild metadata from files left by a previous run."""
+        if not self.root.exists():
+            return
+        found = []
+        for path in self.root.glob('*/*'):
+            if path.suffix not in CONTENT_TYPES or not path.parent.name.isdigit():
+                continue
+            stat = path.stat()
+            kind = path.stem.split('-', 1)[0]
+            found.append(Artifact(path.stem, int(path.parent.name), kind, path, stat.st_size, '', stat.st_mtime, stat.st_mtime))
+        for artifact in sorted(found, key=lambda a: a.last_access):
+            self._artifacts[(artifact.user_id, artifact.id)] = artifact
+            self._total_bytes += artifact.size
+        with self._lock:
+            self._evict()
+
+    def put(self, user_id: int, data: bytes, kind: str, suffix: str, artifact_id: str = None) -> Artifact:
+        """Write data to disk and register it for user_id."""
+        artifact_id = artifact_id or f'{kind}-{uuid.uuid4().hex}'
+        path = self.root / str(user_id) / f'{artifact_id}{suffix}'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(suffix + '.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+        now = time.time()
+        artifact = Artifact(artifact_id, user_id, kind, path, len(data), hashlib.sha256(data).hexdigest(), now, now)
+        with self._lock:
+            # Replacing an artifact must not count the old payload twice
+            previous = self._artifacts.pop((user_id, artifact_id), None)
+            if previous is not None:
+                self._total_bytes -= previous.size
+                if previous.path != path:
+                    previous.path.unlink(missing_ok=True)
+            self._artifacts[(user_id, artifact_id)] = artifact
+            self._total_bytes += artifact.size
+            self._evict()
+        return artifact
+
+    def get(self, user_id: int, artifact_id: str) -> Artifact | None:
+        """Return artifact metadata if it exists, belongs to user_id and has not expired."""
+        with self._lock:
+            artifact = self._artifacts.get((user_id, artifact_id)) or self._find_on_disk(user_id, artifact_id)
+            if artifact is None:
+                return None
+            if time.time() - artifact.created_at > self.ttl or not artifact.path.exists():
+                self._remove(artifact)
+                return None
+            artifact.last_access = time.time()
+            self._artifacts.move_to_end((user_id, artifact_id))
+            return artifact
+
+    def _find_on_disk(self, user_id: int, artifact_id: str) -> Artifact | None:
+        """Register an artifact another process wrote since this one started."""
+        if not _ARTIFACT_ID.fullmatch(artifact_id):
+            return None
+        for suffix in CONTENT_TYPES:
+            path = self.root / str(user_id) / f'{artifact_id}{suffix}'
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            kind = artifact_id.split('-', 1)[0]
+            artifact = Artifact(artifact_id, user_id, kind, path, stat.st_size, '', stat.st_mtime, stat.st_mtime)
+            self._artifacts[(user_id, artifact_id)] = artifact
+            self._total_bytes += artifact.size
+            return artifact
+        return None
+
+    def read(self, artifact: Artifact) -> bytes:
+        """Read an artifact's payload from disk."""
+        return artifact.path.read_bytes()
+
+    def delete(self, user_id: int, artifact_id: str):
+        with self._lock:
+            artifact = self._artifacts.get((user_id, artifact_id))
+            if artifact:
+                self._remove(artifact)
+
+    def _remove(self, artifact: Artifact):
+        self._artifacts.pop((artifact.user_id, artifact.id), None)
+        self._total_bytes -= artifact.size
+        artifact.path.unlink(missing_ok=True)
+
+    def _evict(self):
+        now = time.time()
+        for artifact in [a for a in self._artifacts.values() if now - a.created_at > self.ttl]:
+            self._remove(artifact)
+        while self._total_bytes > self.max_bytes and self._artifacts:
+            _, artifact = next(iter(self._artifacts.items()))
+            self._remove(artifact)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'artifacts': len(self._artifacts), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes}
+
+def artifact_url(artifact: Artifact) -> str:
+    """URL of the HTTP route that serves an artifact to its owner."""
+    return f'/artifacts/{artifact.id}'
+
+# Process-wide store shared by the UI and the job workers
+artifact_store = ArtifactStore()
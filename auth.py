@@ -1,12 +1,67 @@
 """Authentication functions for user signup and login."""
+import os
+import math
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import bcrypt
-from database import create_user, get_user
+from dotenv import load_dotenv
+from metrics import EXECUTOR_QUEUE_DEPTH
+from database import create_user, get_user, update_password_hash, create_user_async, get_user_async
+
+load_dotenv()
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+AUTH_WORKERS = int(os.getenv('AUTH_WORKERS', 2))
+BCRYPT_TARGET_MS = float(os.getenv('BCRYPT_TARGET_MS', 250))
+BCRYPT_MIN_ROUNDS = int(os.getenv('BCRYPT_MIN_ROUNDS', 10))
+BCRYPT_MAX_ROUNDS = int(os.getenv('BCRYPT_MAX_ROUNDS', 16))
+# Set to skip calibration and always use a fixed cost
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 0)) or None
+
+_CALIBRATION_ROUNDS = 8
+
+_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix='auth')
+# Hashes waiting for a free thread
+EXECUTOR_QUEUE_DEPTH.set_function(lambda: _executor._work_queue.qsize(), executor='auth')
+_rounds_lock = threading.Lock()
+_rounds = BCRYPT_ROUNDS
+_dummy_hash = None
+
+def calibrate_rounds(target_ms: float = BCRYPT_TARGET_MS) -> int:
+    """
+    Pick the bcrypt cost whose hash time is closest to target_ms on this machine.
+    Each extra round doubles the work, so one cheap sample is enough to extrapolate.
+    """
+    start = time.perf_counter()
+    bcrypt.hashpw(b'calibration', bcrypt.gensalt(_CALIBRATION_ROUNDS))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rounds = _CALIBRATION_ROUNDS + round(math.log2(target_ms / max(elapsed_ms, 0.001)))
+    return max(BCRYPT_MIN_ROUNDS, min(BCRYPT_MAX_ROUNDS, rounds))
+
+def get_rounds() -> int:
+    """The bcrypt cost for new hashes; calibrated once per process."""
+    global _rounds
+    if _rounds is None:
+        with _rounds_lock:
+            if _rounds is None:
+                _rounds = calibrate_rounds()
+    return _rounds
+
+def hash_rounds(hashed_password: str) -> int:
+    """Read the cost factor out of a stored bcrypt hash ($2b$<cost>$...)."""
+    return int(hashed_password.split('$')[2])
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True when a stored hash is cheaper than the current cost."""
+    return hash_rounds(hashed_password) < get_rounds()
 
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt."""
     # Convert password to bytes and hash it
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(get_rounds())
     hashed = bcrypt.hashpw(password_bytes, salt)
     # Return as string for database storage
     return hashed.decode('utf-8')
@@ -19,6 +74,17 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     # Verify using bcrypt
     return bcrypt.checkpw(password_bytes, hashed_bytes)
 
+def _reject_unknown_user(password: str):
+    """Spend the same time as a real check so unknown usernames are not revealed by timing."""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password('not-a-real-password')
+    verify_password(password, _dummy_hash)
+
+def _rehash_if_needed(user, password: str):
+    if needs_rehash(user.hashed_password):
+        update_password_hash(user.id, hash_password(password))
+
 def signup_user(username: str, password: str) -> tuple[bool, str]:
     """
     Sign up a new user.
@@ -28,7 +94,7 @@ def signup_user(username: str, password: str) -> tuple[bool, str]:
     existing_user = get_user(username)
     if existing_user:
         return False, "Username already exists"
-    
+
     # Hash password and create user
     hashed_password = hash_password(password)
     try:
@@ -44,9 +110,56 @@ def login_user(username: str, password: str) -> tuple[bool, str, object]:
     """
     user = get_user(username)
     if not user:
+        _reject_unknown_user(password)
         return False, "Invalid username or password", None
-    
+
     if not verify_password(password, user.hashed_password):
         return False, "Invalid username or password", None
-    
+
+    _rehash_if_needed(user, password)
     return True, "Login successful", user
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+async def signup_user_async(username: str, password: str) -> tuple[bool, str, object]:
+    """
+    Sign up a new user without blocking the event loop.
+    Returns (success: bool, message: str, user: User or None) so callers can
+    log the user in without hashing the password a second time.
+    """
+    existing_user = await get_user_async(username)
+    if existing_user:
+        return False, "Username already exists", None
+
+    hashed_password = await _run(hash_password, password)
+    try:
+        user = await create_user_async(username, hashed_password)
+        return True, "Account created successfully", user
+    except Exception as e:
+        return False, f"Error creating account: {str(e)}", None
+
+async def login_user_async(username: str, password: str) -> tuple[bool, str, object]:
+    """
+    Log in a user without blocking the event loop.
+    Returns (success: bool, message: str, user: User or None)
+    """
+    user = await get_user_async(username)
+    if not user:
+        await _run(_reject_unknown_user, password)
+        return False, "Invalid username or password", None
+
+    if not await _run(verify_password, password, user.hashed_password):
+        return False, "Invalid username or password", None
+
+    await _run(_rehash_if_needed, user, password)
+    return True, "Login successful", user
+
+def warm_up():
+    """Calibrate the cost in the background so the first signup does not pay for it."""
+    _executor.submit(get_rounds)
+
+def shutdown():
+    """Stop the hashing threads; call on application shutdown."""
+    _executor.shutdown(wait=False, cancel_futures=True)
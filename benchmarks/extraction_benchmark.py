@@ -0,0 +1,130 @@
+"""
+Compare the local heuristic extractor with the LLM on one document.
+
+    python benchmarks/extraction_benchmark.py
+    python benchmarks/extraction_benchmark.py --save-reference llm_entities.txt
+    python benchmarks/extraction_benchmark.py --reference llm_entities.txt
+
+Times the local extractor over many runs and, when TOGETHER_API_KEY is set
+(or TOGETHER_BASE_URL points at the stub server), one LLM extraction of the
+same text. The LLM's entities are the reference for precision and recall;
+--reference reads a list saved earlier with --save-reference instead of
+calling the provider again.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+from dotenv import load_dotenv
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+ROOT = BENCHMARKS_DIR.parent
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--document', type=Path, default=ROOT / 'samples' / 'sample_document.txt')
+    parser.add_argument('--runs', type=int, default=200, help='timed runs of the local extractor')
+    parser.add_argument('--reference', type=Path, help='LLM entities, one per line, instead of calling the provider')
+    parser.add_argument('--save-reference', type=Path, help='write the LLM entities here for later runs')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args(argv)
+
+def normalize(entity: str) -> str:
+    """Case-fold and drop a leading article, so "The Shield of Dawn" matches "Shield of Dawn"."""
+    words = entity.casefold().split()
+    if words and words[0] in ('the', 'a', 'an'):
+        words = words[1:]
+    return ' '.join(words)
+
+def matches(entity: str, others: set[str]) -> bool:
+    """Exact match, or one name contains the other ("Aldric" and "Sir Aldric")."""
+    return any(entity == other or f' {entity} ' in f' {other} ' or f' {other} ' in f' {entity} ' for other in others)
+
+def compare(local: list[str], reference: list[str]) -> dict:
+    local_set = {normalize(entity) for entity in local} - {''}
+    reference_set = {normalize(entity) for entity in reference} - {''}
+    found = [entity for entity in local_set if matches(entity, reference_set)]
+    recalled = [entity for entity in reference_set if matches(entity, local_set)]
+    precision = len(found) / len(local_set) if local_set else 0.0
+    recall = len(recalled) / len(reference_set) if reference_set else 0.0
+    return {
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        'missed': sorted(reference_set - set(recalled)),
+        'extra': sorted(local_set - set(found)),
+    }
+
+def time_local(text: str, runs: int) -> dict:
+    from local_extractor import extract_entities_local
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        entities = extract_entities_local(text)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        'entities': entities,
+        'median_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(0.95 * len(timings)))] * 1000,
+    }
+
+def run_llm(text: str) -> dict:
+    import rag
+
+    start = time.perf_counter()
+    entities = rag.extract_entities(text, mode='single')
+    return {'entities': [entity for entity in entities if entity != 'No entities found'], 'seconds': time.perf_counter() - start}
+
+def format_report(report: dict) -> str:
+    local = report['local']
+    lines = [
+        f"Document: {report['document']} ({report['chars']} chars)",
+        f"Local: {len(local['entities'])} entities, median {local['median_ms']:.2f} ms, p95 {local['p95_ms']:.2f} ms",
+        '  ' + ', '.join(local['entities']),
+    ]
+    llm = report.get('llm')
+    if llm is None:
+        lines.append('LLM: skipped (set TOGETHER_API_KEY or pass --reference)')
+        return '\n'.join(lines)
+    timing = f", {llm['seconds']:.2f} s" if llm.get('seconds') is not None else ' (from reference file)'
+    lines += [f"LLM: {len(llm['entities'])} entities{timing}", '  ' + ', '.join(llm['entities'])]
+    comparison = report['comparison']
+    lines += [
+        '',
+        f"Precision {comparison['precision']:.2f}  recall {comparison['recall']:.2f}  F1 {comparison['f1']:.2f}",
+        f"Missed by local: {', '.join(comparison['missed']) or '-'}",
+        f"Only found locally: {', '.join(comparison['extra']) or '-'}",
+    ]
+    if llm.get('seconds'):
+        lines.append(f"Speedup: {llm['seconds'] * 1000 / local['median_ms']:.0f}x")
+    return '\n'.join(lines)
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    text = args.document.read_text(encoding='utf-8')
+    # Measure the model itself, not the fallback it would use on failure
+    os.environ['EXTRACTION_FALLBACK'] = 'false'
+    sys.path.insert(0, str(ROOT))
+
+    report = {'document': str(args.document), 'chars': len(text), 'local': time_local(text, args.runs)}
+    if args.reference:
+        reference = [line.strip() for line in args.reference.read_text(encoding='utf-8').splitlines() if line.strip()]
+        report['llm'] = {'entities': reference, 'seconds': None}
+    elif os.getenv('TOGETHER_API_KEY'):
+        report['llm'] = run_llm(text)
+        if args.save_reference:
+            args.save_reference.write_text('\n'.join(report['llm']['entities']) + '\n', encoding='utf-8')
+    if 'llm' in report:
+        report['comparison'] = compare(report['local']['entities'], report['llm']['entities'])
+
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
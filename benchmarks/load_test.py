@@ -0,0 +1,240 @@
+"""
+End-to-end load test: N simulated users each sign up, log in, analyze a document,
+generate an image and convert it to 3D, all against the local stub server.
+
+    python benchmarks/load_test.py --users 20 --time-scale 0.05
+
+The app modules run in this process with their real job workers, database
+and artifact store, in a temporary directory. Reports throughput, p50/p95/p99
+latency per stage and end to end, errors and peak RSS.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+import statistics
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+ROOT = BENCHMARKS_DIR.parent
+STAGES = ('signup', 'login', 'analyze', 'image', 'model', 'total')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help='simulated users')
+    parser.add_argument('--concurrency', type=int, default=0, help='users active at once (default: all)')
+    parser.add_argument('--document', type=Path, default=ROOT / 'samples' / 'sample_document.txt')
+    parser.add_argument('--model-type', choices=('fast', 'point-aware'), default='point-aware')
+    parser.add_argument('--stub-url', help='use an already running stub server instead of starting one')
+    parser.add_argument('--time-scale', type=float, default=0.05, help='passed to the stub server it starts')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='passed to the stub server it starts')
+    parser.add_argument('--job-workers', type=int, default=4)
+    parser.add_argument('--bcrypt-rounds', type=int, default=10)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    return parser.parse_args(argv)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_stub(time_scale: float, error_rate: float) -> tuple[subprocess.Popen, str]:
+    """Start stub_server.py on a free port and wait until it accepts connections."""
+    port = _free_port()
+    process = subprocess.Popen([
+        sys.executable, str(BENCHMARKS_DIR / 'stub_server.py'), '--port', str(port),
+        '--time-scale', str(time_scale), '--error-rate', str(error_rate),
+    ])
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise Exception("Failed to start the stub server")
+
+def configure_environment(stub_url: str, workdir: Path, args):
+    """Point the app at the stub and a scratch directory. Must run before the app modules are imported."""
+    os.environ.update({
+        'OPENAI_BASE_URL': f'{stub_url}/v1',
+        'STABILITY_BASE_URL': stub_url,
+        'TOGETHER_BASE_URL': stub_url,
+        'OPENAI_API_KEY': 'stub',
+        'STABILITY_API_KEY': 'stub',
+        'TOGETHER_API_KEY': 'stub',
+        'DATABASE_URL': f'sqlite:///{workdir / "load_test.db"}',
+        'SCULPTOR_CACHE_DIR': str(workdir / 'cache'),
+        'SCULPTOR_ARTIFACT_DIR': str(workdir / 'artifacts'),
+        'SCULPTOR_JOBS_DIR': str(workdir / 'jobs'),
+        'JOB_WORKERS': str(args.job_workers),
+        'JOB_POLL_INTERVAL': '0.1',
+        'BCRYPT_ROUNDS': str(args.bcrypt_rounds),
+        'LOOP_MONITOR': 'false',
+    })
+    sys.path.insert(0, str(ROOT))
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20,
+    }
+
+async def simulate_user(index: int, document: str, model_type: str, timings: dict, errors: dict):
+    """Walk one user through the whole workflow, recording each stage's latency."""
+    import auth
+    import jobs
+    from ingest import DocumentStore
+    from rag import extract_document_entities_async
+
+    async def stage(name, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            timings[name].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    try:
+        username = f'load-{index}-{time.time_ns()}'
+        success, message, user = await stage('signup', auth.signup_user_async(username, 'password123'))
+        if not success:
+            raise Exception(f"Failed to sign up: {message}")
+        # Login is the bcrypt verify path every returning user hits
+        success, message, user = await stage('login', auth.login_user_async(username, 'password123'))
+        if not success:
+            raise Exception(f"Failed to log in: {message}")
+
+        async def analyze():
+            # Extraction results are cached per document, so each user's copy is
+            # made unique; otherwise only the first user would reach the provider
+            async def upload():
+                yield f'{document}\n\n(copy {index})'.encode('utf-8')
+            store = DocumentStore()
+            await store.add('document.txt', upload())
+            return await extract_document_entities_async(store.documents)
+
+        entities = await stage('analyze', analyze())
+        if not entities:
+            raise Exception("Failed to extract entities: none found")
+
+        async def generate(kind, enqueue):
+            job_id = await enqueue
+            if job_id is None:
+                raise Exception(f"Failed to queue {kind} job: insufficient credits")
+            job = await jobs.wait_for_job(job_id)
+            if job.status != 'done':
+                raise Exception(f"Failed to generate {kind}: {job.error}")
+            return job
+
+        image_job = await stage('image', generate('image', jobs.enqueue_image_job(user.id, entities[index % len(entities)], 1)))
+        image_bytes = await asyncio.to_thread(Path(image_job.result_path).read_bytes)
+        await stage('model', generate('model', jobs.enqueue_3d_job(user.id, image_bytes, model_type, 3 if model_type == 'fast' else 1)))
+        timings['total'].append(time.perf_counter() - start)
+    except Exception as e:
+        errors[str(e)[:120]] = errors.get(str(e)[:120], 0) + 1
+
+async def run(args, document: str) -> dict:
+    import auth
+    import jobs
+    import database
+    import http_client
+    import thumbnails
+
+    await database.init_db_async()
+    await jobs.start_workers(args.job_workers)
+    timings = {name: [] for name in STAGES}
+    errors = {}
+    limit = asyncio.Semaphore(args.concurrency or args.users)
+
+    async def limited(index):
+        async with limit:
+            await simulate_user(index, document, args.model_type, timings, errors)
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(limited(index) for index in range(args.users)))
+    finally:
+        elapsed = time.perf_counter() - start
+        await jobs.stop_workers()
+        await http_client.aclose()
+        thumbnails.shutdown()
+        auth.shutdown()
+        await database.close_async()
+
+    completed = len(timings['total'])
+    return {
+        'users': args.users,
+        'completed': completed,
+        'failed': args.users - completed,
+        'elapsed_s': elapsed,
+        'throughput_users_per_s': completed / elapsed if elapsed else 0.0,
+        'latency_s': {
+            name: {
+                'p50': percentile(values, 0.50),
+                'p95': percentile(values, 0.95),
+                'p99': percentile(values, 0.99),
+                'mean': statistics.fmean(values) if values else 0.0,
+                'count': len(values),
+            }
+            for name, values in timings.items()
+        },
+        'errors': errors,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Users: {report['users']}  completed: {report['completed']}  failed: {report['failed']}",
+        f"Elapsed: {report['elapsed_s']:.2f} s  throughput: {report['throughput_users_per_s']:.2f} users/s",
+        '',
+        f"{'stage':<10}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}",
+    ]
+    for name, stats in report['latency_s'].items():
+        lines.append(
+            f"{name:<10}{stats['count']:>7}{stats['p50']:>10.3f}{stats['p95']:>10.3f}{stats['p99']:>10.3f}{stats['mean']:>10.3f}"
+        )
+    rss = report['peak_rss_mb']
+    lines += ['', f"Peak RSS: {rss['self']:.1f} MB (largest child process {rss['children']:.1f} MB)"]
+    for message, count in report['errors'].items():
+        lines.append(f'Error x{count}: {message}')
+    return '\n'.join(lines)
+
+def main(argv=None):
+    args = parse_args(argv)
+    document = args.document.read_text(encoding='utf-8')
+    stub = None
+    stub_url = args.stub_url
+    if not stub_url:
+        stub, stub_url = start_stub(args.time_scale, args.error_rate)
+    try:
+        with tempfile.TemporaryDirectory(prefix='sculptor-load-') as workdir:
+            configure_environment(stub_url.rstrip('/'), Path(workdir), args)
+            report = asyncio.run(run(args, document))
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    return 0 if report['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Local stand-in for the OpenAI, Stability and Together APIs.
+
+Serves real sample payloads with configurable latency and error rates, so the
+whole generation pipeline can run without network access:
+
+    python benchmarks/stub_server.py --port 9000 --time-scale 0.1
+
+Then point the app at it:
+
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1
+    STABILITY_BASE_URL=http://127.0.0.1:9000
+    TOGETHER_BASE_URL=http://127.0.0.1:9000
+"""
+import os
+import re
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import asyncio
+import argparse
+from pathlib import Path
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SAMPLES_DIR = Path(__file__).resolve().parent.parent / 'samples'
+
+# Median latency in seconds per API; spread comes from a lognormal with sigma
+DEFAULT_LATENCY = {
+    'image': 12.0,
+    'model': 20.0,
+    'chat': 1.5,
+}
+
+# Share of a streamed completion's latency spent before the first token
+STREAM_FIRST_TOKEN = 0.1
+
+class StubConfig:
+    """Latency, error and payload settings shared by all routes."""
+
+    def __init__(self, latency: dict, sigma: float, time_scale: float, error_rate: float,
+                 image_path: Path, model_paths: list[Path], seed: int = None):
+        self.latency = latency
+        self.sigma = sigma
+        self.time_scale = time_scale
+        self.error_rate = error_rate
+        self.image = image_path.read_bytes()
+        self.models = [path.read_bytes() for path in model_paths]
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    def delay(self, api: str) -> float:
+        median = self.latency[api] * self.time_scale
+        return self.random.lognormvariate(0, self.sigma) * median if median > 0 else 0.0
+
+    def should_fail(self) -> bool:
+        return self.random.random() < self.error_rate
+
+def unique_png(png: bytes, nonce: str) -> bytes:
+    """
+    Insert a tEXt chunk before IEND so every response hashes differently.
+    Otherwise the 3D cache would turn every conversion after the first into a hit.
+    """
+    payload = b'stub\x00' + nonce.encode()
+    chunk = struct.pack('>I', len(payload)) + b'tEXt' + payload
+    chunk += struct.pack('>I', zlib.crc32(b'tEXt' + payload) & 0xffffffff)
+    iend = png.rindex(b'IEND') - 4
+    return png[:iend] + chunk + png[iend:]
+
+def extract_names(text: str, limit: int = 12) -> list[str]:
+    """Cheap imitation of the extraction model: capitalized phrases, most frequent first."""
+    counts = {}
+    for match in re.finditer(r'\b(?:[A-Z][a-z]+)(?:\s+(?:of\s+)?[A-Z][a-z]+)*\b', text):
+        name = match.group(0)
+        counts[name] = counts.get(name, 0) + 1
+    return sorted(counts, key=lambda name: -counts[name])[:limit]
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI()
+
+    async def simulate(api: str, delay: float = None) -> Response | None:
+        config.requests += 1
+        await asyncio.sleep(config.delay(api) if delay is None else delay)
+        if config.should_fail():
+            config.errors += 1
+            return JSONResponse({'error': {'message': 'stub: simulated upstream failure'}}, status_code=503)
+        return None
+
+    @app.post('/v1/images/generations')
+    async def images(request: Request):
+        body = await request.json()
+        if failure := await simulate('image'):
+            return failure
+        png = unique_png(config.image, f'{time.time_ns()}-{config.random.random()}')
+        return {
+            'created': int(time.time()),
+            'data': [{'b64_json': base64.b64encode(png).decode('ascii'), 'revised_prompt': body.get('prompt', '')}]
+        }
+
+    @app.post('/v2beta/3d/{model}')
+    async def model_3d(model: str, request: Request):
+        form = await request.form()
+        if 'image' not in form:
+            return JSONResponse({'errors': ['image is required']}, status_code=400)
+        if failure := await simulate('model'):
+            return failure
+        return Response(config.random.choice(config.models), media_type='model/gltf-binary')
+
+    @app.post('/v1/chat/completions')
+    async def chat(request: Request):
+        body = await request.json()
+        text = body['messages'][-1]['content'].split('Text:', 1)[-1]
+        if body.get('stream'):
+            return await chat_stream(body, extract_names(text))
+        if failure := await simulate('chat'):
+            return failure
+        return {
+            'id': f'stub-{config.requests}',
+            'object': 'chat.completion',
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': '\n'.join(extract_names(text))}, 'finish_reason': 'stop'}]
+        }
+
+    async def chat_stream(body: dict, names: list[str]):
+        # Headers after a tenth of the total latency, then names spread over the rest
+        total = config.delay('chat')
+        if failure := await simulate('chat', total * STREAM_FIRST_TOKEN):
+            return failure
+        pieces = [piece for name in names for piece in (name[:len(name) // 2], name[len(name) // 2:] + '\n')]
+        interval = total * (1 - STREAM_FIRST_TOKEN) / max(len(pieces), 1)
+
+        async def events():
+            for piece in pieces:
+                await asyncio.sleep(interval)
+                chunk = {'object': 'chat.completion.chunk', 'model': body.get('model'), 'choices': [{'index': 0, 'delta': {'content': piece}}]}
+                yield f'data: {json.dumps(chunk)}\n\n'
+            yield 'data: [DONE]\n\n'
+
+        return StreamingResponse(events(), media_type='text/event-stream')
+
+    @app.get('/stats')
+    async def stats():
+        return {'requests': config.requests, 'errors': config.errors}
+
+    return app
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('STUB_PORT', 9000)))
+    parser.add_argument('--image-latency', type=float, default=DEFAULT_LATENCY['image'], help='median seconds per image')
+    parser.add_argument('--model-latency', type=float, default=DEFAULT_LATENCY['model'], help='median seconds per 3D model')
+    parser.add_argument('--chat-latency', type=float, default=DEFAULT_LATENCY['chat'], help='median seconds per extraction')
+    parser.add_argument('--sigma', type=float, default=0.35, help='lognormal spread of all latencies')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='multiply every latency, e.g. 0.1 for quick runs')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--image', type=Path, default=SAMPLES_DIR / 'generated_image.png')
+    parser.add_argument('--model', type=Path, action='append', help='GLB to return (repeatable)')
+    parser.add_argument('--seed', type=int)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = StubConfig(
+        latency={'image': args.image_latency, 'model': args.model_latency, 'chat': args.chat_latency},
+        sigma=args.sigma,
+        time_scale=args.time_scale,
+        error_rate=args.error_rate,
+        image_path=args.image,
+        model_paths=args.model or sorted(SAMPLES_DIR.glob('*.glb')),
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level='warning')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Content-addressed on-disk cache for generated assets, plus a small in-memory TTL cache."""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_ROOT = Path(os.getenv('SCULPTOR_CACHE_DIR', '.sculptor_cache'))
+
+def make_key(**fields) -> str:
+    """
+    Build a cache key from keyword fields.
+    The fields are serialized with sorted keys so argument order never matters.
+    """
+    payload = json.dumps(fields, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class DiskCache:
+    """
+    Size-bounded key/value cache that stores each entry as a file.
+    Least recently used entries are evicted once max_bytes is exceeded.
+    """
+
+    def __init__(self, name: str, max_bytes: int, suffix: str = '.bin'):
+        self.directory = CACHE_ROOT / name
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the LRU order from file modification times."""
+        files = sorted(self.directory.glob(f'*{self.suffix}'), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._entries[path.stem] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f'{key}{self.suffix}'
+
+    def get(self, key: str) -> bytes | None:
+        """Return cached bytes for key, or None on a miss."""
+        # The lock covers only the index; the file is read without it so lookups do not queue
+        with self._lock:
+            if key not in self._entries:
+                return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # Touch the file so recency survives a restart
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another thread, or removed behind our back
+            with self._lock:
+                if key in self._entries and not path.exists():
+                    self._total_bytes -= self._entries.pop(key)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """Store bytes under key, evicting old entries if needed."""
+        if len(data) > self.max_bytes:
+            return
+        # Write to a temp file first so readers never see partial data
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            # Renaming under the lock keeps the file and its index entry in step with eviction
+            os.replace(tmp_path, self._path(key))
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._path(key).unlink(missing_ok=True)
+            self._total_bytes -= size
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache whose entries expire after ttl seconds.
+    Writers call invalidate(); readers pass the version() taken before their
+    read to put(), so a value read before an invalidation is never cached.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+
+    def version(self, key) -> int:
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def get(self, key):
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, version: int = None):
+        with self._lock:
+            if version is not None and self._versions.get(key, 0) != version:
+                # Invalidated while the caller was reading; drop the stale value
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
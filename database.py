@@ -1,7 +1,21 @@
-"""Database models and CRUD operations using SQLAlchemy."""
-from sqlalchemy import create_engine, Column, Integer, String
+"""Database models and an async repository API, with blocking wrappers for synchronous callers."""
+import os
+import json
+import time
+import asyncio
+import threading
+from functools import wraps
+from datetime import datetime, timedelta
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from sqlalchemy import event, make_url, select, Column, Integer, String, Text, DateTime, update, insert, delete, func
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from cache import TTLCache
+from metrics import DB_LATENCY, ERRORS, CREDIT_OPERATIONS, CREDITS_MOVED, EXECUTOR_QUEUE_DEPTH, CACHE_LOOKUPS
+
+load_dotenv()
 
 Base = declarative_base()
 
@@ -14,10 +28,164 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     credits = Column(Integer, default=5)
 
+class Job(Base):
+    """Background generation job, drained by the worker pool in jobs.py."""
+    __tablename__ = 'jobs'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    kind = Column(String, nullable=False)                     # 'image' or '3d'
+    status = Column(String, nullable=False, default='queued', index=True)  # queued, running, done, failed
+    params = Column(Text, default='{}')                       # JSON encoded job parameters
+    credit_cost = Column(Integer, default=0)
+    input_path = Column(String)
+    result_path = Column(String)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class CreditLedger(Base):
+    """
+    Append-only record of every credit change.
+    A 'reserve' row holds credits for a pending generation until a matching
+    'commit' or 'refund' row settles it.
+    """
+    __tablename__ = 'credit_ledger'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    kind = Column(String, nullable=False)           # signup, add, deduct, set, reserve, commit, refund
+    amount = Column(Integer, nullable=False)        # signed change applied to the balance
+    status = Column(String)                         # reserve rows only: held, committed, refunded
+    reservation_id = Column(Integer, index=True)    # commit/refund rows point at their reserve row
+    reason = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class SharedState(Base):
+    """JSON values shared by all app processes, e.g. sessions and workflows (see shared_state.py)."""
+    __tablename__ = 'shared_state'
+    
+    namespace = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    value = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 # Database setup
-engine = create_engine('sqlite:///sculptor.db', echo=False)
-Base.metadata.create_all(engine)
-SessionLocal = sessionmaker(bind=engine)
+# Any SQLAlchemy URL; plain driver names are mapped to their asyncio driver below
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///sculptor.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+ASYNC_DRIVERS = {
+    'sqlite': 'aiosqlite',
+    'postgresql': 'asyncpg',
+    'mysql': 'aiomysql',
+}
+
+def _async_url(url: str):
+    url = make_url(url)
+    if url.drivername in ASYNC_DRIVERS:
+        url = url.set(drivername=f'{url.drivername}+{ASYNC_DRIVERS[url.drivername]}')
+    return url
+
+def _create_engine(url: str):
+    url = _async_url(url)
+    is_sqlite = url.get_backend_name() == 'sqlite'
+    engine = create_async_engine(
+        url,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        # Server connections can be dropped while idle; SQLite files cannot
+        pool_pre_ping=not is_sqlite,
+        connect_args={'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000} if is_sqlite else {},
+    )
+    if is_sqlite:
+        event.listen(engine.sync_engine, 'connect', _configure_sqlite)
+    return engine
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    """WAL lets readers proceed during writes; busy_timeout waits instead of failing on locks."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+engine = _create_engine(DATABASE_URL)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+# Pooled async connections belong to the loop that opened them, so every query
+# runs on one dedicated database loop no matter which thread or loop asked for it
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='database', daemon=True).start()
+    return _loop
+
+def _on_db_loop(func):
+    """Make an async query function run on the database loop when awaited from anywhere."""
+    operation = func.__name__.removesuffix('_async')
+
+    async def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            ERRORS.inc(operation=f'db.{operation}', type=type(e).__name__)
+            raise
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - start, operation=operation)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = _get_loop()
+        if asyncio.get_running_loop() is loop:
+            return await timed(*args, **kwargs)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(timed(*args, **kwargs), loop))
+    return wrapper
+
+# Coroutines queued or running on the database loop
+EXECUTOR_QUEUE_DEPTH.set_function(lambda: len(asyncio.all_tasks(_loop)) if _loop else 0, executor='database')
+
+def _run(coro):
+    """Block the calling thread until a coroutine finishes on the database loop."""
+    loop = _get_loop()
+    if threading.current_thread().name == 'database':
+        coro.close()
+        raise RuntimeError('Blocking database call made from the database loop; await the _async variant')
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Read-only snapshot of the user fields needed on every page load."""
+    id: int
+    username: str
+    credits: int
+
+# Short-lived user rows; every credit write invalidates its entry
+user_cache = TTLCache(float(os.getenv('USER_CACHE_TTL', 5)))
+
+@_on_db_loop
+async def init_db_async():
+    """Create missing tables. Call once at startup."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+@_on_db_loop
+async def close_async():
+    """Close pooled connections; call on application shutdown."""
+    await engine.dispose()
 
 def get_db():
     """Get database session."""
@@ -27,69 +195,364 @@ def get_db():
     finally:
         pass
 
-def create_user(username: str, hashed_password: str) -> User:
+@_on_db_loop
+async def create_user_async(username: str, hashed_password: str) -> User:
     """Create a new user with 5 initial credits."""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         user = User(username=username, hashed_password=hashed_password, credits=5)
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.flush()
+        db.add(CreditLedger(user_id=user.id, kind='signup', amount=5))
+        await db.commit()
+        _count_credits('signup', True, 5)
         return user
-    finally:
-        db.close()
 
-def get_user(username: str) -> User:
+@_on_db_loop
+async def get_user_async(username: str) -> User:
     """Get user by username."""
-    db = SessionLocal()
-    try:
-        return db.query(User).filter(User.username == username).first()
-    finally:
-        db.close()
+    async with SessionLocal() as db:
+        return await db.scalar(select(User).where(User.username == username).limit(1))
 
-def get_user_by_id(user_id: int) -> User:
+@_on_db_loop
+async def get_user_by_id_async(user_id: int) -> User:
     """Get user by ID."""
-    db = SessionLocal()
-    try:
-        return db.query(User).filter(User.id == user_id).first()
-    finally:
-        db.close()
+    async with SessionLocal() as db:
+        return await db.get(User, user_id)
 
-def update_credits(user_id: int, credits: int) -> bool:
+@_on_db_loop
+async def update_password_hash_async(user_id: int, hashed_password: str) -> bool:
+    """Replace a user's stored password hash (used to upgrade the bcrypt cost)."""
+    async with SessionLocal() as db:
+        updated = (await db.execute(update(User).where(User.id == user_id).values(hashed_password=hashed_password))).rowcount
+        await db.commit()
+        return bool(updated)
+
+async def get_cached_user_async(user_id: int) -> CachedUser | None:
+    """Get a user snapshot by ID, served from user_cache when fresh."""
+    cached = user_cache.get(user_id)
+    CACHE_LOOKUPS.inc(cache='users', result='hit' if cached is not None else 'miss')
+    if cached is not None:
+        return cached
+    version = user_cache.version(user_id)
+    user = await get_user_by_id_async(user_id)
+    if user is None:
+        return None
+    snapshot = CachedUser(user.id, user.username, user.credits)
+    user_cache.put(user_id, snapshot, version)
+    return snapshot
+
+def _count_credits(operation: str, ok: bool, amount: int = 0):
+    CREDIT_OPERATIONS.inc(operation=operation, result='ok' if ok else 'rejected')
+    if ok and amount:
+        CREDITS_MOVED.inc(amount, operation=operation)
+
+async def _record(db, user_id: int, kind: str, amount: int, **fields) -> int:
+    """Append a ledger row inside the caller's transaction. Returns its ID."""
+    result = await db.execute(
+        insert(CreditLedger).values(user_id=user_id, kind=kind, amount=amount, created_at=datetime.utcnow(), **fields)
+    )
+    return result.inserted_primary_key[0]
+
+@_on_db_loop
+async def update_credits_async(user_id: int, credits: int) -> bool:
     """Update user credits."""
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
+    async with SessionLocal() as db:
+        user = await db.get(User, user_id)
         if user:
-            user.credits = credits
-            db.commit()
-            return True
+            await _record(db, user_id, 'set', credits - user.credits)
+            updated = (await db.execute(update(User).where(User.id == user_id).values(credits=credits))).rowcount
+            await db.commit()
+            user_cache.invalidate(user_id)
+            _count_credits('set', bool(updated), abs(credits - user.credits))
+            return bool(updated)
         return False
-    finally:
-        db.close()
 
-def add_credits(user_id: int, amount: int) -> bool:
+@_on_db_loop
+async def add_credits_async(user_id: int, amount: int, reason: str = None) -> bool:
     """Add credits to user account."""
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-        if user:
-            user.credits += amount
-            db.commit()
-            return True
-        return False
-    finally:
-        db.close()
+    async with SessionLocal() as db:
+        # Single-statement increment; no read-modify-write race
+        updated = (await db.execute(
+            update(User).where(User.id == user_id).values(credits=User.credits + amount)
+        )).rowcount
+        if updated:
+            await _record(db, user_id, 'add', amount, reason=reason)
+        await db.commit()
+        user_cache.invalidate(user_id)
+        _count_credits('add', bool(updated), amount)
+        return bool(updated)
 
-def deduct_credits(user_id: int, amount: int) -> bool:
+@_on_db_loop
+async def deduct_credits_async(user_id: int, amount: int, reason: str = None) -> bool:
     """Deduct credits from user account. Returns True if successful."""
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-        if user and user.credits >= amount:
-            user.credits -= amount
-            db.commit()
+    async with SessionLocal() as db:
+        # The balance check and the decrement happen in one conditional UPDATE
+        updated = (await db.execute(
+            update(User).where(User.id == user_id, User.credits >= amount).values(credits=User.credits - amount)
+        )).rowcount
+        if updated:
+            await _record(db, user_id, 'deduct', -amount, reason=reason)
+        await db.commit()
+        user_cache.invalidate(user_id)
+        _count_credits('deduct', bool(updated), amount)
+        return bool(updated)
+
+@_on_db_loop
+async def reserve_credits_async(user_id: int, amount: int, reason: str = None) -> int | None:
+    """
+    Take credits from the balance for a pending operation.
+    Returns a reservation ID to commit or refund later, or None if the user
+    cannot afford it.
+    """
+    async with SessionLocal() as db:
+        updated = (await db.execute(
+            update(User).where(User.id == user_id, User.credits >= amount).values(credits=User.credits - amount)
+        )).rowcount
+        if not updated:
+            await db.rollback()
+            _count_credits('reserve', False)
+            return None
+        reservation_id = await _record(db, user_id, 'reserve', -amount, status='held', reason=reason)
+        await db.commit()
+        user_cache.invalidate(user_id)
+        _count_credits('reserve', True, amount)
+        return reservation_id
+
+@_on_db_loop
+async def commit_reservation_async(reservation_id: int) -> bool:
+    """Settle a held reservation after the operation succeeded."""
+    async with SessionLocal() as db:
+        # Write first so the transaction takes the lock before reading
+        settled = (await db.execute(
+            update(CreditLedger)
+            .where(CreditLedger.id == reservation_id, CreditLedger.status == 'held')
+            .values(status='committed')
+        )).rowcount
+        if settled:
+            reservation = await db.get(CreditLedger, reservation_id)
+            await _record(db, reservation.user_id, 'commit', 0, reservation_id=reservation_id)
+        await db.commit()
+        _count_credits('commit', bool(settled), -reservation.amount if settled else 0)
+        return bool(settled)
+
+@_on_db_loop
+async def refund_reservation_async(reservation_id: int) -> bool:
+    """Return held credits after the operation failed. Refunds at most once."""
+    async with SessionLocal() as db:
+        # Write first so the transaction takes the lock before reading
+        settled = (await db.execute(
+            update(CreditLedger)
+            .where(CreditLedger.id == reservation_id, CreditLedger.status == 'held')
+            .values(status='refunded')
+        )).rowcount
+        if settled:
+            reservation = await db.get(CreditLedger, reservation_id)
+            refund = -reservation.amount
+            await db.execute(update(User).where(User.id == reservation.user_id).values(credits=User.credits + refund))
+            await _record(db, reservation.user_id, 'refund', refund, reservation_id=reservation_id)
+        await db.commit()
+        if settled:
+            user_cache.invalidate(reservation.user_id)
+        _count_credits('refund', bool(settled), refund if settled else 0)
+        return bool(settled)
+
+@_on_db_loop
+async def create_job_async(user_id: int, kind: str, params: str, credit_cost: int, input_path: str = None) -> Job:
+    """Create a queued job."""
+    async with SessionLocal() as db:
+        job = Job(user_id=user_id, kind=kind, params=params, credit_cost=credit_cost, input_path=input_path)
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        return job
+
+@_on_db_loop
+async def get_job_async(job_id: int) -> Job:
+    """Get job by ID."""
+    async with SessionLocal() as db:
+        return await db.get(Job, job_id)
+
+@_on_db_loop
+async def get_latest_job_async(user_id: int, kind: str) -> Job:
+    """Get the most recently created job of a kind for a user."""
+    async with SessionLocal() as db:
+        return await db.scalar(
+            select(Job).where(Job.user_id == user_id, Job.kind == kind).order_by(Job.id.desc()).limit(1)
+        )
+
+@_on_db_loop
+async def claim_next_job_async(max_per_user: int = None) -> Job:
+    """
+    Atomically move the oldest queued job to running.
+    With max_per_user, jobs of users who already have that many running are
+    skipped, so one large batch cannot take every worker. Concurrent claims
+    can overshoot the limit slightly; it is a fairness cap, not a quota.
+    Returns the claimed job, or None if nothing can be claimed.
+    """
+    query = select(Job).where(Job.status == 'queued')
+    if max_per_user:
+        running = aliased(Job)
+        running_count = (
+            select(func.count()).select_from(running)
+            .where(running.user_id == Job.user_id, running.status == 'running')
+            .scalar_subquery()
+        )
+        query = query.where(running_count < max_per_user)
+    query = query.order_by(Job.id).limit(1)
+    async with SessionLocal() as db:
+        while True:
+            job = await db.scalar(query)
+            if not job:
+                return None
+            # Conditional update so two workers can never claim the same job
+            claimed = (await db.execute(
+                update(Job)
+                .where(Job.id == job.id, Job.status == 'queued')
+                .values(status='running', updated_at=datetime.utcnow())
+            )).rowcount
+            await db.commit()
+            if claimed:
+                await db.refresh(job)
+                return job
+
+@_on_db_loop
+async def finish_job_async(job_id: int, status: str, result_path: str = None, error: str = None, details: dict = None) -> bool:
+    """Mark a job as done or failed. details are merged into the job's params, e.g. an optimization report."""
+    async with SessionLocal() as db:
+        job = await db.get(Job, job_id)
+        if job:
+            job.status = status
+            job.result_path = result_path
+            job.error = error
+            if details:
+                job.params = json.dumps({**json.loads(job.params or '{}'), **details})
+            job.updated_at = datetime.utcnow()
+            await db.commit()
             return True
         return False
-    finally:
-        db.close()
+
+@_on_db_loop
+async def count_jobs_async(status: str) -> int:
+    """Number of jobs in a status, e.g. the queue depth for 'queued'."""
+    async with SessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(Job).where(Job.status == status))
+
+@_on_db_loop
+async def renew_job_leases_async(job_ids: list[int]) -> int:
+    """
+    Stamp running jobs as still being worked on. updated_at doubles as the
+    lease, so other processes leave these jobs alone. Returns the count renewed.
+    """
+    if not job_ids:
+        return 0
+    async with SessionLocal() as db:
+        count = (await db.execute(
+            update(Job).where(Job.id.in_(job_ids), Job.status == 'running').values(updated_at=datetime.utcnow())
+        )).rowcount
+        await db.commit()
+        return count
+
+@_on_db_loop
+async def requeue_running_jobs_async(lease_seconds: float) -> int:
+    """
+    Put running jobs whose lease expired, i.e. not renewed for lease_seconds,
+    back in the queue. Their worker died or was restarted. Returns the count.
+    """
+    expired = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    async with SessionLocal() as db:
+        count = (await db.execute(
+            update(Job)
+            .where(Job.status == 'running', Job.updated_at < expired)
+            .values(status='queued', updated_at=datetime.utcnow())
+        )).rowcount
+        await db.commit()
+        return count
+
+@_on_db_loop
+async def get_shared_state_async(namespace: str, key: str) -> str | None:
+    """Get a shared JSON value, or None if it is not set."""
+    async with SessionLocal() as db:
+        state = await db.get(SharedState, (namespace, key))
+        return state.value if state else None
+
+@_on_db_loop
+async def put_shared_states_async(values: dict[tuple[str, str], str | None]) -> int:
+    """
+    Write several shared values in one transaction.
+    values maps (namespace, key) to a JSON string, or None to delete the key.
+    """
+    async with SessionLocal() as db:
+        now = datetime.utcnow()
+        for (namespace, key), value in values.items():
+            where = (SharedState.namespace == namespace, SharedState.key == key)
+            if value is None:
+                await db.execute(delete(SharedState).where(*where))
+                continue
+            # Write first so the transaction takes the lock before deciding to insert
+            updated = (await db.execute(update(SharedState).where(*where).values(value=value, updated_at=now))).rowcount
+            if not updated:
+                await db.execute(insert(SharedState).values(namespace=namespace, key=key, value=value, updated_at=now))
+        await db.commit()
+        return len(values)
+
+# Blocking wrappers for threads and scripts without an event loop
+
+def init_db():
+    _run(init_db_async())
+
+def create_user(username: str, hashed_password: str) -> User:
+    return _run(create_user_async(username, hashed_password))
+
+def get_user(username: str) -> User:
+    return _run(get_user_async(username))
+
+def get_user_by_id(user_id: int) -> User:
+    return _run(get_user_by_id_async(user_id))
+
+def update_password_hash(user_id: int, hashed_password: str) -> bool:
+    return _run(update_password_hash_async(user_id, hashed_password))
+
+def get_cached_user(user_id: int) -> CachedUser | None:
+    return _run(get_cached_user_async(user_id))
+
+def update_credits(user_id: int, credits: int) -> bool:
+    return _run(update_credits_async(user_id, credits))
+
+def add_credits(user_id: int, amount: int, reason: str = None) -> bool:
+    return _run(add_credits_async(user_id, amount, reason))
+
+def deduct_credits(user_id: int, amount: int, reason: str = None) -> bool:
+    return _run(deduct_credits_async(user_id, amount, reason))
+
+def reserve_credits(user_id: int, amount: int, reason: str = None) -> int | None:
+    return _run(reserve_credits_async(user_id, amount, reason))
+
+def commit_reservation(reservation_id: int) -> bool:
+    return _run(commit_reservation_async(reservation_id))
+
+def refund_reservation(reservation_id: int) -> bool:
+    return _run(refund_reservation_async(reservation_id))
+
+def create_job(user_id: int, kind: str, params: str, credit_cost: int, input_path: str = None) -> Job:
+    return _run(create_job_async(user_id, kind, params, credit_cost, input_path))
+
+def get_job(job_id: int) -> Job:
+    return _run(get_job_async(job_id))
+
+def get_latest_job(user_id: int, kind: str) -> Job:
+    return _run(get_latest_job_async(user_id, kind))
+
+def claim_next_job(max_per_user: int = None) -> Job:
+    return _run(claim_next_job_async(max_per_user))
+
+def finish_job(job_id: int, status: str, result_path: str = None, error: str = None, details: dict = None) -> bool:
+    return _run(finish_job_async(job_id, status, result_path, error, details))
+
+def count_jobs(status: str) -> int:
+    return _run(count_jobs_async(status))
+
+def renew_job_leases(job_ids: list[int]) -> int:
+    return _run(renew_job_leases_async(job_ids))
+
+def requeue_running_jobs(lease_seconds: float) -> int:
+    return _run(requeue_running_jobs_async(lease_seconds))
@@ -0,0 +1,392 @@
+"""GLB post-processing: vertex dedup, quantization, index reordering and repacking."""
+import sys
+import json
+import struct
+import numpy as np
+
+GLB_MAGIC = 0x46546C67
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+FLOAT, BYTE, UNSIGNED_BYTE, SHORT, UNSIGNED_SHORT, UNSIGNED_INT = 5126, 5120, 5121, 5122, 5123, 5125
+COMPONENT_DTYPES = {
+    BYTE: np.int8,
+    UNSIGNED_BYTE: np.uint8,
+    SHORT: np.int16,
+    UNSIGNED_SHORT: np.uint16,
+    UNSIGNED_INT: np.uint32,
+    FLOAT: np.float32,
+}
+TYPE_SIZES = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+TYPE_NAMES = {1: 'SCALAR', 2: 'VEC2', 3: 'VEC3', 4: 'VEC4'}
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+
+# Files using these already have custom geometry encodings we must not touch
+UNSUPPORTED_EXTENSIONS = {
+    'KHR_draco_mesh_compression',
+    'EXT_meshopt_compression',
+    'EXT_mesh_gpu_instancing',
+    'KHR_mesh_quantization',
+}
+
+def parse_glb(data: bytes) -> tuple[dict, bytes]:
+    """Split a GLB file into its JSON document and binary chunk."""
+    magic, version, length = struct.unpack_from('<III', data, 0)
+    if magic != GLB_MAGIC or version != 2:
+        raise ValueError('Not a glTF 2.0 binary file')
+    offset = 12
+    gltf, bin_chunk = None, b''
+    while offset < length:
+        chunk_length, chunk_type = struct.unpack_from('<II', data, offset)
+        chunk = data[offset + 8:offset + 8 + chunk_length]
+        if chunk_type == CHUNK_JSON:
+            gltf = json.loads(chunk)
+        elif chunk_type == CHUNK_BIN and not bin_chunk:
+            bin_chunk = chunk
+        offset += 8 + chunk_length
+    if gltf is None:
+        raise ValueError('GLB has no JSON chunk')
+    return gltf, bin_chunk
+
+def build_glb(gltf: dict, bin_chunk: bytes) -> bytes:
+    """Assemble a GLB file from a JSON document and binary chunk."""
+    json_bytes = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    json_bytes += b' ' * (-len(json_bytes) % 4)
+    bin_chunk += b'\x00' * (-len(bin_chunk) % 4)
+    length = 12 + 8 + len(json_bytes) + (8 + len(bin_chunk) if bin_chunk else 0)
+    parts = [struct.pack('<III', GLB_MAGIC, 2, length), struct.pack('<II', len(json_bytes), CHUNK_JSON), json_bytes]
+    if bin_chunk:
+        parts += [struct.pack('<II', len(bin_chunk), CHUNK_BIN), bin_chunk]
+    return b''.join(parts)
+
+def read_accessor(gltf: dict, bin_chunk: bytes, index: int) -> np.ndarray:
+    """Read an accessor as a (count, components) array, dequantized to float32 if normalized."""
+    accessor = gltf['accessors'][index]
+    dtype = np.dtype(COMPONENT_DTYPES[accessor['componentType']])
+    components = TYPE_SIZES[accessor['type']]
+    count = accessor['count']
+    view = gltf['bufferViews'][accessor['bufferView']]
+    offset = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    stride = view.get('byteStride', dtype.itemsize * components)
+    array = np.ndarray((count, components), dtype=dtype, buffer=bin_chunk, offset=offset,
+                       strides=(stride, dtype.itemsize)).copy()
+    if accessor.get('normalized'):
+        info = np.iinfo(dtype)
+        array = np.maximum(array.astype(np.float32) / info.max, -1.0)
+    return array
+
+def _morton_order(points: np.ndarray) -> np.ndarray:
+    """Return the permutation that sorts points along a 3D Z-order curve."""
+    low, high = points.min(axis=0), points.max(axis=0)
+    grid = ((points - low) / np.maximum(high - low, 1e-12) * 1023).astype(np.uint32)
+
+    def spread_bits(v):
+        v = (v | (v << 16)) & 0x030000FF
+        v = (v | (v << 8)) & 0x0300F00F
+        v = (v | (v << 4)) & 0x030C30C3
+        return (v | (v << 2)) & 0x09249249
+
+    codes = spread_bits(grid[:, 0]) | (spread_bits(grid[:, 1]) << 1) | (spread_bits(grid[:, 2]) << 2)
+    return np.argsort(codes, kind='stable')
+
+def _rotate(quaternion: list, vector: np.ndarray) -> np.ndarray:
+    u, w = np.array(quaternion[:3], dtype=np.float64), quaternion[3]
+    return vector + 2 * w * np.cross(u, vector) + 2 * np.cross(u, np.cross(u, vector))
+
+class _Packer:
+    """Accumulates buffer views in a fresh binary chunk."""
+
+    def __init__(self):
+        self.parts = []
+        self.payloads = []
+        self.length = 0
+        self.views = []
+
+    def add(self, data: bytes, target: int = None, stride: int = None) -> int:
+        padding = -self.length % 4
+        if padding:
+            self.parts.append(b'\x00' * padding)
+            self.length += padding
+        view = {'buffer': 0, 'byteOffset': self.length, 'byteLength': len(data)}
+        if target:
+            view['target'] = target
+        if stride:
+            view['byteStride'] = stride
+        self.parts.append(data)
+        self.payloads.append(data)
+        self.length += len(data)
+        self.views.append(view)
+        return len(self.views) - 1
+
+    def add_vertex_attribute(self, array: np.ndarray) -> int:
+        """Add a vertex attribute, padding each element to a 4-byte boundary."""
+        element_size = array.dtype.itemsize * array.shape[1]
+        padded_size = element_size + (-element_size % 4)
+        if padded_size != element_size:
+            padded = np.zeros((array.shape[0], padded_size // array.dtype.itemsize), dtype=array.dtype)
+            padded[:, :array.shape[1]] = array
+            return self.add(padded.tobytes(), ARRAY_BUFFER, padded_size)
+        return self.add(np.ascontiguousarray(array).tobytes(), ARRAY_BUFFER, element_size)
+
+def _quantize_attribute(name: str, values: np.ndarray, position_transform: tuple) -> tuple[np.ndarray, dict]:
+    """Return (encoded array, accessor fields) for one vertex attribute."""
+    if name == 'POSITION' and position_transform is not None:
+        center, scale = position_transform
+        encoded = np.clip(np.rint((values - center) / scale), -32767, 32767).astype(np.int16)
+        return encoded, {'componentType': SHORT}
+    if name == 'NORMAL':
+        lengths = np.linalg.norm(values, axis=1, keepdims=True)
+        unit = values / np.where(lengths > 0, lengths, 1)
+        return np.rint(unit * 127).astype(np.int8), {'componentType': BYTE, 'normalized': True}
+    if name.startswith('TEXCOORD_') and values.size and values.min() >= 0 and values.max() <= 1:
+        return np.rint(values * 65535).astype(np.uint16), {'componentType': UNSIGNED_SHORT, 'normalized': True}
+    return values.astype(np.float32), {'componentType': FLOAT}
+
+def _is_optimizable(primitive: dict, accessors: list) -> bool:
+    """Plain indexed or unindexed triangle lists without skinning, morphs or sparse data."""
+    if primitive.get('mode', 4) != 4 or 'targets' in primitive or 'extensions' in primitive:
+        return False
+    if any(name.startswith(('JOINTS_', 'WEIGHTS_')) for name in primitive['attributes']):
+        return False
+    used = list(primitive['attributes'].values())
+    if 'indices' in primitive:
+        used.append(primitive['indices'])
+    return all('sparse' not in accessors[index] and 'bufferView' in accessors[index] for index in used)
+
+def _mesh_nodes(gltf: dict, mesh_index: int) -> list[dict]:
+    return [node for node in gltf.get('nodes', []) if node.get('mesh') == mesh_index]
+
+def _can_move_node_transform(nodes: list[dict]) -> bool:
+    """Positions can only be rescaled through node transforms that affect nothing else."""
+    return bool(nodes) and all(not node.get('children') and 'skin' not in node for node in nodes)
+
+def _apply_dequantization(node: dict, center: np.ndarray, scale: float):
+    """Fold the position dequantization (scale, then translate by center) into a node transform."""
+    if 'matrix' in node:
+        matrix = np.array(node['matrix'], dtype=np.float64).reshape(4, 4).T
+        dequantize = np.eye(4)
+        dequantize[:3, :3] *= scale
+        dequantize[:3, 3] = center
+        node['matrix'] = (matrix @ dequantize).T.flatten().tolist()
+        return
+    node_scale = np.array(node.get('scale', [1.0, 1.0, 1.0]), dtype=np.float64)
+    rotation = node.get('rotation', [0.0, 0.0, 0.0, 1.0])
+    translation = np.array(node.get('translation', [0.0, 0.0, 0.0]), dtype=np.float64)
+    node['translation'] = (translation + _rotate(rotation, node_scale * center)).tolist()
+    node['scale'] = (node_scale * scale).tolist()
+
+def optimize_glb(data: bytes, quantize: bool = True) -> tuple[bytes, dict]:
+    """
+    Deduplicate vertices, optionally quantize attributes (KHR_mesh_quantization),
+    reorder triangles and vertices for cache locality and repack the buffer.
+
+    Returns (optimized GLB bytes, report). The input is returned unchanged
+    when it uses features this optimizer does not handle.
+    """
+    gltf, bin_chunk = parse_glb(data)
+    report = {'original_bytes': len(data), 'optimized_bytes': len(data), 'vertices_before': 0,
+              'vertices_after': 0, 'triangles': 0, 'skipped': None}
+
+    used_extensions = set(gltf.get('extensionsUsed', []))
+    if used_extensions & UNSUPPORTED_EXTENSIONS:
+        report['skipped'] = f'unsupported extensions: {sorted(used_extensions & UNSUPPORTED_EXTENSIONS)}'
+        return data, report
+    if len(gltf.get('buffers', [])) != 1 or 'uri' in gltf['buffers'][0]:
+        report['skipped'] = 'external or multiple buffers'
+        return data, report
+
+    accessors = gltf.setdefault('accessors', [])
+    packer = _Packer()
+    new_view_owner = {}       # new accessor index -> new view index (in packer)
+    quantized_any = False
+
+    for mesh_index, mesh in enumerate(gltf.get('meshes', [])):
+        primitives = [p for p in mesh['primitives'] if _is_optimizable(p, accessors)]
+        if not primitives:
+            continue
+
+        # One dequantization transform per mesh, since it lives on the mesh's nodes
+        nodes = _mesh_nodes(gltf, mesh_index)
+        position_transform = None
+        if quantize and _can_move_node_transform(nodes) and len(primitives) == len(mesh['primitives']):
+            positions = [read_accessor(gltf, bin_chunk, p['attributes']['POSITION']) for p in primitives if 'POSITION' in p['attributes']]
+            if positions:
+                stacked = np.concatenate(positions).astype(np.float64)
+                low, high = stacked.min(axis=0), stacked.max(axis=0)
+                center = (low + high) / 2
+                scale = float((high - low).max()) / 2 / 32767 or 1.0
+                position_transform = (center, scale)
+
+        for primitive in primitives:
+            attributes = {name: read_accessor(gltf, bin_chunk, index) for name, index in primitive['attributes'].items()}
+            vertex_count = next(iter(attributes.values())).shape[0]
+            if 'indices' in primitive:
+                indices = read_accessor(gltf, bin_chunk, primitive['indices']).reshape(-1).astype(np.int64)
+            else:
+                indices = np.arange(vertex_count, dtype=np.int64)
+            triangles = indices[:len(indices) - len(indices) % 3].reshape(-1, 3)
+            report['vertices_before'] += vertex_count
+
+            # Encode first so vertices that quantize identically are merged
+            encoded, fields = {}, {}
+            for name, values in attributes.items():
+                if quantize:
+                    encoded[name], fields[name] = _quantize_attribute(name, values, position_transform)
+                else:
+                    encoded[name], fields[name] = values.astype(np.float32), {'componentType': FLOAT}
+
+            # Dedup: one row of raw bytes per vertex, unique rows win
+            names = sorted(encoded)
+            rows = np.concatenate([encoded[name].view(np.uint8).reshape(vertex_count, -1) for name in names], axis=1)
+            keys = np.ascontiguousarray(rows).view(np.dtype((np.void, rows.shape[1]))).reshape(-1)
+            _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            triangles = inverse.reshape(-1)[triangles]
+            encoded = {name: array[first_index] for name, array in encoded.items()}
+            attributes_float = attributes['POSITION'][first_index] if 'POSITION' in attributes else None
+
+            # Drop triangles that collapsed to a line or point
+            keep = (triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & (triangles[:, 0] != triangles[:, 2])
+            triangles = triangles[keep]
+
+            # Spatially coherent triangle order, then vertices in order of first use
+            if attributes_float is not None and len(triangles):
+                centroids = attributes_float[triangles].mean(axis=1)
+                triangles = triangles[_morton_order(centroids)]
+            flat = triangles.reshape(-1)
+            used, first_use = np.unique(flat, return_index=True)
+            vertex_order = used[np.argsort(first_use, kind='stable')]
+            remap = np.empty(len(first_index), dtype=np.int64)
+            remap[vertex_order] = np.arange(len(vertex_order))
+            flat = remap[flat]
+            encoded = {name: array[vertex_order] for name, array in encoded.items()}
+            new_vertex_count = len(vertex_order)
+            report['vertices_after'] += new_vertex_count
+            report['triangles'] += len(triangles)
+
+            # Write attribute accessors
+            for name in names:
+                array = encoded[name]
+                view_index = packer.add_vertex_attribute(array)
+                accessor = {'bufferView': view_index, 'count': new_vertex_count, 'type': TYPE_NAMES[array.shape[1]]}
+                accessor.update(fields[name])
+                if name == 'POSITION' and new_vertex_count:
+                    accessor['min'] = array.min(axis=0).tolist()
+                    accessor['max'] = array.max(axis=0).tolist()
+                accessors.append(accessor)
+                new_view_owner[len(accessors) - 1] = view_index
+                primitive['attributes'][name] = len(accessors) - 1
+
+            # Smallest index type that fits
+            index_dtype, component_type = (np.uint16, UNSIGNED_SHORT) if new_vertex_count < 65536 else (np.uint32, UNSIGNED_INT)
+            view_index = packer.add(flat.astype(index_dtype).tobytes(), ELEMENT_ARRAY_BUFFER)
+            accessors.append({'bufferView': view_index, 'componentType': component_type, 'count': len(flat), 'type': 'SCALAR'})
+            new_view_owner[len(accessors) - 1] = view_index
+            primitive['indices'] = len(accessors) - 1
+
+        if position_transform is not None:
+            for node in nodes:
+                _apply_dequantization(node, *position_transform)
+        quantized_any = quantized_any or quantize
+
+    # Garbage-collect accessors no longer referenced
+    referenced = set()
+    for mesh in gltf.get('meshes', []):
+        for primitive in mesh['primitives']:
+            referenced.update(primitive['attributes'].values())
+            if 'indices' in primitive:
+                referenced.add(primitive['indices'])
+            for target in primitive.get('targets', []):
+                referenced.update(target.values())
+    for skin in gltf.get('skins', []):
+        if 'inverseBindMatrices' in skin:
+            referenced.add(skin['inverseBindMatrices'])
+    for animation in gltf.get('animations', []):
+        for sampler in animation['samplers']:
+            referenced.update((sampler['input'], sampler['output']))
+    accessor_map = {old: new for new, old in enumerate(sorted(referenced))}
+    old_accessors = accessors
+    gltf['accessors'] = [old_accessors[old] for old in sorted(referenced)]
+    for mesh in gltf.get('meshes', []):
+        for primitive in mesh['primitives']:
+            primitive['attributes'] = {name: accessor_map[index] for name, index in primitive['attributes'].items()}
+            if 'indices' in primitive:
+                primitive['indices'] = accessor_map[primitive['indices']]
+            for target in primitive.get('targets', []):
+                for name in target:
+                    target[name] = accessor_map[target[name]]
+    for skin in gltf.get('skins', []):
+        if 'inverseBindMatrices' in skin:
+            skin['inverseBindMatrices'] = accessor_map[skin['inverseBindMatrices']]
+    for animation in gltf.get('animations', []):
+        for sampler in animation['samplers']:
+            sampler['input'] = accessor_map[sampler['input']]
+            sampler['output'] = accessor_map[sampler['output']]
+
+    # Repack: copy surviving old views (textures, untouched accessors), then the new ones
+    old_views = gltf.get('bufferViews', [])
+    final = _Packer()
+    old_view_map = {}
+
+    def copy_old_view(index):
+        if index not in old_view_map:
+            view = old_views[index]
+            start = view.get('byteOffset', 0)
+            new_index = final.add(bin_chunk[start:start + view['byteLength']], view.get('target'), view.get('byteStride'))
+            old_view_map[index] = new_index
+        return old_view_map[index]
+
+    new_view_map = {}
+    for new_index, old_index in enumerate(sorted(referenced)):
+        accessor = gltf['accessors'][new_index]
+        if old_index in new_view_owner:
+            packed_index = new_view_owner[old_index]
+            if packed_index not in new_view_map:
+                view = packer.views[packed_index]
+                new_view_map[packed_index] = final.add(packer.payloads[packed_index], view.get('target'), view.get('byteStride'))
+            accessor['bufferView'] = new_view_map[packed_index]
+        else:
+            if 'bufferView' in accessor:
+                accessor['bufferView'] = copy_old_view(accessor['bufferView'])
+            sparse = accessor.get('sparse')
+            if sparse:
+                sparse['indices']['bufferView'] = copy_old_view(sparse['indices']['bufferView'])
+                sparse['values']['bufferView'] = copy_old_view(sparse['values']['bufferView'])
+    for image in gltf.get('images', []):
+        if 'bufferView' in image:
+            image['bufferView'] = copy_old_view(image['bufferView'])
+
+    gltf['bufferViews'] = final.views
+    new_bin = b''.join(final.parts)
+    gltf['buffers'][0]['byteLength'] = len(new_bin)
+    if not gltf['bufferViews']:
+        del gltf['bufferViews']
+
+    # Quantized normals and positions are only valid with KHR_mesh_quantization
+    if quantized_any:
+        for key in ('extensionsUsed', 'extensionsRequired'):
+            extensions = gltf.setdefault(key, [])
+            if 'KHR_mesh_quantization' not in extensions:
+                extensions.append('KHR_mesh_quantization')
+
+    optimized = build_glb(gltf, new_bin)
+    report['optimized_bytes'] = len(optimized)
+    return optimized, report
+
+def format_report(report: dict) -> str:
+    """One-line human readable summary of an optimize_glb report."""
+    if report.get('skipped'):
+        return f"GLB optimization skipped ({report['skipped']})"
+    saved = report['original_bytes'] - report['optimized_bytes']
+    percent = saved / report['original_bytes'] * 100 if report['original_bytes'] else 0
+    return (f"GLB optimized: {report['original_bytes'] / 1024:.1f} KB -> {report['optimized_bytes'] / 1024:.1f} KB "
+            f"({percent:.1f}% smaller), vertices {report['vertices_before']} -> {report['vertices_after']}")
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python glb_optimizer.py input.glb output.glb')
+        sys.exit(1)
+    with open(sys.argv[1], 'rb') as f:
+        optimized, report = optimize_glb(f.read())
+    with open(sys.argv[2], 'wb') as f:
+        f.write(optimized)
+    print(format_report(report))
@@ -0,0 +1,120 @@
+"""Shared pooled HTTP clients for provider API calls."""
+import os
+import asyncio
+import threading
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from resilience import ProviderGuard
+
+load_dotenv()
+
+# Connection pool sizing (shared by all providers)
+POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 20))
+KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30))
+
+# Per-endpoint request timeouts in seconds; the adaptive timeout never exceeds these
+ENDPOINT_TIMEOUTS = {
+    'together': float(os.getenv('TOGETHER_TIMEOUT', 30)),
+    'stability': float(os.getenv('STABILITY_TIMEOUT', 120)),
+    'openai': float(os.getenv('OPENAI_TIMEOUT', 120)),
+}
+# Streamed calls answer with headers long before the body ends, so they get their own latency history
+ENDPOINT_TIMEOUTS['together-stream'] = ENDPOINT_TIMEOUTS['together']
+# Only these may be retried after a read timeout and get adaptive timeouts;
+# image and 3D generations are billed per request
+IDEMPOTENT_ENDPOINTS = frozenset(('together', 'together-stream'))
+DEFAULT_TIMEOUT = float(os.getenv('HTTP_DEFAULT_TIMEOUT', 60))
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+
+_session = None
+_session_lock = threading.Lock()
+# httpx clients cannot be shared across event loops, so each loop gets its own;
+# a loop's entry goes away with the loop
+_async_clients = weakref.WeakKeyDictionary()
+_guards = {}
+
+def get_timeout(endpoint: str) -> float:
+    """Return the configured read timeout for a named endpoint."""
+    return ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+
+def get_guard(endpoint: str) -> ProviderGuard:
+    """Return the retry, circuit breaker and timeout policy for a named endpoint."""
+    guard = _guards.get(endpoint)
+    if guard is None:
+        with _session_lock:
+            guard = _guards.setdefault(endpoint, ProviderGuard(
+                endpoint, get_timeout(endpoint), idempotent=endpoint in IDEMPOTENT_ENDPOINTS
+            ))
+    return guard
+
+def get_session() -> requests.Session:
+    """Return the process-wide keep-alive session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the pooled async client bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=POOL_MAXSIZE,
+                max_keepalive_connections=POOL_MAXSIZE,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            )
+        )
+    return client
+
+def post(endpoint: str, url: str, **kwargs) -> requests.Response:
+    """
+    POST through the shared session.
+    endpoint names the provider so its retry policy and timeout can be applied.
+    """
+    def attempt(timeout):
+        return get_session().post(url, timeout=(CONNECT_TIMEOUT, timeout), **kwargs)
+    return get_guard(endpoint).call(attempt)
+
+async def async_post(endpoint: str, url: str, hedge: bool = False, **kwargs) -> httpx.Response:
+    """
+    Async counterpart of post() that can be awaited from UI handlers.
+    Pass hedge=True for idempotent requests to race a second attempt against a slow first one.
+    """
+    def attempt(timeout):
+        return get_async_client().post(url, timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT), **kwargs)
+    return await get_guard(endpoint).call_async(attempt, hedge=hedge)
+
+async def async_post_stream(endpoint: str, url: str, **kwargs) -> httpx.Response:
+    """
+    POST and return as soon as the response headers arrive, with the body
+    left to stream. Only connecting and the status are retried; the caller
+    must close the response with aclose().
+    """
+    async def attempt(timeout):
+        client = get_async_client()
+        request = client.build_request('POST', url, timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT), **kwargs)
+        response = await client.send(request, stream=True)
+        if response.status_code != 200:
+            # Read the error body now so the connection is released before any retry
+            await response.aread()
+            await response.aclose()
+        return response
+    return await get_guard(endpoint).call_async(attempt)
+
+async def aclose():
+    """Close the running loop's async client; call before the loop shuts down."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
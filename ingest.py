@@ -0,0 +1,190 @@
+"""Streaming, size-bounded ingestion of uploaded text documents."""
+import os
+import re
+import codecs
+import hashlib
+import asyncio
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Iterator
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_FILE_BYTES = int(float(os.getenv('INGEST_MAX_FILE_MB', 20)) * 1024 * 1024)
+MAX_SESSION_BYTES = int(float(os.getenv('INGEST_MAX_SESSION_MB', 50)) * 1024 * 1024)
+SPOOL_THRESHOLD = int(os.getenv('INGEST_SPOOL_KB', 256)) * 1024
+SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR') or None
+READ_BLOCK_CHARS = 64 * 1024
+
+_INLINE_SPACE = re.compile(r'[ \t\f\v\r]+')
+_SPACE_AROUND_NEWLINE = re.compile(r' ?\n ?')
+_BLANK_LINES = re.compile(r'\n{3,}')
+
+class IngestError(Exception):
+    """Raised when an upload breaks a size limit or cannot be decoded."""
+
+def normalize_whitespace(text: str) -> str:
+    """Collapse runs of spaces and keep at most one blank line between paragraphs."""
+    text = _INLINE_SPACE.sub(' ', text)
+    text = _SPACE_AROUND_NEWLINE.sub('\n', text)
+    return _BLANK_LINES.sub('\n\n', text)
+
+def iter_chunks(pieces: Iterable[str], chunk_chars: int, overlap_chars: int = 0) -> Iterator[str]:
+    """Re-cut a stream of text pieces into overlapping chunks of at most chunk_chars."""
+    overlap_chars = min(overlap_chars, chunk_chars // 2)
+    buffer = ''
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= chunk_chars:
+            # Cut on the last whitespace so words stay whole
+            cut = max(buffer.rfind(' ', 0, chunk_chars), buffer.rfind('\n', 0, chunk_chars))
+            if cut <= overlap_chars:
+                cut = chunk_chars
+            yield buffer[:cut]
+            start = cut - overlap_chars
+            if overlap_chars:
+                # Start the overlap on a word boundary
+                boundary = buffer.find(' ', start, cut)
+                start = boundary + 1 if boundary != -1 else start
+            buffer = buffer[start:]
+    if buffer.strip():
+        yield buffer
+
+class Document:
+    """An ingested document whose normalized text is in memory or spooled to disk."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.raw_bytes = 0
+        self.text_chars = 0
+        self._parts = []
+        self._buffered_chars = 0
+        self._spool = None
+        self._hash = hashlib.sha256()
+        self.path = None
+        # SHA-256 of the normalized text, set once ingestion finishes
+        self.digest = None
+
+    @property
+    def spooled(self) -> bool:
+        return self.path is not None
+
+    def _write(self, text: str):
+        if not text:
+            return
+        self.text_chars += len(text)
+        self._hash.update(text.encode('utf-8'))
+        if self._spool is None:
+            self._parts.append(text)
+            self._buffered_chars += len(text)
+            if self._buffered_chars > SPOOL_THRESHOLD:
+                # Too big to keep resident; move what we have to a temp file
+                fd, path = tempfile.mkstemp(prefix='sculptor-doc-', suffix='.txt', dir=SPOOL_DIR)
+                self._spool = os.fdopen(fd, 'w', encoding='utf-8')
+                self.path = Path(path)
+                self._spool.write(''.join(self._parts))
+                self._parts = []
+        else:
+            self._spool.write(text)
+
+    def _finish(self):
+        self.digest = self._hash.hexdigest()
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        else:
+            self._parts = [''.join(self._parts)]
+
+    def iter_text(self, block_chars: int = READ_BLOCK_CHARS) -> Iterator[str]:
+        """Yield the normalized text in blocks without loading it all."""
+        if self.path is None:
+            yield from self._parts
+            return
+        with open(self.path, encoding='utf-8') as f:
+            while block := f.read(block_chars):
+                yield block
+
+    def iter_chunks(self, chunk_chars: int, overlap_chars: int = 0) -> Iterator[str]:
+        """Yield overlapping chunks of this document alone."""
+        return iter_chunks(self.iter_text(), chunk_chars, overlap_chars)
+
+    def discard(self):
+        """Release memory and delete any spool file."""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
+        self._parts = []
+
+class DocumentStore:
+    """
+    Per-session collection of uploaded documents.
+    Enforces per-file and per-session byte limits while streaming.
+    """
+
+    def __init__(self, max_file_bytes: int = MAX_FILE_BYTES, max_session_bytes: int = MAX_SESSION_BYTES):
+        self.max_file_bytes = max_file_bytes
+        self.max_session_bytes = max_session_bytes
+        self.documents = []
+        self.total_bytes = 0
+
+    async def add(self, name: str, chunks: AsyncIterator[bytes], encoding: str = 'utf-8') -> Document:
+        """Decode, normalize and store an upload from an async byte iterator."""
+        document = Document(name)
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        # Trailing whitespace is held back so runs spanning two chunks collapse correctly
+        pending = ''
+        leading = True
+        try:
+            async for chunk in chunks:
+                document.raw_bytes += len(chunk)
+                if document.raw_bytes > self.max_file_bytes:
+                    raise IngestError(f'{name} exceeds the {self.max_file_bytes / (1024 * 1024):g} MB per-file limit')
+                if self.total_bytes + document.raw_bytes > self.max_session_bytes:
+                    raise IngestError(f'Upload limit of {self.max_session_bytes / (1024 * 1024):g} MB per session reached')
+
+                text = pending + decoder.decode(chunk)
+                if leading:
+                    text = text.lstrip()
+                    leading = not text
+                stripped = text.rstrip()
+                pending = text[len(stripped):]
+                normalized = normalize_whitespace(stripped)
+                if document.spooled:
+                    await asyncio.to_thread(document._write, normalized)
+                else:
+                    document._write(normalized)
+
+            tail = (pending + decoder.decode(b'', final=True)).rstrip()
+            document._write(normalize_whitespace(tail))
+            document._finish()
+        except BaseException:
+            document.discard()
+            raise
+
+        self.total_bytes += document.raw_bytes
+        self.documents.append(document)
+        return document
+
+    def iter_text(self) -> Iterator[str]:
+        """Stream all documents, separated by a blank line."""
+        for index, document in enumerate(self.documents):
+            if index:
+                yield '\n\n'
+            yield from document.iter_text()
+
+    def iter_chunks(self, chunk_chars: int, overlap_chars: int = 0) -> Iterator[str]:
+        """
+        Yield overlapping chunks of at most chunk_chars across all documents.
+        Only one chunk plus one read block is held in memory at a time.
+        """
+        return iter_chunks(self.iter_text(), chunk_chars, overlap_chars)
+
+    def close(self):
+        """Delete spool files and forget all documents."""
+        for document in self.documents:
+            document.discard()
+        self.documents = []
+        self.total_bytes = 0
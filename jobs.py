@@ -0,0 +1,294 @@
+"""Durable background job queue for image and 3D generation."""
+import os
+import time
+import json
+import uuid
+import asyncio
+import logging
+from pathlib import Path
+from dotenv import load_dotenv
+from database import (
+    create_job_async, get_job_async, claim_next_job_async, finish_job_async, requeue_running_jobs_async, renew_job_leases_async,
+    reserve_credits_async, commit_reservation_async, refund_reservation_async,
+    get_user_by_id_async
+)
+from api_clients import generate_image_async, generate_3d_model_async, cached_image_async, cached_3d_model_async
+from artifacts import artifact_store, Artifact
+from glb_optimizer import optimize_glb, format_report
+import thumbnails
+from metrics import JOB_LATENCY, JOB_QUEUE_WAIT, GLB_BYTES
+
+load_dotenv()
+
+JOBS_DIR = Path(os.getenv('SCULPTOR_JOBS_DIR', 'generated/jobs'))
+# Workers mostly wait on providers, so the global cap can be generous;
+# the per-user cap keeps one batch from starving everyone else
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 16))
+JOB_MAX_PER_USER = int(os.getenv('JOB_MAX_PER_USER', 10))
+POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+# Running jobs are renewed every JOB_HEARTBEAT_S; one not renewed for JOB_LEASE_S
+# belongs to a dead process and is queued again
+JOB_HEARTBEAT = float(os.getenv('JOB_HEARTBEAT_S', 15))
+JOB_LEASE = float(os.getenv('JOB_LEASE_S', 120))
+GLB_OPTIMIZE = os.getenv('GLB_OPTIMIZE', 'false').lower() in ('1', 'true', 'yes')
+
+logger = logging.getLogger(__name__)
+
+_workers = []
+_wakeup = None
+_finished = {}
+_running = set()  # ids of jobs this process is working on
+
+def _get_wakeup() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+def _notify_workers():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # Enqueued from a thread with no loop; workers pick it up on their next poll
+        return
+    _get_wakeup().set()
+
+async def enqueue_image_job(user_id: int, prompt: str, credit_cost: int = 1) -> int | None:
+    """
+    Queue a 2D image generation. Returns the job ID.
+    Credits are reserved up front; returns None if the user cannot afford it.
+    """
+    reservation_id = await reserve_credits_async(user_id, credit_cost, 'image') if credit_cost else None
+    if credit_cost and reservation_id is None:
+        return None
+    params = {'prompt': prompt, 'reservation_id': reservation_id}
+    try:
+        job = await create_job_async(user_id, 'image', json.dumps(params), credit_cost)
+    except Exception:
+        # No job will ever settle the reservation, so give the credits back
+        if reservation_id:
+            await refund_reservation_async(reservation_id)
+        raise
+    _notify_workers()
+    return job.id
+
+async def enqueue_image_batch(user_id: int, prompts: list[str], credit_cost: int = 1) -> list[int] | None:
+    """
+    Queue one image job per prompt, all or nothing. Returns the job IDs in
+    prompt order, or None if the user cannot afford the whole batch.
+    If queueing fails part way, the jobs already queued still run and the
+    remaining reservations are refunded before the error is raised.
+    """
+    user = await get_user_by_id_async(user_id)
+    if user is None or user.credits < credit_cost * len(prompts):
+        return None
+    reservations = []
+    try:
+        for _ in prompts:
+            reservation_id = await reserve_credits_async(user_id, credit_cost, 'image') if credit_cost else None
+            if credit_cost and reservation_id is None:
+                # Credits were spent elsewhere since the check
+                raise Exception("Insufficient credits")
+            reservations.append(reservation_id)
+    except Exception:
+        for reservation_id in reservations:
+            if reservation_id:
+                await refund_reservation_async(reservation_id)
+        return None
+
+    job_ids = []
+    try:
+        for prompt, reservation_id in zip(prompts, reservations):
+            params = {'prompt': prompt, 'reservation_id': reservation_id}
+            job = await create_job_async(user_id, 'image', json.dumps(params), credit_cost)
+            job_ids.append(job.id)
+    except Exception:
+        # Jobs already created settle their own reservations; refund the rest
+        for reservation_id in reservations[len(job_ids):]:
+            if reservation_id:
+                await refund_reservation_async(reservation_id)
+        raise
+    finally:
+        _notify_workers()
+    return job_ids
+
+async def enqueue_3d_job(user_id: int, image_bytes: bytes, model_type: str, credit_cost: int) -> int | None:
+    """
+    Queue an image-to-3D conversion. Returns the job ID, or None if the
+    credits cannot be reserved.
+    The input image is written to disk so the job survives restarts.
+    """
+    reservation_id = await reserve_credits_async(user_id, credit_cost, f'3d:{model_type}') if credit_cost else None
+    if credit_cost and reservation_id is None:
+        return None
+    input_path = JOBS_DIR / f'input-{uuid.uuid4().hex}.png'
+    try:
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(input_path.write_bytes, image_bytes)
+        params = {'model_type': model_type, 'reservation_id': reservation_id}
+        job = await create_job_async(user_id, '3d', json.dumps(params), credit_cost, str(input_path))
+    except Exception:
+        input_path.unlink(missing_ok=True)
+        if reservation_id:
+            await refund_reservation_async(reservation_id)
+        raise
+    _notify_workers()
+    return job.id
+
+async def _run_job(job):
+    """Execute one claimed job and record the outcome."""
+    params = json.loads(job.params or '{}')
+    if job.created_at and job.updated_at:
+        # updated_at is stamped when the job is claimed
+        JOB_QUEUE_WAIT.observe((job.updated_at - job.created_at).total_seconds(), kind=job.kind)
+    start = time.perf_counter()
+    status = 'failed'
+    settled = False
+    details = None
+    try:
+        # A result already in the generation cache is free; only misses reach the provider
+        if job.kind == 'image':
+            result = await cached_image_async(params['prompt'])
+            cache_hit = result is not None
+            if not cache_hit:
+                result = await generate_image_async(params['prompt'], check_cache=False)
+            kind, suffix = 'image', '.png'
+        elif job.kind == '3d':
+            image_bytes = await asyncio.to_thread(Path(job.input_path).read_bytes)
+            model_type = params.get('model_type', 'point-aware')
+            result = await cached_3d_model_async(image_bytes, model_type)
+            cache_hit = result is not None
+            if not cache_hit:
+                result = await generate_3d_model_async(image_bytes, model_type, check_cache=False)
+            kind, suffix = 'model', '.glb'
+            if GLB_OPTIMIZE:
+                result, report = await asyncio.to_thread(_optimize_model, result)
+                details = {'optimization': report} if report else None
+        else:
+            raise Exception(f"Unknown job kind: {job.kind}")
+
+        # Results go straight to the owner's artifact store
+        artifact = await asyncio.to_thread(artifact_store.put, job.user_id, result, kind, suffix)
+        if kind == 'image':
+            # Render the preview variants once, off the event loop
+            try:
+                await thumbnails.ensure_variants(artifact)
+            except Exception as e:
+                logger.warning(f'Could not render image variants for job {job.id}: {e}')
+
+        # Reserved credits are only committed once the result is safely on disk; a cached result is free
+        if params.get('reservation_id'):
+            if cache_hit:
+                await refund_reservation_async(params['reservation_id'])
+            else:
+                await commit_reservation_async(params['reservation_id'])
+        await finish_job_async(job.id, 'done', str(artifact.path), details=details)
+        status = 'done'
+        settled = True
+    except Exception as e:
+        if params.get('reservation_id'):
+            await refund_reservation_async(params['reservation_id'])
+        await finish_job_async(job.id, 'failed', None, str(e))
+        settled = True
+    finally:
+        # Once the outcome is recorded the input is no longer needed. A job
+        # interrupted by shutdown keeps it, since it runs again when requeued.
+        if settled and job.input_path:
+            Path(job.input_path).unlink(missing_ok=True)
+        JOB_LATENCY.observe(time.perf_counter() - start, kind=job.kind, model_type=params.get('model_type', ''), status=status)
+        event = _finished.pop(job.id, None)
+        if event:
+            event.set()
+
+def _optimize_model(model_bytes: bytes) -> tuple[bytes, dict | None]:
+    """
+    Run the GLB optimizer, falling back to the original model on any error.
+    Returns (model bytes, report), with report None if optimization failed.
+    """
+    try:
+        optimized, report = optimize_glb(model_bytes)
+    except Exception as e:
+        logger.warning(f'GLB optimization failed, keeping original: {e}')
+        return model_bytes, None
+    GLB_BYTES.observe(report['original_bytes'], stage='original')
+    GLB_BYTES.observe(report['optimized_bytes'], stage='optimized')
+    logger.info(format_report(report))
+    return optimized, report
+
+async def _worker():
+    wakeup = _get_wakeup()
+    while True:
+        job = await claim_next_job_async(JOB_MAX_PER_USER)
+        if job is None:
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        _running.add(job.id)
+        try:
+            await _run_job(job)
+        finally:
+            _running.discard(job.id)
+
+async def _keep_leases():
+    """Renew the leases of this process's jobs and requeue jobs whose lease expired."""
+    while True:
+        try:
+            await renew_job_leases_async(list(_running))
+            if count := await requeue_running_jobs_async(JOB_LEASE):
+                logger.warning(f'Requeued {count} jobs whose worker stopped renewing them')
+                _notify_workers()
+        except Exception as e:
+            logger.warning(f'Could not renew job leases: {e}')
+        await asyncio.sleep(JOB_HEARTBEAT)
+
+async def start_workers(count: int = JOB_WORKERS):
+    """
+    Start the worker pool. Jobs left running by a dead process are requeued
+    once their lease expires; jobs other live processes run are left alone.
+    """
+    _workers.append(asyncio.create_task(_keep_leases()))
+    for _ in range(count):
+        _workers.append(asyncio.create_task(_worker()))
+
+async def stop_workers():
+    """Cancel the worker pool; its running jobs are requeued once their lease expires."""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+async def wait_for_job(job_id: int):
+    """
+    Wait until a job is done or failed and return it.
+    Completion in this process wakes the waiter immediately; otherwise
+    the job table is polled.
+    """
+    while True:
+        job = await get_job_async(job_id)
+        if job is None or job.status in ('done', 'failed'):
+            _finished.pop(job_id, None)
+            return job
+        event = _finished.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def as_completed(job_ids: list[int]):
+    """Yield finished jobs in the order they complete."""
+    for next_job in asyncio.as_completed([wait_for_job(job_id) for job_id in job_ids]):
+        yield await next_job
+
+def optimization_summary(job) -> str | None:
+    """One-line GLB optimization report of a finished 3D job, if it was optimized."""
+    report = json.loads(job.params or '{}').get('optimization')
+    return format_report(report) if report else None
+
+def result_artifact(job) -> Artifact | None:
+    """Return the stored artifact of a finished job, or None if it has expired."""
+    if not job.result_path:
+        return None
+    return artifact_store.get(job.user_id, Path(job.result_path).stem)
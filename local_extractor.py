@@ -0,0 +1,190 @@
+"""
+Heuristic entity extraction that runs locally, without a model call.
+
+Characters and named things are found as runs of capitalized words
+("Queen Seraphina", "Citadel of Stars"); unnamed objects as short noun
+phrases ending in a concrete noun ("a magical crown"). Candidates are ranked
+by how often they are mentioned. Used for short inputs and whenever the
+extraction provider is unavailable.
+"""
+import re
+from typing import Iterable
+
+MAX_ENTITIES = 20
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+_TOKEN = re.compile(r"[A-Za-z][A-Za-z'’-]*")
+_POSSESSIVE = re.compile(r"['’]s?$")
+
+# Capitalized only because they start a sentence or a heading
+_FUNCTION_WORDS = frozenset((
+    'a an the this that these those some any each every all no one another such '
+    'i me my we our you your he him his she her it its they them their who whom whose which what '
+    'in on at by for from with without into onto over under above below beyond behind before after during '
+    'through across against among around between near toward towards upon within of to and or but nor so yet '
+    'if then than when while where as because although though since until unless once only also even '
+    'there here now later soon often always never however meanwhile finally suddenly together '
+    'is was are were be been being has had have do did does will would can could may might must shall should '
+    'chapter part book'
+).split())
+
+# Lowercase words allowed inside a name, between two capitalized words
+_CONNECTORS = frozenset(('of', 'the', 'de', 'la', 'le', 'von', 'van', 'al'))
+
+# Words that open a noun phrase, and modifiers that never belong to one
+_DETERMINERS = frozenset('a an the his her its their my our your this that'.split())
+_NOT_MODIFIERS = _FUNCTION_WORDS | frozenset('named called known said very most more'.split())
+
+# Head nouns of things worth sculpting: creatures, wearables, weapons and other objects
+_OBJECT_NOUNS = frozenset((
+    'amulet armor armour arrow axe bag banner bell belt blade boat book boots bottle bow box bracelet '
+    'cage candle cape carriage cart chalice chest cloak coin compass crossbow crown crystal cup dagger '
+    'drum egg flag flute gauntlet gem goblet hammer harp hat helm helmet horn idol jewel key lamp lantern '
+    'locket map mask medallion mirror necklace orb pendant pipe potion quill ring robe rod rune saddle '
+    'scepter sceptre scroll shield ship spear staff statue stone sword throne tiara tome torch totem trident '
+    'urn vial wagon wand whip '
+    'bear beast cat dog dragon eagle falcon fox golem griffin horse hound lion owl phoenix raven serpent '
+    'snake spider stag toad unicorn wolf wyvern '
+    'automaton robot car train airship spaceship rocket'
+).split())
+
+def _words(sentence: str) -> list[str]:
+    return [_POSSESSIVE.sub('', token) for token in _TOKEN.findall(sentence)]
+
+def _is_capitalized(word: str) -> bool:
+    return word[0].isupper() and not word.isupper()
+
+def _name_suffixes(name: str) -> list[str]:
+    """Trailing parts of a name that stand for it: "Aldric" for "Sir Aldric", but not "Eldoria" for "Chronicles of Eldoria"."""
+    words = name.split()
+    if any(word in _CONNECTORS for word in words):
+        return []
+    return [' '.join(words[index:]) for index in range(1, len(words))]
+
+class _Candidates:
+    """Mention counts and first positions for proper names and object phrases."""
+
+    def __init__(self):
+        self.names = {}  # name -> [count, first position, seen other than sentence-initially]
+        self.objects = {}  # phrase -> [count, first position]
+        self.lowercase = set()  # words seen in lowercase, to spot capitalized common words
+        self.position = 0
+
+    def _add_name(self, words: list[str], sentence_initial: bool):
+        # Headings and sentence starts capitalize function words: drop them from the ends
+        while words and words[0].casefold() in _FUNCTION_WORDS:
+            words = words[1:]
+            sentence_initial = False
+        while words and words[-1].casefold() in _CONNECTORS:
+            words = words[:-1]
+        if not words or (len(words) == 1 and len(words[0]) < 2):
+            return
+        name = ' '.join(words)
+        entry = self.names.setdefault(name, [0, self.position, False])
+        entry[0] += 1
+        entry[2] = entry[2] or not sentence_initial
+
+    def _add_object(self, words: list[str], end: int):
+        """Record the noun phrase ending in the object noun words[end], with up to two modifiers."""
+        start = end
+        while start > 0 and end - start < 2 and words[start - 1].casefold() not in _NOT_MODIFIERS and not _is_capitalized(words[start - 1]):
+            start -= 1
+        # A bare noun counts only after an article or possessive ("a staff"), not in "staff members"
+        if start == end and (start == 0 or words[start - 1].casefold() not in _DETERMINERS):
+            return
+        following = words[end + 1].casefold() if end + 1 < len(words) else ''
+        # "a dragon named Ember" is the character Ember, not a separate object
+        if following in ('named', 'called'):
+            return
+        # In "crystal spires" or "stone golem" the noun is only a modifier
+        if following in _OBJECT_NOUNS or (following not in _NOT_MODIFIERS and following.endswith('s') and not following.endswith('ss')):
+            return
+        phrase = ' '.join(word.casefold() for word in words[start:end + 1])
+        entry = self.objects.setdefault(phrase, [0, self.position])
+        entry[0] += 1
+
+    def add_sentence(self, sentence: str):
+        words = _words(sentence)
+        run = []
+        run_start = 0
+        for index, word in enumerate(words + ['.']):
+            self.position += 1
+            if _is_capitalized(word):
+                if not run:
+                    run_start = index
+                run.append(word)
+                continue
+            lower = word.casefold()
+            if run and lower in _CONNECTORS and index + 1 < len(words) and _is_capitalized(words[index + 1]):
+                run.append(word)
+                continue
+            if run:
+                self._add_name(run, run_start == 0)
+                run = []
+            if word.islower():
+                self.lowercase.add(lower)
+                if lower in _OBJECT_NOUNS:
+                    self._add_object(words, index)
+
+    @staticmethod
+    def _fold(entries: dict, shorter_forms):
+        """
+        Merge each entry into the one longer entry it is a shorter form of, if
+        there is exactly one. shorter_forms(key) yields the shorter keys that
+        key would absorb, so candidates are found by lookup, not by scanning.
+        """
+        containing = {}
+        for key in entries:
+            for short in shorter_forms(key):
+                if short in entries:
+                    containing.setdefault(short, []).append(key)
+        # Shortest first, so "Aldric" -> "Sir Aldric" happens before "Sir Aldric" is itself folded
+        for short in sorted(containing, key=len):
+            if len(containing[short]) == 1:
+                longer = entries[containing[short][0]]
+                longer[0] += entries[short][0]
+                longer[1] = min(longer[1], entries[short][1])
+                del entries[short]
+
+    def ranked(self, limit: int) -> list[str]:
+        names = {
+            name: entry for name, entry in self.names.items()
+            # A word only ever capitalized at the start of a sentence, and used in lowercase elsewhere, is not a name
+            if entry[2] or ' ' in name or name.casefold() not in self.lowercase
+        }
+        self._fold(names, _name_suffixes)
+
+        # Objects whose head noun is also part of a name ("Shield of Dawn") are already covered
+        name_words = {word.casefold() for name in names for word in name.split()}
+        objects = {
+            phrase: entry for phrase, entry in self.objects.items()
+            if phrase.split()[-1] not in name_words
+        }
+        # A bare "key" is the "silver key" mentioned elsewhere
+        self._fold(objects, lambda phrase: phrase.split()[-1:] if ' ' in phrase else ())
+
+        def rank(item):
+            return (-item[1][0], item[1][1])
+        ranked = [name for name, _ in sorted(names.items(), key=rank)]
+        ranked += [phrase for phrase, _ in sorted(objects.items(), key=rank)]
+        return ranked[:limit]
+
+def extract_entities_local(pieces: Iterable[str] | str, limit: int = MAX_ENTITIES) -> list[str]:
+    """
+    Extract character and object names from text, most mentioned first.
+    pieces may be one string or an iterable of text blocks, e.g.
+    Document.iter_text(); blocks are split into sentences as they are read.
+    """
+    if isinstance(pieces, str):
+        pieces = (pieces,)
+    candidates = _Candidates()
+    pending = ''
+    for piece in pieces:
+        sentences = _SENTENCE_END.split(pending + piece)
+        # The last piece of a block may be a sentence that continues in the next block
+        pending = sentences.pop()
+        for sentence in sentences:
+            candidates.add_sentence(sentence)
+    if pending.strip():
+        candidates.add_sentence(pending)
+    return candidates.ranked(limit)
@@ -0,0 +1,99 @@
+"""Event-loop stall detector: measures scheduling lag and logs what blocked the loop."""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from dotenv import load_dotenv
+from metrics import LOOP_LAG, LOOP_STALLS
+
+load_dotenv()
+
+LOOP_MONITOR = os.getenv('LOOP_MONITOR', 'true').lower() in ('1', 'true', 'yes')
+STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD_MS', 100)) / 1000
+SAMPLE_INTERVAL = float(os.getenv('LOOP_SAMPLE_INTERVAL_MS', 50)) / 1000
+
+logger = logging.getLogger(__name__)
+
+class LoopMonitor:
+    """
+    A heartbeat coroutine sleeps for interval seconds and records how late it
+    wakes up. A watchdog thread checks the last heartbeat; once it is more than
+    threshold seconds overdue, the loop thread's current stack is logged,
+    which points at the callback that is blocking it.
+    """
+
+    def __init__(self, name: str = 'main', threshold: float = STALL_THRESHOLD, interval: float = SAMPLE_INTERVAL):
+        self.name = name
+        self.threshold = threshold
+        self.interval = interval
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = time.monotonic()
+        self._stall_reported = False
+        self._heartbeat_task = None
+        self._stopped = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        """Start monitoring the running loop. Call from a coroutine on that loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = self._loop.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name=f'loop-monitor-{self.name}', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - self._last_beat - self.interval, 0.0)
+            LOOP_LAG.observe(lag, loop=self.name)
+            if self._stall_reported:
+                logger.warning(f'Event loop "{self.name}" was blocked for {lag * 1000:.0f} ms')
+                self._stall_reported = False
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue < self.threshold or self._stall_reported:
+                continue
+            # Report each stall once, with the stack of whatever is holding the loop
+            self._stall_reported = True
+            LOOP_STALLS.inc(loop=self.name)
+            stack = _format_loop_stack(sys._current_frames().get(self._loop_thread_id))
+            logger.warning(
+                f'Event loop "{self.name}" blocked for more than {overdue * 1000:.0f} ms, currently in:\n{stack}'
+            )
+
+def _format_loop_stack(frame) -> str:
+    """Format a stack without the event loop's own frames above the blocking callback."""
+    if frame is None:
+        return '(stack unavailable)\n'
+    entries = traceback.extract_stack(frame)
+    asyncio_dir = os.path.dirname(asyncio.__file__)
+    for index in range(len(entries) - 1, -1, -1):
+        if entries[index].filename.startswith(asyncio_dir):
+            entries = entries[index + 1:] or entries
+            break
+    return ''.join(traceback.format_list(entries))
+
+_monitor = LoopMonitor()
+
+async def start():
+    """Start the stall detector on the app's event loop (unless LOOP_MONITOR is off)."""
+    if LOOP_MONITOR:
+        _monitor.start()
+
+def stop():
+    _monitor.stop()
@@ -1,42 +1,75 @@
 """Sculptor - Main application entry point."""
 import os
-import base64
+import time
+import asyncio
 from pathlib import Path
-from nicegui import ui, app
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from nicegui import ui, app, background_tasks
 from dotenv import load_dotenv
-from auth import signup_user, login_user
-from database import get_user_by_id, deduct_credits
-from rag import extract_entities
-from api_clients import generate_image, generate_3d_model
+import auth
+from auth import signup_user_async, login_user_async
+import database
+from database import get_cached_user_async, get_latest_job_async, count_jobs_async
+from rag import (
+    extract_document_entities_async, stream_document_entities_async, describe_entity, build_image_prompt,
+    EXTRACTION_STREAMING
+)
+from ingest import DocumentStore
+from semantic_index import SemanticIndex
 from mock_payment import simulate_payment_success
+import http_client
+import jobs
+import thumbnails
+import shared_state
+import metrics
+import loop_monitor
+from artifacts import artifact_store, artifact_url
 
 load_dotenv()
 
+async def start_background_services():
+    """NiceGUI runs async startup handlers concurrently, so order them here."""
+    # Tables must exist before the workers start polling
+    await database.init_db_async()
+    # Background generation workers live for the whole process
+    await jobs.start_workers()
+
+app.on_startup(start_background_services)
+app.on_shutdown(jobs.stop_workers)
+
+# Release pooled provider connections on shutdown
+app.on_shutdown(http_client.aclose)
+app.on_shutdown(thumbnails.shutdown)
+
+# Log the stack of any handler that blocks the event loop
+app.on_startup(loop_monitor.start)
+app.on_shutdown(loop_monitor.stop)
+
+# Password hashing runs in its own small thread pool
+app.on_startup(auth.warm_up)
+app.on_shutdown(auth.shutdown)
+app.on_shutdown(shared_state.shutdown)
+app.on_shutdown(database.close_async)
+
 # Session state keys
 SESSION_USER_ID = 'user_id'
 SESSION_USERNAME = 'username'
 SESSION_CREDITS = 'credits'
 
-# Global state for workflow
-workflow_state = {
-    'entities': [],
-    'selected_entity': None,
-    'generated_image': None,
-    'generated_3d_model': None
-}
-
-def get_current_user():
-    """Get current user from session."""
+async def get_current_user():
+    """Get current user from session (cached for a few seconds)."""
     user_id = app.storage.user.get(SESSION_USER_ID)
     if user_id:
-        return get_user_by_id(user_id)
+        return await get_cached_user_async(user_id)
     return None
 
-def update_session_credits():
+async def update_session_credits():
     """Update credits in session from database."""
-    user = get_current_user()
+    user = await get_current_user()
     if user:
         app.storage.user[SESSION_CREDITS] = user.credits
+        await shared_state.save_session()
         return user.credits
     return 0
 
@@ -44,24 +77,75 @@ def require_auth(func):
     """Decorator to require authentication."""
     from functools import wraps
     @wraps(func)
-    def wrapper():
+    async def wrapper():
+        await shared_state.load_session()
         if not app.storage.user.get(SESSION_USER_ID):
             ui.navigate.to('/login')
             return
         return func()
     return wrapper
 
+@app.get('/artifacts/{artifact_id}')
+async def serve_artifact(artifact_id: str, request: Request):
+    """
+    Serve a stored artifact to its owner.
+    Artifact content never changes, so the ID doubles as a strong ETag.
+    FileResponse handles Range/If-Range for partial .glb downloads.
+    """
+    await shared_state.load_session()
+    user_id = app.storage.user.get(SESSION_USER_ID)
+    artifact = artifact_store.get(user_id, artifact_id) if user_id else None
+    if artifact is None:
+        return Response(status_code=404)
+    
+    etag = f'"{artifact.id}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'private, max-age={int(artifact_store.ttl)}, immutable'
+    }
+    
+    # Conditional GET: the browser already has this exact artifact
+    if_none_match = request.headers.get('if-none-match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return Response(status_code=304, headers=headers)
+    
+    return FileResponse(artifact.path, media_type=artifact.content_type, headers=headers)
+
+@app.middleware('http')
+async def record_request_metrics(request: Request, call_next):
+    """Time every HTTP request by route template, so IDs in paths do not multiply series."""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get('route')
+    metrics.HTTP_LATENCY.observe(
+        time.perf_counter() - start,
+        method=request.method, route=getattr(route, 'path', 'unmatched'), status=response.status_code
+    )
+    return response
+
+@app.get('/metrics')
+async def serve_metrics(request: Request):
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require a bearer token."""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('authorization') != f'Bearer {token}':
+        return Response(status_code=401)
+    # The job queue lives in the database, so its depth is read at scrape time
+    metrics.EXECUTOR_QUEUE_DEPTH.set(await count_jobs_async('queued'), executor='jobs')
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @ui.page('/')
-def index():
+async def index():
     """Landing page - redirects to login or main app."""
+    await shared_state.load_session()
     if app.storage.user.get(SESSION_USER_ID):
         ui.navigate.to('/app')
     else:
         ui.navigate.to('/login')
 
 @ui.page('/login')
-def login_page():
+async def login_page():
     """Login and signup page."""
+    await shared_state.load_session()
     if app.storage.user.get(SESSION_USER_ID):
         ui.navigate.to('/app')
         return
@@ -86,18 +170,20 @@ def login_page():
                 login_username = ui.input('Username').classes('w-full')
                 login_password = ui.input('Password', password=True, password_toggle_button=True).classes('w-full')
                 
-                def do_login():
+                async def do_login():
                     # Validate inputs
                     if not login_username.value or not login_password.value:
                         ui.notify('Please fill in all fields', type='negative')
                         return
                     
                     try:
-                        success, message, user = login_user(login_username.value, login_password.value)
+                        success, message, user = await login_user_async(login_username.value, login_password.value)
                         if success:
                             app.storage.user[SESSION_USER_ID] = user.id
                             app.storage.user[SESSION_USERNAME] = user.username
                             app.storage.user[SESSION_CREDITS] = user.credits
+                            # The next request may be served by another process
+                            await shared_state.save_session(flush=True)
                             ui.notify(message, type='positive')
                             ui.navigate.to('/app')
                         else:
@@ -113,7 +199,7 @@ def login_page():
                 signup_password = ui.input('Password', password=True, password_toggle_button=True).classes('w-full')
                 signup_confirm = ui.input('Confirm Password', password=True, password_toggle_button=True).classes('w-full')
                 
-                def do_signup():
+                async def do_signup():
                     # Validate inputs
                     if not signup_username.value or not signup_password.value:
                         ui.notify('Please fill in all fields', type='negative')
@@ -128,13 +214,13 @@ def login_page():
                         return
                     
                     try:
-                        success, message = signup_user(signup_username.value, signup_password.value)
+                        success, message, user = await signup_user_async(signup_username.value, signup_password.value)
                         if success:
                             # Auto-login after signup
-                            _, _, user = login_user(signup_username.value, signup_password.value)
                             app.storage.user[SESSION_USER_ID] = user.id
                             app.storage.user[SESSION_USERNAME] = user.username
                             app.storage.user[SESSION_CREDITS] = user.credits
+                            await shared_state.save_session(flush=True)
                             ui.notify(f'{message}! You have 5 free credits.', type='positive')
                             ui.navigate.to('/app')
                         else:
@@ -150,6 +236,15 @@ def main_app():
     """Main application page."""
     username = app.storage.user.get(SESSION_USERNAME, 'User')
     credits = app.storage.user.get(SESSION_CREDITS, 0)
+    user_id = app.storage.user.get(SESSION_USER_ID)
+    
+    # Per-page workflow state; payloads live in the per-user artifact store
+    workflow = {
+        'entities': [],
+        'image_id': None,
+        'model_id': None,
+        'gallery': []
+    }
     
     # Add custom styling for main app
     ui.query('body').style('background: linear-gradient(to bottom, #f8fafc 0%, #e2e8f0 100%);')
@@ -164,8 +259,9 @@ def main_app():
                 credit_label = ui.label(f'💎 {credits} Credits').classes('text-lg text-white font-bold px-2')
             ui.label(f'👤 {username}').classes('text-lg text-white font-semibold')
             
-            def do_logout():
+            async def do_logout():
                 app.storage.user.clear()
+                await shared_state.save_session(flush=True)
                 ui.navigate.to('/login')
             
             ui.button('Logout', on_click=do_logout, icon='logout').props('flat color=white')
@@ -188,26 +284,32 @@ def main_app():
                 ui.label('📄').classes('text-3xl')
                 ui.label('Step 1: Upload and Analyze Documents').classes('text-2xl font-bold text-gray-800')
             
-            uploaded_files = []
+            documents = DocumentStore()
+            # Passages of the uploads, searched to describe the selected entity
+            index = SemanticIndex()
+            # Spooled uploads and the index are deleted when the client goes away
+            ui.context.client.on_delete(documents.close)
+            ui.context.client.on_delete(index.close)
             entities_list = ui.column()
             selected_entity = {'value': None}
+            batch_entities = {'values': []}
             
             async def handle_upload(e):
                 try:
-                    # In NiceGUI 3.2.0, use e.file to access the uploaded file
-                    # Read the file content - it might be async
-                    if hasattr(e.file, 'read'):
-                        content = e.file.read()
-                        # If it's a coroutine, await it
-                        if hasattr(content, '__await__'):
-                            content = await content
+                    # Stream the upload in blocks instead of reading it whole
+                    if hasattr(e.file, 'iterate'):
+                        chunks = e.file.iterate(chunk_size=64 * 1024)
                     else:
-                        content = e.file
-                    
-                    if isinstance(content, bytes):
-                        content = content.decode('utf-8')
-                    
-                    uploaded_files.append(content)
+                        async def read_whole():
+                            content = e.file.read()
+                            if hasattr(content, '__await__'):
+                                content = await content
+                            yield content if isinstance(content, bytes) else content.encode('utf-8')
+                        chunks = read_whole()
+                    
+                    document = await documents.add(getattr(e.file, 'name', 'document'), chunks)
+                    # Index as each file arrives, so retrieval never re-reads the whole corpus
+                    await asyncio.to_thread(index.add_document, document)
                     ui.notify(f'Uploaded document successfully', type='positive')
                 except Exception as ex:
                     ui.notify(f'Upload error: {str(ex)}', type='negative')
@@ -216,14 +318,69 @@ def main_app():
                 label='Upload Documents (.txt, .md)',
                 on_upload=handle_upload,
                 multiple=True,
-                auto_upload=True
+                auto_upload=True,
+                max_file_size=documents.max_file_bytes
             ).props('accept=".txt,.md"').classes('w-full')
             
+            entity_widgets = {}
+            
+            def show_entities(entities):
+                entities_list.clear()
+                with entities_list:
+                    ui.label('Select a character or object:').classes('font-bold mb-2')
+                    entity_widgets['radio'] = ui.radio(
+                        list(entities),
+                        value=entities[0] if entities else None,
+                        on_change=lambda e: select_entity(e.value)
+                    ).props('inline')
+                    select_entity(entities[0] if entities else None)
+                    
+                    # Batch mode: several entities generated concurrently in Step 2
+                    batch_entities['values'] = []
+                    entity_widgets['batch'] = ui.select(
+                        list(entities),
+                        multiple=True,
+                        label='Or select several for a batch of images',
+                        on_change=lambda e: set_batch_selection(e.value)
+                    ).props('use-chips clearable').classes('w-full mt-4')
+                    set_batch_selection([])
+            
+            def add_entity(entity):
+                """Append one streamed entity to the choices; the first one becomes the selection."""
+                entity_widgets['radio'].set_options(entity_widgets['radio'].options + [entity])
+                entity_widgets['batch'].set_options(entity_widgets['batch'].options + [entity])
+                if selected_entity['value'] is None:
+                    entity_widgets['radio'].value = entity
+            
+            def select_entity(entity):
+                selected_entity['value'] = entity
+                entity_context.text = ''
+                if entity:
+                    background_tasks.create(show_entity_context(entity))
+            
+            async def show_entity_context(entity):
+                # Retrieval scores every passage in the session, so it runs off the event loop
+                context = await asyncio.to_thread(describe_entity, index, entity)
+                # The selection may have changed while it ran
+                if context and selected_entity['value'] == entity:
+                    entity_context.text = f'From your documents: {context}'
+            
             async def analyze_documents():
-                if not uploaded_files:
+                if not documents.documents:
                     ui.notify('Please upload at least one document', type='warning')
                     return
                 
+                if not any(document.text_chars for document in documents.documents):
+                    ui.notify('No valid text content found', type='negative')
+                    return
+                
+                # Documents are extracted one by one, so ones analyzed before come from the cache
+                session_documents = list(documents.documents)
+                
+                if EXTRACTION_STREAMING:
+                    await analyze_streaming(session_documents)
+                    return
+                
                 # Show loading
                 with ui.dialog() as dialog, ui.card():
                     ui.label('Analyzing documents...')
@@ -231,32 +388,12 @@ def main_app():
                 dialog.open()
                 
                 try:
-                    # Combine all documents - ensure all are strings
-                    text_items = [item for item in uploaded_files if isinstance(item, str)]
-                    
-                    if not text_items:
-                        dialog.close()
-                        ui.notify('No valid text content found', type='negative')
-                        return
-                    
-                    combined_text = '\n\n'.join(text_items)
-                    
-                    # Extract entities using asyncio to avoid blocking
-                    import asyncio
-                    loop = asyncio.get_event_loop()
-                    entities = await loop.run_in_executor(None, extract_entities, combined_text)
-                    workflow_state['entities'] = entities
+                    entities = await extract_document_entities_async(session_documents)
+                    workflow['entities'] = entities
+                    shared_state.save_workflow(user_id, workflow)
                     
                     # Update UI
-                    entities_list.clear()
-                    with entities_list:
-                        ui.label('Select a character or object:').classes('font-bold mb-2')
-                        radio_group = ui.radio(
-                            entities,
-                            value=entities[0] if entities else None,
-                            on_change=lambda e: selected_entity.update({'value': e.value})
-                        ).props('inline')
-                        selected_entity['value'] = entities[0] if entities else None
+                    show_entities(entities)
                     
                     dialog.close()
                     ui.notify(f'Found {len(entities)} entities', type='positive')
@@ -265,6 +402,33 @@ def main_app():
                     dialog.close()
                     ui.notify(f'Error: {str(e)}', type='negative')
             
+            async def analyze_streaming(session_documents):
+                """Fill the entity list while the model is still writing it."""
+                workflow['entities'] = []
+                select_entity(None)
+                show_entities([])
+                with entities_list:
+                    with ui.row().classes('items-center gap-2') as progress:
+                        ui.spinner()
+                        ui.label('Analyzing documents...').classes('text-gray-600')
+                
+                try:
+                    async for entity in stream_document_entities_async(session_documents):
+                        workflow['entities'].append(entity)
+                        add_entity(entity)
+                        shared_state.save_workflow(user_id, workflow)
+                    
+                    if not workflow['entities']:
+                        workflow['entities'].append('No entities found')
+                        add_entity('No entities found')
+                        shared_state.save_workflow(user_id, workflow)
+                    ui.notify(f'Found {len(workflow["entities"])} entities', type='positive')
+                    
+                except Exception as e:
+                    ui.notify(f'Error: {str(e)}', type='negative')
+                finally:
+                    progress.delete()
+            
             ui.button('Analyze Documents', on_click=analyze_documents, icon='search').classes('mt-4')
         
         # Step 2: Image Generation
@@ -278,15 +442,49 @@ def main_app():
                 placeholder='e.g., "in a fantasy art style, with vibrant colors"'
             ).classes('w-full')
             
+            # What the documents say about the selected entity; it is added to the prompt
+            entity_context = ui.label('').classes('text-sm text-gray-600 italic')
+            
             image_container = ui.column().classes('w-full items-center')
             
+            def show_image(image_artifact, preview_artifact):
+                # Display the small preview; the original stays one click away
+                image_container.clear()
+                with image_container:
+                    ui.label('Generated Image:').classes('font-bold mb-2')
+                    ui.image(artifact_url(preview_artifact)).classes('max-w-md border rounded')
+                    ui.link('Open full-size image', artifact_url(image_artifact), new_tab=True).classes('text-sm')
+                    
+                    # Download button for image (served over HTTP, no bytes kept here)
+                    def download_image():
+                        ui.download(artifact_url(image_artifact), 'generated_image.png')
+                    
+                    ui.button('Download Image', on_click=download_image, icon='download').props('color=primary').classes('mt-2')
+            
+            async def build_prompt(entity):
+                context = await asyncio.to_thread(describe_entity, index, entity)
+                return build_image_prompt(entity, context, modifications_input.value or '')
+            
+            async def use_image(image_artifact):
+                workflow['image_id'] = image_artifact.id
+                shared_state.save_workflow(user_id, workflow)
+                variants = await thumbnails.ensure_variants(image_artifact)
+                show_image(image_artifact, variants['preview'])
+            
+            def add_to_gallery(entity, image_artifact, preview_artifact):
+                with gallery:
+                    with ui.card().classes('w-48 items-center'):
+                        ui.image(artifact_url(preview_artifact)).classes('w-44 rounded')
+                        ui.label(entity).classes('text-sm font-bold text-center')
+                        ui.button('Use for 3D', on_click=lambda: use_image(image_artifact)).props('flat dense size=sm')
+            
             async def generate_2d_image():
                 if not selected_entity.get('value'):
                     ui.notify('Please select an entity first', type='warning')
                     return
                 
                 # Check credits
-                current_credits = update_session_credits()
+                current_credits = await update_session_credits()
                 if current_credits < 1:
                     ui.notify('Insufficient credits. Please purchase more credits.', type='negative')
                     return
@@ -298,37 +496,26 @@ def main_app():
                 dialog.open()
                 
                 try:
-                    # Create prompt
-                    entity = selected_entity['value']
-                    modifications = modifications_input.value or ''
-                    prompt = f"{entity}"
-                    if modifications:
-                        prompt += f", {modifications}"
-                    
-                    # Generate image using asyncio to avoid blocking
-                    import asyncio
-                    loop = asyncio.get_event_loop()
-                    image_bytes = await loop.run_in_executor(None, generate_image, prompt)
-                    workflow_state['generated_image'] = image_bytes
-                    
-                    # Deduct credit
-                    user_id = app.storage.user.get(SESSION_USER_ID)
-                    if deduct_credits(user_id, 1):
-                        new_credits = update_session_credits()
-                        credit_label.text = f'Credits: {new_credits}'
-                    
-                    # Display image
-                    image_container.clear()
-                    with image_container:
-                        ui.label('Generated Image:').classes('font-bold mb-2')
-                        image_b64 = base64.b64encode(image_bytes).decode()
-                        ui.image(f'data:image/png;base64,{image_b64}').classes('max-w-md border rounded')
-                        
-                        # Download button for image
-                        def download_image():
-                            ui.download(image_bytes, 'generated_image.png')
-                        
-                        ui.button('Download Image', on_click=download_image, icon='download').props('color=primary').classes('mt-2')
+                    prompt = await build_prompt(selected_entity['value'])
+                    
+                    # Reserve the credit and queue; the worker commits it on success or refunds it
+                    job_id = await jobs.enqueue_image_job(user_id, prompt, 1)
+                    if job_id is None:
+                        raise Exception('Insufficient credits. Please purchase more credits.')
+                    job = await jobs.wait_for_job(job_id)
+                    if job.status == 'failed':
+                        raise Exception(job.error)
+                    image_artifact = jobs.result_artifact(job)
+                    if image_artifact is None:
+                        raise Exception('Generated image is no longer available')
+                    workflow['image_id'] = image_artifact.id
+                    shared_state.save_workflow(user_id, workflow)
+                    
+                    new_credits = await update_session_credits()
+                    credit_label.text = f'Credits: {new_credits}'
+                    
+                    variants = await thumbnails.ensure_variants(image_artifact)
+                    show_image(image_artifact, variants['preview'])
                     
                     dialog.close()
                     ui.notify('Image generated successfully!', type='positive')
@@ -337,7 +524,75 @@ def main_app():
                     dialog.close()
                     ui.notify(f'Error: {str(e)}', type='negative')
             
-            ui.button('Generate Image (1 Credit)', on_click=generate_2d_image, icon='image').classes('mt-4')
+            async def generate_batch():
+                entities = list(batch_entities['values'])
+                if not entities:
+                    ui.notify('Please select entities for the batch first', type='warning')
+                    return
+                
+                # Disabled up front so a double click cannot queue the batch twice
+                batch_button.disable()
+                try:
+                    # Check the whole batch is affordable before anything is queued
+                    current_credits = await update_session_credits()
+                    if current_credits < len(entities):
+                        ui.notify(f'Insufficient credits. Need {len(entities)} credits for this batch, you have {current_credits}.', type='negative')
+                        return
+                    
+                    try:
+                        prompts = await asyncio.gather(*(build_prompt(entity) for entity in entities))
+                        job_ids = await jobs.enqueue_image_batch(user_id, prompts, 1)
+                    except Exception as e:
+                        ui.notify(f'Error: {str(e)}', type='negative')
+                        return
+                    if job_ids is None:
+                        ui.notify('Insufficient credits. Please purchase more credits.', type='negative')
+                        return
+                    credit_label.text = f'💎 {await update_session_credits()} Credits'
+                    
+                    # Images run concurrently in the job workers and appear as each one finishes
+                    entity_by_job = dict(zip(job_ids, entities))
+                    failed = 0
+                    with gallery_status:
+                        gallery_status.clear()
+                        progress = ui.label(f'Generating {len(job_ids)} images...').classes('text-gray-600')
+                        spinner = ui.spinner()
+                    try:
+                        done = 0
+                        async for job in jobs.as_completed(job_ids):
+                            done += 1
+                            progress.text = f'{done} / {len(job_ids)} images finished'
+                            image_artifact = jobs.result_artifact(job) if job.status == 'done' else None
+                            if image_artifact is None:
+                                failed += 1
+                                ui.notify(f'{entity_by_job[job.id]}: {job.error or "image is no longer available"}', type='negative')
+                                continue
+                            variants = await thumbnails.ensure_variants(image_artifact)
+                            add_to_gallery(entity_by_job[job.id], image_artifact, variants['preview'])
+                            workflow['gallery'].append([entity_by_job[job.id], image_artifact.id])
+                            shared_state.save_workflow(user_id, workflow)
+                    finally:
+                        spinner.delete()
+                    
+                    credit_label.text = f'💎 {await update_session_credits()} Credits'
+                    if failed:
+                        ui.notify(f'{len(job_ids) - failed} of {len(job_ids)} images generated', type='warning')
+                    else:
+                        ui.notify(f'{len(job_ids)} images generated!', type='positive')
+                finally:
+                    batch_button.enable()
+            
+            with ui.row().classes('mt-4 gap-4'):
+                ui.button('Generate Image (1 Credit)', on_click=generate_2d_image, icon='image')
+                batch_button = ui.button('Generate Batch', on_click=generate_batch, icon='collections')
+            
+            def set_batch_selection(entities):
+                batch_entities['values'] = list(entities or [])
+                count = len(batch_entities['values'])
+                batch_button.text = f'Generate {count} Images ({count} Credit{"s" if count != 1 else ""})' if count else 'Generate Batch'
+            
+            gallery_status = ui.row().classes('items-center gap-2 mt-4')
+            gallery = ui.row().classes('w-full flex-wrap gap-4')
         
         # Step 3: 3D Model Generation
         with ui.card().classes('w-full shadow-lg hover:shadow-xl transition-shadow'):
@@ -358,8 +613,29 @@ def main_app():
             
             model_container = ui.column().classes('w-full items-center')
             
+            def show_model(model_artifact):
+                workflow['model_id'] = model_artifact.id
+                shared_state.save_workflow(user_id, workflow)
+                model_container.clear()
+                with model_container:
+                    ui.label('✅ 3D Model Generated Successfully!').classes('text-xl font-bold mb-4 text-green-600')
+                    ui.label(f'Model size: {model_artifact.size / 1024:.1f} KB').classes('text-gray-600 mb-4')
+                    
+                    # Download button
+                    def download_model():
+                        ui.download(artifact_url(model_artifact), 'model.glb')
+                    
+                    ui.button('Download .glb File', on_click=download_model, icon='download').props('color=primary size=lg')
+                    
+                    ui.label('You can view this .glb file in:').classes('mt-4 font-bold')
+                    with ui.column().classes('ml-6 text-gray-600'):
+                        ui.label('• Blender (free 3D software)')
+                        ui.label('• Windows 3D Viewer')
+                        ui.label('• Online viewers like gltf-viewer.donmccurdy.com')
+            
             async def generate_3d():
-                if not workflow_state.get('generated_image'):
+                image_artifact = artifact_store.get(user_id, workflow['image_id']) if workflow['image_id'] else None
+                if not image_artifact:
                     ui.notify('Please generate an image first', type='warning')
                     return
                 
@@ -368,7 +644,7 @@ def main_app():
                 credit_cost = 3 if selected_model == 'fast' else 1
                 
                 # Check credits
-                current_credits = update_session_credits()
+                current_credits = await update_session_credits()
                 if current_credits < credit_cost:
                     ui.notify(f'Insufficient credits. Need {credit_cost} credits for this model.', type='negative')
                     return
@@ -380,42 +656,29 @@ def main_app():
                 dialog.open()
                 
                 try:
-                    # Generate 3D model using asyncio to avoid blocking
-                    import asyncio
-                    loop = asyncio.get_event_loop()
-                    model_bytes = await loop.run_in_executor(None, generate_3d_model, workflow_state['generated_image'], selected_model)
-                    workflow_state['generated_3d_model'] = model_bytes
-                    
-                    # Save model to file
-                    model_path = Path('generated_model.glb')
-                    model_path.write_bytes(model_bytes)
-                    
-                    # Deduct credits based on model type
-                    user_id = app.storage.user.get(SESSION_USER_ID)
-                    if deduct_credits(user_id, credit_cost):
-                        new_credits = update_session_credits()
-                        credit_label.text = f'💎 {new_credits} Credits'
+                    # Queue the conversion; it keeps running if this page goes away
+                    image_bytes = await asyncio.to_thread(artifact_store.read, image_artifact)
+                    job_id = await jobs.enqueue_3d_job(user_id, image_bytes, selected_model, credit_cost)
+                    if job_id is None:
+                        raise Exception(f'Insufficient credits. Need {credit_cost} credits for this model.')
+                    job = await jobs.wait_for_job(job_id)
+                    if job.status == 'failed':
+                        raise Exception(job.error)
+                    model_artifact = jobs.result_artifact(job)
+                    if model_artifact is None:
+                        raise Exception('Generated model is no longer available')
+                    
+                    # Credits were charged by the worker
+                    new_credits = await update_session_credits()
+                    credit_label.text = f'💎 {new_credits} Credits'
                     
                     # Display download option
-                    model_container.clear()
-                    with model_container:
-                        ui.label('✅ 3D Model Generated Successfully!').classes('text-xl font-bold mb-4 text-green-600')
-                        ui.label(f'Model size: {len(model_bytes) / 1024:.1f} KB').classes('text-gray-600 mb-4')
-                        
-                        # Download button
-                        def download_model():
-                            ui.download(model_bytes, 'model.glb')
-                        
-                        ui.button('Download .glb File', on_click=download_model, icon='download').props('color=primary size=lg')
-                        
-                        ui.label('You can view this .glb file in:').classes('mt-4 font-bold')
-                        with ui.column().classes('ml-6 text-gray-600'):
-                            ui.label('• Blender (free 3D software)')
-                            ui.label('• Windows 3D Viewer')
-                            ui.label('• Online viewers like gltf-viewer.donmccurdy.com')
+                    show_model(model_artifact)
                     
                     dialog.close()
                     ui.notify('3D model generated successfully!', type='positive')
+                    if optimization := jobs.optimization_summary(job):
+                        ui.notify(optimization, type='info')
                     
                 except Exception as e:
                     dialog.close()
@@ -429,6 +692,49 @@ def main_app():
                 generate_button.text = f'Generate 3D Model ({credit_cost} Credit{"s" if credit_cost > 1 else ""})'
             
             model_select.on_value_change(lambda: update_button_text())
+            
+            # In multi-process mode the workflow follows the user across reloads and processes
+            async def restore_workflow():
+                saved = await shared_state.load_workflow(user_id)
+                if not saved:
+                    return
+                if saved.get('entities'):
+                    workflow['entities'] = saved['entities']
+                    show_entities(saved['entities'])
+                image_artifact = artifact_store.get(user_id, saved['image_id']) if saved.get('image_id') else None
+                if image_artifact:
+                    workflow['image_id'] = image_artifact.id
+                    variants = await thumbnails.ensure_variants(image_artifact)
+                    show_image(image_artifact, variants['preview'])
+                for entity, image_id in saved.get('gallery', []):
+                    gallery_artifact = artifact_store.get(user_id, image_id)
+                    if gallery_artifact:
+                        workflow['gallery'].append([entity, image_id])
+                        variants = await thumbnails.ensure_variants(gallery_artifact)
+                        add_to_gallery(entity, gallery_artifact, variants['preview'])
+                model_artifact = artifact_store.get(user_id, saved['model_id']) if saved.get('model_id') else None
+                if model_artifact:
+                    show_model(model_artifact)
+            
+            ui.timer(0, restore_workflow, once=True)
+            
+            # Pick up a conversion that was still pending when the page was left
+            async def resume_pending_job():
+                pending_job = await get_latest_job_async(user_id, '3d')
+                if pending_job and pending_job.status in ('queued', 'running'):
+                    with model_container:
+                        ui.label('A previous 3D model is still being generated...').classes('text-gray-600')
+                        ui.spinner(size='lg')
+                    job = await jobs.wait_for_job(pending_job.id)
+                    model_artifact = jobs.result_artifact(job) if job.status == 'done' else None
+                    if model_artifact:
+                        show_model(model_artifact)
+                        credit_label.text = f'💎 {await update_session_credits()} Credits'
+                    else:
+                        model_container.clear()
+                        ui.notify(f'Error: {job.error or "model is no longer available"}', type='negative')
+            
+            ui.timer(0, resume_pending_job, once=True)
         
         # Step 4: Custom Image to 3D
         with ui.card().classes('w-full shadow-lg hover:shadow-xl transition-shadow'):
@@ -437,7 +743,7 @@ def main_app():
                 ui.label('Step 4: Upload Custom Image for 3D Conversion').classes('text-2xl font-bold text-gray-800')
             ui.label('Upload your own image to convert it directly to a 3D model').classes('text-gray-600 mb-4')
             
-            custom_image_data = {'bytes': None}
+            custom_image_data = {'artifact_id': None}
             custom_image_preview = ui.column()
             custom_3d_container = ui.column().classes('w-full items-center')
             
@@ -449,16 +755,24 @@ def main_app():
                         content = await content
                     
                     if isinstance(content, bytes):
-                        custom_image_data['bytes'] = content
+                        suffix = Path(getattr(e.file, 'name', '')).suffix.lower()
+                        upload = await asyncio.to_thread(
+                            artifact_store.put, user_id, content, 'upload', suffix if suffix in ('.png', '.jpg', '.webp') else '.png'
+                        )
+                        custom_image_data['artifact_id'] = upload.id
                     else:
                         raise Exception(f"Unexpected content type: {type(content)}")
                     
                     # Show preview
+                    try:
+                        preview = (await thumbnails.ensure_variants(upload))['preview']
+                    except Exception:
+                        # Formats Pillow cannot read are shown as uploaded
+                        preview = upload
                     custom_image_preview.clear()
                     with custom_image_preview:
                         ui.label('Uploaded Image Preview:').classes('font-bold mb-2')
-                        image_b64 = base64.b64encode(content).decode()
-                        ui.image(f'data:image/png;base64,{image_b64}').classes('max-w-md border rounded')
+                        ui.image(artifact_url(preview)).classes('max-w-md border rounded')
                     
                     ui.notify('Image uploaded successfully', type='positive')
                 except Exception as ex:
@@ -482,7 +796,8 @@ def main_app():
             ).classes('w-full mb-4')
             
             async def generate_custom_3d():
-                if not custom_image_data['bytes']:
+                upload = artifact_store.get(user_id, custom_image_data['artifact_id']) if custom_image_data['artifact_id'] else None
+                if not upload:
                     ui.notify('Please upload an image first', type='warning')
                     return
                 
@@ -491,7 +806,7 @@ def main_app():
                 custom_credit_cost = 3 if selected_custom_model == 'fast' else 1
                 
                 # Check credits
-                current_credits = update_session_credits()
+                current_credits = await update_session_credits()
                 if current_credits < custom_credit_cost:
                     ui.notify(f'Insufficient credits. Need {custom_credit_cost} credits for this model.', type='negative')
                     return
@@ -503,30 +818,33 @@ def main_app():
                 dialog.open()
                 
                 try:
-                    # Generate 3D model using asyncio to avoid blocking
-                    import asyncio
-                    loop = asyncio.get_event_loop()
-                    model_bytes = await loop.run_in_executor(None, generate_3d_model, custom_image_data['bytes'], selected_custom_model)
-                    
-                    # Save model to file
-                    model_path = Path('custom_model.glb')
-                    model_path.write_bytes(model_bytes)
-                    
-                    # Deduct credits based on model type
-                    user_id = app.storage.user.get(SESSION_USER_ID)
-                    if deduct_credits(user_id, custom_credit_cost):
-                        new_credits = update_session_credits()
-                        credit_label.text = f'💎 {new_credits} Credits'
+                    # Queue the conversion; it keeps running if this page goes away
+                    image_bytes = await asyncio.to_thread(artifact_store.read, upload)
+                    job_id = await jobs.enqueue_3d_job(user_id, image_bytes, selected_custom_model, custom_credit_cost)
+                    if job_id is None:
+                        raise Exception(f'Insufficient credits. Need {custom_credit_cost} credits for this model.')
+                    job = await jobs.wait_for_job(job_id)
+                    if job.status == 'failed':
+                        raise Exception(job.error)
+                    model_artifact = jobs.result_artifact(job)
+                    if model_artifact is None:
+                        raise Exception('Generated model is no longer available')
+                    
+                    # Credits were charged by the worker
+                    new_credits = await update_session_credits()
+                    credit_label.text = f'💎 {new_credits} Credits'
                     
                     # Display download option
                     custom_3d_container.clear()
                     with custom_3d_container:
                         ui.label('✅ 3D Model Generated Successfully!').classes('text-xl font-bold mb-4 text-green-600')
-                        ui.label(f'Model size: {len(model_bytes) / 1024:.1f} KB').classes('text-gray-600 mb-4')
+                        ui.label(f'Model size: {model_artifact.size / 1024:.1f} KB').classes('text-gray-600 mb-4')
+                        if optimization := jobs.optimization_summary(job):
+                            ui.label(optimization).classes('text-gray-600 mb-4')
                         
                         # Download button
                         def download_custom_model():
-                            ui.download(model_bytes, 'custom_model.glb')
+                            ui.download(artifact_url(model_artifact), 'custom_model.glb')
                         
                         ui.button('Download .glb File', on_click=download_custom_model, icon='download').props('color=primary size=lg')
                         
@@ -581,10 +899,10 @@ def main_app():
                                 return
                             
                             # Simulate payment with password verification
-                            success, message = simulate_payment_success(user_id, password, 10)
+                            success, message = await asyncio.to_thread(simulate_payment_success, user_id, password, 10)
                             
                             if success:
-                                new_credits = update_session_credits()
+                                new_credits = await update_session_credits()
                                 credit_label.text = f'Credits: {new_credits}'
                                 ui.notify(f'✅ {message}', type='positive')
                                 password_dialog.close()
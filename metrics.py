@@ -0,0 +1,257 @@
+"""
+Minimal Prometheus-compatible metrics registry.
+Updates are a dict lookup and an add under a lock, cheap enough to leave on;
+render() produces the text exposition format served at /metrics.
+"""
+import time
+import asyncio
+import threading
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; the top buckets cover slow 3D generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Bytes, 1 KB to 64 MB in steps of 4x
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+_registry = []
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, key, value in self._samples():
+            lines.append(f'{name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Value that goes up and down, or is read from a callback at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """Read the value from function() whenever metrics are scraped."""
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def _samples(self):
+        samples = super()._samples()
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                samples.append((self.name, key, function()))
+            except Exception:
+                # A broken callback must not break the whole scrape
+                continue
+        return samples
+
+class Histogram(_Metric):
+    """Distribution of observations in cumulative buckets, plus sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Metrics shared by the app modules
+
+PROVIDER_LATENCY = Histogram(
+    'sculptor_provider_request_seconds', 'Latency of calls to external providers',
+    ('provider', 'operation', 'model_type')
+)
+PROVIDER_RESPONSE_BYTES = Histogram(
+    'sculptor_provider_response_bytes', 'Size of provider response payloads',
+    ('provider', 'operation', 'model_type'), buckets=SIZE_BUCKETS
+)
+GLB_BYTES = Histogram(
+    'sculptor_glb_bytes', 'Size of generated GLB models before and after optimization', ('stage',), buckets=SIZE_BUCKETS
+)
+PROVIDER_IN_FLIGHT = Gauge(
+    'sculptor_provider_in_flight', 'Provider calls currently waiting for a response',
+    ('provider', 'operation')
+)
+PROVIDER_RETRIES = Counter('sculptor_provider_retries_total', 'Provider attempts retried, by reason', ('provider', 'reason'))
+PROVIDER_HEDGES = Counter(
+    'sculptor_provider_hedges_total', 'Hedged provider requests, by which attempt answered first', ('provider', 'winner')
+)
+PROVIDER_TIMEOUT = Gauge('sculptor_provider_timeout_seconds', 'Current adaptive read timeout per provider', ('provider',))
+CIRCUIT_STATE = Gauge('sculptor_circuit_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)', ('provider',))
+OPERATION_LATENCY = Histogram(
+    'sculptor_operation_seconds', 'Latency of whole operations, including cache hits and fan-out',
+    ('operation', 'outcome')
+)
+EXTRACTION_FIRST_ENTITY = Histogram(
+    'sculptor_extraction_first_entity_seconds', 'Time from starting a streamed extraction to its first entity'
+)
+LOCAL_EXTRACTIONS = Counter(
+    'sculptor_local_extractions_total', 'Entity extractions done locally, by reason (mode or fallback)', ('reason',)
+)
+ERRORS = Counter('sculptor_errors_total', 'Errors by operation and exception type', ('operation', 'type'))
+CACHE_LOOKUPS = Counter('sculptor_cache_lookups_total', 'Cache lookups by cache (images, models, entities, users) and result', ('cache', 'result'))
+DB_LATENCY = Histogram('sculptor_db_query_seconds', 'Latency of database helpers', ('operation',))
+CREDIT_OPERATIONS = Counter(
+    'sculptor_credit_operations_total', 'Credit operations by outcome (ok or rejected)', ('operation', 'result')
+)
+CREDITS_MOVED = Counter('sculptor_credits_total', 'Credits moved by operation', ('operation',))
+JOB_LATENCY = Histogram(
+    'sculptor_job_seconds', 'Background job run time from claim to finish', ('kind', 'model_type', 'status')
+)
+JOB_QUEUE_WAIT = Histogram('sculptor_job_queue_wait_seconds', 'Time jobs spent queued before a worker claimed them', ('kind',))
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    'sculptor_executor_queue_depth', 'Work items waiting for a thread, process or event loop', ('executor',)
+)
+HTTP_LATENCY = Histogram(
+    'sculptor_http_request_seconds', 'HTTP request latency by route template', ('method', 'route', 'status')
+)
+LOOP_LAG = Histogram(
+    'sculptor_event_loop_lag_seconds', 'Delay between when a loop heartbeat was due and when it ran', ('loop',),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+LOOP_STALLS = Counter('sculptor_event_loop_stalls_total', 'Times a loop was blocked longer than the stall threshold', ('loop',))
+
+@contextmanager
+def track_provider_call(provider: str, operation: str, model_type: str = ''):
+    """Count a provider call as in flight and record its latency and any error."""
+    PROVIDER_IN_FLIGHT.inc(provider=provider, operation=operation)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERRORS.inc(operation=operation, type=type(e).__name__)
+        raise
+    finally:
+        PROVIDER_IN_FLIGHT.dec(provider=provider, operation=operation)
+        PROVIDER_LATENCY.observe(time.perf_counter() - start, provider=provider, operation=operation, model_type=model_type)
+
+def timed(operation: str):
+    """
+    Decorator recording the latency of a sync or async function, labelled ok or error.
+    Error types are counted where they happen, e.g. by track_provider_call.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                outcome = 'error'
+                try:
+                    result = await func(*args, **kwargs)
+                    outcome = 'ok'
+                    return result
+                finally:
+                    OPERATION_LATENCY.observe(time.perf_counter() - start, operation=operation, outcome=outcome)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = func(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                OPERATION_LATENCY.observe(time.perf_counter() - start, operation=operation, outcome=outcome)
+        return wrapper
+    return decorator
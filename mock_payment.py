@@ -24,7 +24,7 @@ def simulate_payment_success(user_id: int, password: str, credits: int = 10) ->
     
     # Add credits if password is correct
     try:
-        add_credits(user_id, credits)
+        add_credits(user_id, credits, 'mock payment')
         return True, f"Successfully added {credits} credits"
     except Exception as e:
         return False, f"Failed to add credits: {str(e)}"
@@ -0,0 +1,338 @@
+"""
+Headless batch pipeline: documents -> entities -> images -> 3D models.
+
+    python pipeline.py docs/ --account studio --output assets/ --models point-aware
+
+Each stage runs with its own concurrency limit and feeds the next one as soon
+as an item is ready. Progress is recorded in a manifest file after every item,
+so an interrupted run picks up where it stopped; failed items are retried on
+the next run. Credits are reserved from the named account before each paid
+call and refunded if it fails; results already in the generation cache are
+free.
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+from dotenv import load_dotenv
+from database import init_db_async, close_async, get_user_async, reserve_credits_async, commit_reservation_async, refund_reservation_async
+from api_clients import generate_image_async, generate_3d_model_async, cached_image_async, cached_3d_model_async
+from rag import extract_document_entities_async
+from ingest import DocumentStore
+import http_client
+
+load_dotenv()
+
+EXTRACT_CONCURRENCY = int(os.getenv('PIPELINE_EXTRACT_CONCURRENCY', 2))
+IMAGE_CONCURRENCY = int(os.getenv('PIPELINE_IMAGE_CONCURRENCY', 8))
+MODEL_CONCURRENCY = int(os.getenv('PIPELINE_MODEL_CONCURRENCY', 4))
+
+DOCUMENT_SUFFIXES = ('.txt', '.md')
+IMAGE_CREDITS = 1
+MODEL_CREDITS = {'point-aware': 1, 'fast': 3}
+READ_BLOCK_BYTES = 64 * 1024
+
+def slugify(name: str) -> str:
+    """File-name-safe slug, with a short hash so similar names never collide."""
+    slug = re.sub(r'[^a-z0-9]+', '-', name.casefold()).strip('-')[:48] or 'entity'
+    return f'{slug}-{hashlib.sha256(name.encode("utf-8")).hexdigest()[:8]}'
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class Manifest:
+    """
+    JSON record of every document and entity and how far each has got.
+    Saved atomically, so a crash never leaves a half-written file.
+    """
+
+    def __init__(self, path: Path, data: dict):
+        self.path = path
+        self.data = data
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def load(cls, path: Path, account: str) -> 'Manifest':
+        if path.exists():
+            data = json.loads(path.read_text(encoding='utf-8'))
+        else:
+            data = {'account': account, 'documents': {}, 'entities': {}}
+        return cls(path, data)
+
+    @property
+    def documents(self) -> dict:
+        return self.data['documents']
+
+    @property
+    def entities(self) -> dict:
+        return self.data['entities']
+
+    def _write(self, payload: str):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix='.manifest-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp, self.path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    async def save(self):
+        async with self._lock:
+            payload = json.dumps(self.data, indent=2, ensure_ascii=False)
+            await asyncio.to_thread(self._write, payload)
+
+class Pipeline:
+    """Runs the three stages over asyncio queues, one worker pool per stage."""
+
+    def __init__(self, manifest: Manifest, user_id: int, output_dir: Path, model_type: str | None = None,
+                 modifications: str = '', extract_concurrency: int = EXTRACT_CONCURRENCY,
+                 image_concurrency: int = IMAGE_CONCURRENCY, model_concurrency: int = MODEL_CONCURRENCY):
+        self.manifest = manifest
+        self.user_id = user_id
+        self.output_dir = output_dir
+        self.model_type = model_type
+        self.modifications = modifications
+        self.concurrency = {'extract': extract_concurrency, 'image': image_concurrency, 'model': model_concurrency}
+        self.queues = {stage: asyncio.Queue() for stage in self.concurrency}
+        self.out_of_credits = False
+        self._queued = set()
+
+    def _prompt(self, entity: str) -> str:
+        return f'{entity}, {self.modifications}' if self.modifications else entity
+
+    def _done(self, record: dict | None) -> bool:
+        return bool(record) and record.get('status') == 'done' and Path(self.output_dir / record['path']).exists()
+
+    async def _write_output(self, path: Path, data: bytes):
+        (self.output_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread((self.output_dir / path).write_bytes, data)
+
+    async def _charge(self, amount: int, reason: str, produce, from_cache=None) -> tuple[bool, str | None]:
+        """
+        Reserve credits, run produce() and commit on success or refund on failure.
+        from_cache(), if given, runs first and returns True when it served the
+        result from the generation cache, which costs nothing.
+        Returns (ok, error).
+        """
+        try:
+            if from_cache is not None and await from_cache():
+                return True, None
+        except Exception as e:
+            return False, str(e)
+        if self.out_of_credits:
+            return False, 'Insufficient credits'
+        reservation_id = await reserve_credits_async(self.user_id, amount, reason)
+        if reservation_id is None:
+            # Stop paying for anything else; a later run resumes once credits are added
+            self.out_of_credits = True
+            return False, 'Insufficient credits'
+        try:
+            await produce()
+        except BaseException as e:
+            await refund_reservation_async(reservation_id)
+            if not isinstance(e, Exception):
+                raise
+            return False, str(e)
+        await commit_reservation_async(reservation_id)
+        return True, None
+
+    def _queue_entity(self, entity: str, document: str):
+        key = entity.casefold()
+        record = self.manifest.entities.get(key)
+        if record is None:
+            record = self.manifest.entities[key] = {'name': entity, 'slug': slugify(entity), 'documents': []}
+        if document not in record['documents']:
+            record['documents'].append(document)
+        if key not in self._queued:
+            self._queued.add(key)
+            self.queues['image'].put_nowait(key)
+
+    async def _extract(self, document: tuple[Path, str]):
+        path, name = document
+        record = self.manifest.documents.get(name, {})
+        digest = await asyncio.to_thread(file_digest, path)
+        if record.get('status') != 'done' or record.get('sha256') != digest:
+            store = DocumentStore()
+            try:
+                async def read_blocks():
+                    with open(path, 'rb') as f:
+                        while block := await asyncio.to_thread(f.read, READ_BLOCK_BYTES):
+                            yield block
+
+                await store.add(name, read_blocks())
+                entities = await extract_document_entities_async(store.documents)
+                record = {'sha256': digest, 'status': 'done', 'entities': [e for e in entities if e != 'No entities found']}
+                print(f'Extracted {len(record["entities"])} entities from {name}')
+            except Exception as e:
+                record = {'sha256': digest, 'status': 'failed', 'error': str(e), 'entities': []}
+                print(f'Failed to extract entities from {name}: {e}')
+            finally:
+                store.close()
+            self.manifest.documents[name] = record
+            await self.manifest.save()
+        for entity in record['entities']:
+            self._queue_entity(entity, name)
+
+    async def _generate_image(self, key: str):
+        record = self.manifest.entities[key]
+        if not self._done(record.get('image')):
+            path = Path('images') / f'{record["slug"]}.png'
+            prompt = self._prompt(record['name'])
+
+            async def from_cache():
+                image_bytes = await cached_image_async(prompt)
+                if image_bytes is None:
+                    return False
+                await self._write_output(path, image_bytes)
+                return True
+
+            async def produce():
+                await self._write_output(path, await generate_image_async(prompt, check_cache=False))
+
+            ok, error = await self._charge(IMAGE_CREDITS, 'pipeline:image', produce, from_cache)
+            record['image'] = {'status': 'done' if ok else 'failed', 'path': str(path), 'error': error}
+            await self.manifest.save()
+            print(f'Image for {record["name"]}: {"done" if ok else error}')
+            if not ok:
+                return
+        if self.model_type:
+            self.queues['model'].put_nowait(key)
+
+    async def _generate_model(self, key: str):
+        record = self.manifest.entities[key]
+        if self._done(record.get('model')) and record['model'].get('model_type') == self.model_type:
+            return
+        path = Path('models') / f'{record["slug"]}.glb'
+        image = {}
+
+        async def from_cache():
+            image['bytes'] = await asyncio.to_thread((self.output_dir / record['image']['path']).read_bytes)
+            model_bytes = await cached_3d_model_async(image['bytes'], self.model_type)
+            if model_bytes is None:
+                return False
+            await self._write_output(path, model_bytes)
+            return True
+
+        async def produce():
+            await self._write_output(path, await generate_3d_model_async(image['bytes'], self.model_type, check_cache=False))
+
+        ok, error = await self._charge(MODEL_CREDITS[self.model_type], f'pipeline:3d:{self.model_type}', produce, from_cache)
+        record['model'] = {'status': 'done' if ok else 'failed', 'path': str(path), 'model_type': self.model_type, 'error': error}
+        await self.manifest.save()
+        print(f'Model for {record["name"]}: {"done" if ok else error}')
+
+    async def _stage_worker(self, stage: str, handler):
+        queue = self.queues[stage]
+        while True:
+            item = await queue.get()
+            try:
+                await handler(item)
+            except Exception as e:
+                print(f'Unexpected error in {stage} stage: {e}')
+            finally:
+                queue.task_done()
+
+    async def run(self, documents: list[Path], root: Path):
+        for path in documents:
+            self.queues['extract'].put_nowait((path, str(path.relative_to(root))))
+
+        handlers = {'extract': self._extract, 'image': self._generate_image, 'model': self._generate_model}
+        workers = [
+            asyncio.create_task(self._stage_worker(stage, handlers[stage]))
+            for stage, count in self.concurrency.items()
+            for _ in range(count)
+        ]
+        try:
+            # Upstream stages enqueue before marking their item done, so joining in order drains everything
+            for stage in ('extract', 'image', 'model'):
+                await self.queues[stage].join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.manifest.save()
+
+    def summary(self) -> dict:
+        def count(stage, status):
+            return sum(1 for record in self.manifest.entities.values() if (record.get(stage) or {}).get('status') == status)
+        return {
+            'documents': len(self.manifest.documents),
+            'documents_failed': sum(1 for record in self.manifest.documents.values() if record.get('status') != 'done'),
+            'entities': len(self.manifest.entities),
+            'images': count('image', 'done'),
+            'images_failed': count('image', 'failed'),
+            'models': count('model', 'done'),
+            'models_failed': count('model', 'failed'),
+        }
+
+def find_documents(root: Path) -> list[Path]:
+    return sorted(path for path in root.rglob('*') if path.is_file() and path.suffix.lower() in DOCUMENT_SUFFIXES)
+
+async def run_pipeline(args) -> dict:
+    await init_db_async()
+    try:
+        user = await get_user_async(args.account)
+        if user is None:
+            raise Exception(f"Failed to find account '{args.account}'")
+        documents = find_documents(args.documents)
+        if not documents:
+            raise Exception(f"Failed to find any {'/'.join(DOCUMENT_SUFFIXES)} documents in {args.documents}")
+
+        manifest = Manifest.load(args.manifest or args.output / 'manifest.json', args.account)
+        if manifest.data.get('account') != args.account:
+            raise Exception(f"Manifest belongs to account '{manifest.data.get('account')}', not '{args.account}'")
+        pipeline = Pipeline(
+            manifest, user.id, args.output,
+            model_type=None if args.models == 'none' else args.models,
+            modifications=args.modifications,
+            extract_concurrency=args.extract_concurrency,
+            image_concurrency=args.image_concurrency,
+            model_concurrency=args.model_concurrency,
+        )
+        await pipeline.run(documents, args.documents)
+        summary = pipeline.summary()
+        summary['out_of_credits'] = pipeline.out_of_credits
+        return summary
+    finally:
+        await http_client.aclose()
+        await close_async()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('documents', type=Path, help='directory of .txt and .md documents')
+    parser.add_argument('--account', required=True, help='username whose credits pay for the run')
+    parser.add_argument('--output', type=Path, default=Path('pipeline_output'))
+    parser.add_argument('--manifest', type=Path, help='progress file (default: OUTPUT/manifest.json)')
+    parser.add_argument('--models', choices=('none', 'point-aware', 'fast'), default='none', help='also convert images to 3D')
+    parser.add_argument('--modifications', default='', help='style text appended to every image prompt')
+    parser.add_argument('--extract-concurrency', type=int, default=EXTRACT_CONCURRENCY)
+    parser.add_argument('--image-concurrency', type=int, default=IMAGE_CONCURRENCY)
+    parser.add_argument('--model-concurrency', type=int, default=MODEL_CONCURRENCY)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        summary = asyncio.run(run_pipeline(args))
+    except Exception as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 2
+    print(json.dumps(summary, indent=2))
+    if summary['out_of_credits']:
+        print('Stopped charging: the account ran out of credits. Add credits and run again to resume.', file=sys.stderr)
+    failed = summary['documents_failed'] + summary['images_failed'] + summary['models_failed']
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,77 +1,437 @@
 """RAG functionality for document analysis and entity extraction."""
 import os
-import requests
+import re
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import http_client
+from cache import DiskCache, make_key
+from ingest import Document
+from local_extractor import extract_entities_local
+from metrics import track_provider_call, timed, PROVIDER_RESPONSE_BYTES, ERRORS, CACHE_LOOKUPS, LOCAL_EXTRACTIONS, OPERATION_LATENCY, EXTRACTION_FIRST_ENTITY
+from semantic_index import SemanticIndex, tokenize
 
 load_dotenv()
 
-def extract_entities(documents_text: str) -> list[str]:
+logger = logging.getLogger(__name__)
+
+TOGETHER_BASE_URL = os.getenv('TOGETHER_BASE_URL', 'https://api.together.xyz').rstrip('/')
+TOGETHER_CHAT_URL = f'{TOGETHER_BASE_URL}/v1/chat/completions'
+EXTRACTION_MODEL = 'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo'
+
+# Chunking settings for large documents (token counts are estimates)
+CHARS_PER_TOKEN = 4
+CHUNK_TOKENS = int(os.getenv('EXTRACTION_CHUNK_TOKENS', 2000))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('EXTRACTION_CHUNK_OVERLAP', 200))
+MAX_CONCURRENT_CHUNKS = int(os.getenv('EXTRACTION_CONCURRENCY', 4))
+# Stream completions so entities can be shown while the model is still writing
+EXTRACTION_STREAMING = os.getenv('EXTRACTION_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+
+# 'llm' always calls the model, 'local' never does, 'auto' handles inputs up to LOCAL_EXTRACTION_MAX_CHARS locally
+EXTRACTION_MODE = os.getenv('EXTRACTION_MODE', 'auto').lower()
+LOCAL_EXTRACTION_MAX_CHARS = int(os.getenv('LOCAL_EXTRACTION_MAX_CHARS', 1000))
+# Use the local extractor when the provider call fails instead of failing the analysis
+EXTRACTION_FALLBACK = os.getenv('EXTRACTION_FALLBACK', 'true').lower() in ('1', 'true', 'yes')
+
+# Entities per document, keyed by the document's content hash and the extraction settings
+entity_cache = DiskCache('entities', int(os.getenv('ENTITY_CACHE_MAX_MB', 16)) * 1024 * 1024, suffix='.json')
+
+# Retrieved description added to image prompts
+ENTITY_CONTEXT_CHARS = int(os.getenv('ENTITY_CONTEXT_CHARS', 400))
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+_PRONOUN_START = re.compile(r'^(he|she|it|they|his|her|its|their)\b', re.IGNORECASE)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting prompts."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def chunk_text(text: str, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list[str]:
     """
-    Extract characters and objects from documents using Together AI API.
-    Returns a list of unique entity names.
+    Split text into overlapping chunks of roughly chunk_tokens each.
+    Chunks break on whitespace so words are never cut in half.
     """
-    try:
-        # Create prompt for entity extraction
-        prompt = f"""Extract a list of all unique characters and objects from the following text.
+    words = text.split()
+    chunk_chars = chunk_tokens * CHARS_PER_TOKEN
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+
+    chunks = []
+    start = 0
+    while start < len(words):
+        # Grow the chunk until the character budget is spent
+        end = start
+        size = 0
+        while end < len(words) and (size + len(words[end]) + 1 <= chunk_chars or end == start):
+            size += len(words[end]) + 1
+            end += 1
+        chunks.append(' '.join(words[start:end]))
+        if end >= len(words):
+            break
+
+        # Step back far enough to repeat overlap_chars of context
+        next_start = end
+        overlap = 0
+        while next_start > start + 1 and overlap + len(words[next_start - 1]) + 1 <= overlap_chars:
+            next_start -= 1
+            overlap += len(words[next_start]) + 1
+        start = next_start
+    return chunks
+
+def parse_entities(content: str) -> list[str]:
+    """Parse a one-name-per-line LLM response into a list of names."""
+    entities = []
+    if content:
+        lines = content.strip().split('\n')
+        for line in lines:
+            line = line.strip()
+            # Remove common prefixes like "- ", "* ", numbers, etc.
+            if line:
+                # Clean up the line
+                cleaned = line.lstrip('-*•0123456789. ')
+                if cleaned and len(cleaned) > 1:
+                    entities.append(cleaned)
+    return entities
+
+def dedup_entities(entities: list[str]) -> list[str]:
+    """Remove case-insensitive duplicates while preserving order."""
+    seen = set()
+    unique_entities = []
+    for entity in entities:
+        if entity.lower() not in seen:
+            seen.add(entity.lower())
+            unique_entities.append(entity)
+    return unique_entities
+
+def use_local_extraction(text_chars: int) -> bool:
+    """Whether EXTRACTION_MODE sends an input of this size to the local extractor."""
+    return EXTRACTION_MODE == 'local' or (EXTRACTION_MODE == 'auto' and text_chars <= LOCAL_EXTRACTION_MAX_CHARS)
+
+def _extract_locally(pieces, reason: str, error: Exception = None) -> list[str]:
+    """Run the local extractor, recording why it was used instead of the model."""
+    if error is not None:
+        if not EXTRACTION_FALLBACK:
+            raise error
+        logger.warning(f'Entity extraction failed, using the local extractor instead: {error}')
+    LOCAL_EXTRACTIONS.inc(reason=reason)
+    return extract_entities_local(pieces)
+
+def describe_entity(index: SemanticIndex, entity: str, max_chars: int = ENTITY_CONTEXT_CHARS) -> str:
+    """
+    Collect sentences about entity from the passages the index retrieves for it.
+    A sentence is kept if it names the entity, or directly follows one that
+    does and starts with a pronoun ("He wore gleaming silver armor").
+    Returns '' when the documents say nothing about it.
+    """
+    names = {word for word in tokenize(entity) if len(word) > 2}
+    if not names:
+        return ''
+    sentences = []
+    for passage in index.search(entity, k=3):
+        follows_mention = False
+        for sentence in _SENTENCE_END.split(passage.text):
+            sentence = sentence.strip()
+            mentions = bool(names & set(tokenize(sentence)))
+            if sentence and (mentions or (follows_mention and _PRONOUN_START.match(sentence))) and sentence not in sentences:
+                sentences.append(sentence)
+            follows_mention = mentions or (follows_mention and bool(_PRONOUN_START.match(sentence)))
+
+    context = ''
+    for sentence in sentences:
+        if len(context) + len(sentence) + 1 > max_chars:
+            break
+        context = f'{context} {sentence}'.strip()
+    return context
+
+def build_image_prompt(entity: str, context: str = '', modifications: str = '') -> str:
+    """Image prompt for entity, described by retrieved context and followed by style modifications."""
+    prompt = f"{entity}. {context.rstrip('.')}" if context else f"{entity}"
+    if modifications:
+        prompt += f", {modifications}"
+    return prompt
+
+def _build_request(documents_text: str) -> tuple[dict, dict]:
+    """Build headers and JSON body for an extraction call over documents_text."""
+    # Create prompt for entity extraction
+    prompt = f"""Extract a list of all unique characters and objects from the following text.
 Return only the names, one per line, without numbering or additional text.
 
 Text:
 {documents_text}
 
 Characters and Objects:"""
-        
-        # Call Together AI API directly
-        api_key = os.getenv('TOGETHER_API_KEY')
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            'model': 'meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo',
-            'messages': [
-                {'role': 'system', 'content': 'You are a precise entity extraction assistant. Extract only character names and object names from the text. Return each name on a new line without any numbering, bullets, or extra text.'},
-                {'role': 'user', 'content': prompt}
-            ],
-            'max_tokens': 500,
-            'temperature': 0.1
-        }
-        
-        response = requests.post(
-            'https://api.together.xyz/v1/chat/completions',
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"API error: {response.status_code} - {response.text}")
-        
-        result = response.json()
-        content = result['choices'][0]['message']['content']
-        
-        # Parse the response into a list
-        entities = []
-        if content:
-            lines = content.strip().split('\n')
-            for line in lines:
-                line = line.strip()
-                # Remove common prefixes like "- ", "* ", numbers, etc.
-                if line:
-                    # Clean up the line
-                    cleaned = line.lstrip('-*•0123456789. ')
-                    if cleaned and len(cleaned) > 1:
-                        entities.append(cleaned)
-        
+
+    # Call Together AI API directly
+    api_key = os.getenv('TOGETHER_API_KEY')
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+
+    data = {
+        'model': EXTRACTION_MODEL,
+        'messages': [
+            {'role': 'system', 'content': 'You are a precise entity extraction assistant. Extract only character names and object names from the text. Return each name on a new line without any numbering, bullets, or extra text.'},
+            {'role': 'user', 'content': prompt}
+        ],
+        'max_tokens': 500,
+        'temperature': 0.1
+    }
+    return headers, data
+
+def _parse_response(response) -> list[str]:
+    """Check status and parse entities from a chat completion response."""
+    PROVIDER_RESPONSE_BYTES.observe(len(response.content), provider='together', operation='extract_entities', model_type=EXTRACTION_MODEL)
+    if response.status_code != 200:
+        ERRORS.inc(operation='extract_entities', type=f'HTTP {response.status_code}')
+        raise Exception(f"API error: {response.status_code} - {response.text}")
+
+    result = response.json()
+    content = result['choices'][0]['message']['content']
+
+    # Parse the response into a list
+    return parse_entities(content)
+
+def _request_entities(documents_text: str) -> list[str]:
+    """Run a single Together AI extraction call over documents_text."""
+    headers, data = _build_request(documents_text)
+    with track_provider_call('together', 'extract_entities', EXTRACTION_MODEL):
+        response = http_client.post('together', TOGETHER_CHAT_URL, headers=headers, json=data)
+    return _parse_response(response)
+
+async def _request_entities_async(documents_text: str) -> list[str]:
+    """Async counterpart of _request_entities."""
+    headers, data = _build_request(documents_text)
+    with track_provider_call('together', 'extract_entities', EXTRACTION_MODEL):
+        # Extraction is idempotent, so a slow call can be hedged with a second one
+        response = await http_client.async_post('together', TOGETHER_CHAT_URL, hedge=True, headers=headers, json=data)
+    return _parse_response(response)
+
+async def _stream_entities_async(documents_text: str) -> AsyncIterator[str]:
+    """
+    Streaming counterpart of _request_entities_async.
+    Yields each name as soon as its line of the completion is complete.
+    """
+    headers, data = _build_request(documents_text)
+    data['stream'] = True
+    with track_provider_call('together', 'extract_entities_stream', EXTRACTION_MODEL):
+        response = await http_client.async_post_stream('together-stream', TOGETHER_CHAT_URL, headers=headers, json=data)
+        try:
+            if response.status_code != 200:
+                ERRORS.inc(operation='extract_entities_stream', type=f'HTTP {response.status_code}')
+                raise Exception(f"API error: {response.status_code} - {response.text}")
+
+            # Server-sent events: one "data: {json}" line per token batch, then "data: [DONE]"
+            pending = ''
+            received = 0
+            async for event in response.aiter_lines():
+                received += len(event)
+                if not event.startswith('data:'):
+                    continue
+                payload = event[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                choices = json.loads(payload).get('choices') or [{}]
+                pending += choices[0].get('delta', {}).get('content') or ''
+                *lines, pending = pending.split('\n')
+                for line in lines:
+                    for entity in parse_entities(line):
+                        yield entity
+            for entity in parse_entities(pending):
+                yield entity
+            PROVIDER_RESPONSE_BYTES.observe(received, provider='together', operation='extract_entities_stream', model_type=EXTRACTION_MODEL)
+        finally:
+            await response.aclose()
+
+def _resolve_mode(documents_text: str, mode: str) -> str:
+    if mode == 'auto':
+        if use_local_extraction(len(documents_text)):
+            return 'local'
+        return 'chunked' if estimate_tokens(documents_text) > CHUNK_TOKENS else 'single'
+    return mode
+
+@timed('extract_entities')
+def extract_entities(documents_text: str, mode: str = 'auto') -> list[str]:
+    """
+    Extract characters and objects from documents using Together AI API.
+
+    Args:
+        documents_text: Combined text of the uploaded documents
+        mode: 'single' sends one prompt, 'chunked' splits the text into
+            overlapping chunks extracted in parallel, 'local' uses the
+            heuristic extractor without a model call, 'auto' picks local for
+            short text (see EXTRACTION_MODE) and chunked once the text
+            exceeds one chunk
+
+    Returns a list of unique entity names. If the provider fails, the local
+    extractor's result is returned instead unless EXTRACTION_FALLBACK is off.
+    """
+    try:
+        mode = _resolve_mode(documents_text, mode)
+        if mode == 'local':
+            entities = _extract_locally(documents_text, 'mode')
+        else:
+            try:
+                if mode == 'chunked':
+                    chunks = chunk_text(documents_text)
+                    # Map: extract each chunk concurrently, bounded by MAX_CONCURRENT_CHUNKS
+                    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_CHUNKS, len(chunks)) or 1) as executor:
+                        chunk_results = list(executor.map(_request_entities, chunks))
+                    # Reduce: flatten in document order, dedup below
+                    entities = [entity for chunk_entities in chunk_results for entity in chunk_entities]
+                else:
+                    entities = _request_entities(documents_text)
+            except Exception as e:
+                entities = _extract_locally(documents_text, 'fallback', e)
+
         # Remove duplicates while preserving order
-        seen = set()
-        unique_entities = []
-        for entity in entities:
-            if entity.lower() not in seen:
-                seen.add(entity.lower())
-                unique_entities.append(entity)
-        
+        unique_entities = dedup_entities(entities)
+
+        return unique_entities if unique_entities else ["No entities found"]
+
+    except Exception as e:
+        raise Exception(f"Failed to extract entities: {str(e)}")
+
+async def _extract_chunks_async(chunks: Iterable[str], semaphore: asyncio.Semaphore, emit=None) -> list[str]:
+    """
+    Extract every chunk, at most as many at once as semaphore allows, and
+    return the entities in chunk order. Chunks are pulled lazily, one per
+    free slot. With emit, completions are streamed and emit(entity) is called
+    for each name as soon as it is read.
+    """
+    tasks = []
+
+    async def extract_chunk(chunk: str) -> list[str]:
+        try:
+            if emit is None:
+                return await _request_entities_async(chunk)
+            entities = []
+            async for entity in _stream_entities_async(chunk):
+                entities.append(entity)
+                emit(entity)
+            return entities
+        finally:
+            semaphore.release()
+
+    try:
+        for chunk in chunks:
+            # Wait for a free slot before reading the next chunk
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(extract_chunk(chunk)))
+        chunk_results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return [entity for chunk_entities in chunk_results for entity in chunk_entities]
+
+def _entity_cache_key(document: Document) -> str:
+    return make_key(
+        digest=document.digest,
+        model=EXTRACTION_MODEL,
+        chunk_tokens=CHUNK_TOKENS,
+        overlap_tokens=CHUNK_OVERLAP_TOKENS
+    )
+
+def cached_entities(document: Document) -> list[str] | None:
+    """Entities previously extracted from a document with the same content, or None."""
+    data = entity_cache.get(_entity_cache_key(document))
+    CACHE_LOOKUPS.inc(cache='entities', result='hit' if data is not None else 'miss')
+    return json.loads(data) if data is not None else None
+
+async def _extract_document_async(document: Document, semaphore: asyncio.Semaphore, emit=None) -> list[str]:
+    """
+    Entities of one document: short documents go to the local extractor,
+    others come from the cache or are extracted chunk by chunk and then cached.
+    """
+    def emit_all(entities: list[str]) -> list[str]:
+        if emit is not None:
+            for entity in entities:
+                emit(entity)
+        return entities
+
+    if use_local_extraction(document.text_chars):
+        # Off the event loop: a large document takes seconds and may be read from a spool file
+        return emit_all(await asyncio.to_thread(_extract_locally, document.iter_text(), 'mode'))
+    entities = cached_entities(document)
+    if entities is not None:
+        return emit_all(entities)
+    chunks = document.iter_chunks(CHUNK_TOKENS * CHARS_PER_TOKEN, CHUNK_OVERLAP_TOKENS * CHARS_PER_TOKEN)
+    try:
+        entities = dedup_entities(await _extract_chunks_async(chunks, semaphore, emit))
+    except Exception as e:
+        # Not cached, so the model is asked again once the provider recovers
+        return emit_all(await asyncio.to_thread(_extract_locally, document.iter_text(), 'fallback', e))
+    # Only complete results are cached; a failed chunk raises before this point
+    entity_cache.put(_entity_cache_key(document), json.dumps(entities).encode('utf-8'))
+    return entities
+
+async def _extract_documents_async(documents: Iterable[Document], emit=None) -> list[str]:
+    """Extract all documents concurrently, sharing one MAX_CONCURRENT_CHUNKS budget."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHUNKS)
+    tasks = [asyncio.create_task(_extract_document_async(document, semaphore, emit)) for document in documents]
+    try:
+        document_results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return [entity for document_entities in document_results for entity in document_entities]
+
+async def _unique_stream(produce, operation: str) -> AsyncIterator[str]:
+    """
+    Run produce(emit) in the background and yield each new unique entity it
+    emits, as soon as it is emitted. Errors from produce are re-raised here.
+    """
+    results = asyncio.Queue()
+    finished = object()
+
+    async def run():
+        try:
+            await produce(results.put_nowait)
+            results.put_nowait(finished)
+        except Exception as e:
+            results.put_nowait(e)
+
+    start = time.perf_counter()
+    outcome = 'error'
+    seen = set()
+    producer = asyncio.create_task(run())
+    try:
+        while (item := await results.get()) is not finished:
+            if isinstance(item, Exception):
+                raise Exception(f"Failed to extract entities: {str(item)}")
+            if item.lower() in seen:
+                continue
+            if not seen:
+                EXTRACTION_FIRST_ENTITY.observe(time.perf_counter() - start)
+            seen.add(item.lower())
+            yield item
+        outcome = 'ok'
+    finally:
+        producer.cancel()
+        OPERATION_LATENCY.observe(time.perf_counter() - start, operation=operation, outcome=outcome)
+
+@timed('extract_entities')
+async def extract_document_entities_async(documents: Iterable[Document]) -> list[str]:
+    """
+    Extract entities from ingested documents, one document at a time.
+    Results are cached by each document's content hash, so re-analyzing a set
+    only calls the model for documents it has not seen before.
+    """
+    try:
+        unique_entities = dedup_entities(await _extract_documents_async(documents))
+
         return unique_entities if unique_entities else ["No entities found"]
-        
+
     except Exception as e:
         raise Exception(f"Failed to extract entities: {str(e)}")
+
+def stream_document_entities_async(documents: Iterable[Document]) -> AsyncIterator[str]:
+    """
+    Streaming version of extract_document_entities_async.
+    Cached documents yield their entities immediately; the rest are streamed.
+    """
+    return _unique_stream(lambda emit: _extract_documents_async(documents, emit), 'extract_entities_stream')
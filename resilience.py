@@ -0,0 +1,308 @@
+"""
+Retries, hedging, circuit breaking and adaptive timeouts for provider calls.
+
+A ProviderGuard wraps every call to one provider. Each attempt receives the
+timeout to use, derived from the latencies observed so far. Retryable
+failures are retried with jittered exponential backoff, and repeated failures
+open the circuit so further calls fail fast until the provider recovers.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+import httpx
+import requests
+import urllib3
+from dotenv import load_dotenv
+from metrics import PROVIDER_RETRIES, PROVIDER_HEDGES, CIRCUIT_STATE, PROVIDER_TIMEOUT
+
+load_dotenv()
+
+MAX_RETRIES = int(os.getenv('PROVIDER_MAX_RETRIES', 2))
+RETRY_BASE_DELAY = float(os.getenv('PROVIDER_RETRY_BASE_DELAY', 0.5))
+RETRY_MAX_DELAY = float(os.getenv('PROVIDER_RETRY_MAX_DELAY', 10))
+RETRY_STATUSES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+# A hedge is sent once the first attempt is slower than this latency quantile
+HEDGING = os.getenv('PROVIDER_HEDGING', 'true').lower() in ('1', 'true', 'yes')
+HEDGE_QUANTILE = float(os.getenv('PROVIDER_HEDGE_QUANTILE', 0.95))
+
+BREAKER_FAILURES = int(os.getenv('CIRCUIT_BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.getenv('CIRCUIT_BREAKER_RESET_S', 30))
+
+# Timeout = quantile of recent latencies * factor, kept between the floor and the configured timeout
+TIMEOUT_QUANTILE = float(os.getenv('ADAPTIVE_TIMEOUT_QUANTILE', 0.99))
+TIMEOUT_FACTOR = float(os.getenv('ADAPTIVE_TIMEOUT_FACTOR', 2))
+TIMEOUT_FLOOR = float(os.getenv('ADAPTIVE_TIMEOUT_FLOOR', 5))
+MIN_SAMPLES = 20
+WINDOW = 200
+
+_CLOSED, _HALF_OPEN, _OPEN = 0, 1, 2
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+class LatencyTracker:
+    """Latencies of the most recent successful attempts."""
+
+    def __init__(self, window: int = WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        """Return the q quantile, or None until MIN_SAMPLES have been observed."""
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. Once reset_timeout
+    seconds have passed, a single probe is let through: success closes the
+    circuit, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = _CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(_CLOSED, provider=name)
+
+    def _set_state(self, state: int):
+        self._state = state
+        CIRCUIT_STATE.set(state, provider=self.name)
+
+    def check(self):
+        """Raise CircuitOpenError unless a call may go ahead."""
+        with self._lock:
+            if self._state == _OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(_HALF_OPEN)
+            if self._state == _CLOSED:
+                return
+            if self._state == _HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            remaining = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0)
+        raise CircuitOpenError(f"{self.name} is unavailable after repeated failures, retrying in {remaining:.0f} s")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != _CLOSED:
+                self._set_state(_CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == _HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(_OPEN)
+
+    def release(self):
+        """Forget an attempt that was cancelled before it had an outcome."""
+        with self._lock:
+            self._probing = False
+
+def _status(outcome) -> int | None:
+    # Responses and openai.APIStatusError both carry status_code
+    return getattr(outcome, 'status_code', None)
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Connection failures, timeouts and retryable HTTP statuses raised as exceptions."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    # The OpenAI SDK raises APIConnectionError (and its APITimeoutError) for transport failures
+    if type(error).__name__ in ('APIConnectionError', 'APITimeoutError'):
+        return True
+    return _status(error) in RETRY_STATUSES
+
+def is_connect_error(error: BaseException) -> bool:
+    """
+    Whether the request failed before it reached the provider, so sending it
+    again cannot run it twice. Looks through wrapped causes, e.g. the httpx
+    error inside an openai.APIConnectionError.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, requests.ConnectTimeout,
+                              urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError)):
+            return True
+        # requests wraps urllib3's MaxRetryError, which keeps the underlying error in reason
+        reason = getattr(error.args[0], 'reason', None) if error.args and isinstance(error.args[0], BaseException) else None
+        error = reason or error.__cause__ or error.__context__
+    return False
+
+def _is_timeout(error: BaseException) -> bool:
+    return isinstance(error, (requests.Timeout, httpx.TimeoutException)) or type(error).__name__ == 'APITimeoutError'
+
+def _retry_after(outcome) -> float | None:
+    """Seconds from a Retry-After header, if the response or error has one."""
+    response = getattr(outcome, 'response', outcome)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(retry: int, retry_after: float | None = None) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After when it gives one."""
+    if retry_after is not None:
+        return min(retry_after, RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** retry))
+
+class ProviderGuard:
+    """
+    Resilience policy for one provider.
+
+    attempt is a callable taking the read timeout in seconds and returning a
+    response (or raising). A response with a retryable status is retried like
+    an exception; once the retries run out it is returned so the caller can
+    report it as usual.
+
+    Calls that are not idempotent, such as paid generations, keep the
+    configured timeout and are only retried when the request never reached
+    the provider or it answered with a retryable status. A slow generation
+    is never cut short and sent again.
+    """
+
+    def __init__(self, name: str, max_timeout: float, max_retries: int = MAX_RETRIES, idempotent: bool = True):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.max_retries = max_retries
+        self.idempotent = idempotent
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(name)
+        PROVIDER_TIMEOUT.set_function(self.timeout, provider=name)
+
+    def timeout(self) -> float:
+        """Read timeout for the next attempt, from observed latency."""
+        observed = self.latency.quantile(TIMEOUT_QUANTILE) if self.idempotent else None
+        if observed is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(TIMEOUT_FLOOR, observed * TIMEOUT_FACTOR))
+
+    def _record(self, start: float, timeout: float, outcome=None, error: BaseException = None) -> bool:
+        """Update latency and breaker state after an attempt. Returns True if it should be retried."""
+        if error is not None:
+            if not is_retryable_error(error):
+                # A 4xx answer means the provider is up; anything else says nothing about it
+                if _status(error) is not None:
+                    self.breaker.record_success()
+                else:
+                    self.breaker.release()
+                return False
+            if _is_timeout(error):
+                # Count a timeout as a slow sample so the timeout can grow when the provider slows down
+                self.latency.observe(timeout)
+            self.breaker.record_failure()
+            # A read timeout or dropped connection may still have run the request
+            return self.idempotent or _status(error) is not None or is_connect_error(error)
+        if _status(outcome) in RETRY_STATUSES:
+            self.breaker.record_failure()
+            return True
+        self.latency.observe(time.perf_counter() - start)
+        self.breaker.record_success()
+        return False
+
+    def _should_retry(self, retry: int, retryable: bool, outcome) -> bool:
+        if not retryable or retry >= self.max_retries:
+            return False
+        status = _status(outcome)
+        PROVIDER_RETRIES.inc(provider=self.name, reason=f'HTTP {status}' if status else type(outcome).__name__)
+        return True
+
+    def call(self, attempt):
+        """Run attempt with retries, backoff and the circuit breaker."""
+        retry = 0
+        while True:
+            self.breaker.check()
+            timeout = self.timeout()
+            start = time.perf_counter()
+            try:
+                outcome = attempt(timeout)
+            except Exception as e:
+                if not self._should_retry(retry, self._record(start, timeout, error=e), e):
+                    raise
+                outcome = e
+            else:
+                if not self._should_retry(retry, self._record(start, timeout, outcome), outcome):
+                    return outcome
+            time.sleep(backoff_delay(retry, _retry_after(outcome)))
+            retry += 1
+
+    async def _attempt_async(self, attempt, timeout: float):
+        """One async attempt; returns (outcome, error, retryable)."""
+        start = time.perf_counter()
+        try:
+            outcome = await attempt(timeout)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            return None, e, self._record(start, timeout, error=e)
+        return outcome, None, self._record(start, timeout, outcome)
+
+    async def _hedged(self, attempt, timeout: float):
+        """
+        Start a second attempt if the first is slower than the hedge quantile,
+        and keep whichever succeeds first.
+        """
+        hedge_after = self.latency.quantile(HEDGE_QUANTILE)
+        first = asyncio.ensure_future(self._attempt_async(attempt, timeout))
+        if hedge_after is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        second = asyncio.ensure_future(self._attempt_async(attempt, timeout))
+        pending = {first, second}
+        result = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if not result[2]:
+                        PROVIDER_HEDGES.inc(provider=self.name, winner='hedge' if task is second else 'original')
+                        return result
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def call_async(self, attempt, hedge: bool = False):
+        """
+        Async counterpart of call(). attempt returns an awaitable.
+        Pass hedge=True only for idempotent requests.
+        """
+        retry = 0
+        while True:
+            self.breaker.check()
+            timeout = self.timeout()
+            if hedge and HEDGING:
+                outcome, error, retryable = await self._hedged(attempt, timeout)
+            else:
+                outcome, error, retryable = await self._attempt_async(attempt, timeout)
+            if not self._should_retry(retry, retryable, error or outcome):
+                if error is not None:
+                    raise error
+                return outcome
+            await asyncio.sleep(backoff_delay(retry, _retry_after(error or outcome)))
+            retry += 1
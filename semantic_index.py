@@ -0,0 +1,167 @@
+"""
+In-process semantic index over document passages.
+
+Passages are embedded locally with signed feature hashing of words and word
+pairs, so indexing and queries never call a remote model. Vectors live in a
+memory-mapped matrix on disk that grows as documents are added, and a query
+is one matrix-vector product plus a top-k partition in NumPy.
+"""
+import os
+import re
+import math
+import zlib
+import tempfile
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from collections import Counter
+import numpy as np
+from dotenv import load_dotenv
+from ingest import Document
+
+load_dotenv()
+
+INDEX_DIM = int(os.getenv('SEMANTIC_INDEX_DIM', 1024))
+PASSAGE_CHARS = int(os.getenv('SEMANTIC_PASSAGE_CHARS', 600))
+PASSAGE_OVERLAP = int(os.getenv('SEMANTIC_PASSAGE_OVERLAP', 120))
+INDEX_DIR = os.getenv('SEMANTIC_INDEX_DIR') or None
+INITIAL_CAPACITY = 256
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset((
+    'a an and are as at be but by for from had has have he her his i in is it its of on or she that the their '
+    'them they this to was were which who with you your not no so if then than there into out up down over'
+).split())
+
+@dataclass(frozen=True)
+class Passage:
+    """A stretch of a document returned by a search."""
+    source: str
+    text: str
+    score: float
+
+def tokenize(text: str) -> list[str]:
+    return [word for word in _WORD.findall(text.casefold()) if word not in _STOPWORDS]
+
+def _features(text: str) -> Counter:
+    words = tokenize(text)
+    # Word pairs keep multi-word names like "queen seraphina" together
+    return Counter(words + [f'{a} {b}' for a, b in zip(words, words[1:])])
+
+class HashingEmbedder:
+    """
+    Maps text to a fixed-size unit vector by hashing features into buckets.
+    A second hash picks each feature's sign, so collisions cancel out
+    instead of piling up.
+    """
+
+    def __init__(self, dim: int = INDEX_DIM):
+        self.dim = dim
+
+    def buckets(self, text: str) -> dict[int, float]:
+        """Sparse (bucket -> weight) form of the embedding, before normalization."""
+        weights = {}
+        for feature, count in _features(text).items():
+            digest = zlib.crc32(feature.encode('utf-8'))
+            bucket = digest % self.dim
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            # Sublinear term frequency so repeated words do not dominate
+            weights[bucket] = weights.get(bucket, 0.0) + sign * (1.0 + math.log(count))
+        return weights
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for bucket, weight in self.buckets(text).items():
+            vector[bucket] = weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class SemanticIndex:
+    """
+    Growable index of passages for one session.
+    Vectors are stored in a memmap file and passage texts in a sidecar file,
+    so memory use stays flat as documents are added. Call close() to delete both.
+    """
+
+    def __init__(self, dim: int = INDEX_DIM, directory: str = INDEX_DIR):
+        self.embedder = HashingEmbedder(dim)
+        self.dim = dim
+        self.count = 0
+        self._dir = Path(tempfile.mkdtemp(prefix='sculptor-index-', dir=directory))
+        self._vectors_path = self._dir / 'vectors.f32'
+        self._texts = open(self._dir / 'passages.txt', 'w+', encoding='utf-8')
+        self._passages = []  # (source, offset, length) into the passages file
+        # Number of passages containing each bucket, for query-side IDF weighting
+        self._document_frequency = np.zeros(dim, dtype=np.float32)
+        self._capacity = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._grow(INITIAL_CAPACITY)
+
+    def _grow(self, capacity: int):
+        if self._vectors is not None:
+            self._vectors.flush()
+        with open(self._vectors_path, 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        self._capacity = capacity
+
+    def add(self, source: str, passages) -> int:
+        """Embed and append passages from source. Returns how many were added."""
+        added = 0
+        for text in passages:
+            text = text.strip()
+            if not text:
+                continue
+            vector = self.embedder.embed(text)
+            with self._lock:
+                if self.count == self._capacity:
+                    self._grow(self._capacity * 2)
+                self._vectors[self.count] = vector
+                self._document_frequency += vector != 0
+                self._texts.seek(0, os.SEEK_END)
+                offset = self._texts.tell()
+                self._texts.write(text)
+                self._passages.append((source, offset, len(text)))
+                self.count += 1
+            added += 1
+        return added
+
+    def add_document(self, document: Document) -> int:
+        """Index an ingested document as overlapping passages. Blocking; run it off the event loop."""
+        return self.add(document.name, document.iter_chunks(PASSAGE_CHARS, PASSAGE_OVERLAP))
+
+    def _read(self, index: int) -> str:
+        source, offset, length = self._passages[index]
+        self._texts.flush()
+        self._texts.seek(offset)
+        return self._texts.read(length)
+
+    def search(self, query: str, k: int = 3) -> list[Passage]:
+        """Return up to k passages most similar to query, best first."""
+        query_vector = self.embedder.embed(query)
+        with self._lock:
+            count = self.count
+            if not count or not query_vector.any():
+                return []
+            # Rare features say more about a passage than common ones
+            idf = np.log1p(count / (1.0 + self._document_frequency))
+            scores = self._vectors[:count] @ (query_vector * idf)
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                Passage(self._passages[i][0], self._read(i), float(scores[i]))
+                for i in top if scores[i] > 0
+            ]
+
+    def close(self):
+        """Delete the index files."""
+        with self._lock:
+            self._texts.close()
+            self._vectors = None
+            for path in self._dir.iterdir():
+                path.unlink(missing_ok=True)
+            self._dir.rmdir()
+            self.count = 0
+            self._passages = []
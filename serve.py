@@ -0,0 +1,59 @@
+"""
+Run several Sculptor processes that share state through the database.
+
+Each worker serves main.py on its own port (PORT, PORT+1, ...) with
+SCULPTOR_SHARED_STATE enabled, so sessions, workflows and artifacts are
+visible to all of them. Put a load balancer with sticky sessions in front:
+NiceGUI keeps each open page on a websocket to the process that rendered it.
+
+    SCULPTOR_WORKERS=4 python serve.py
+"""
+import os
+import sys
+import signal
+import subprocess
+from pathlib import Path
+from dotenv import load_dotenv
+from database import init_db
+
+load_dotenv()
+
+WORKERS = int(os.getenv('SCULPTOR_WORKERS', os.cpu_count() or 1))
+BASE_PORT = int(os.getenv('PORT', 8080))
+
+def main():
+    # Create tables once so the workers do not race each other
+    init_db()
+
+    app_path = Path(__file__).with_name('main.py')
+    processes = []
+    for index in range(WORKERS):
+        env = dict(
+            os.environ,
+            PORT=str(BASE_PORT + index),
+            SCULPTOR_SHARED_STATE='true',
+            # Each process keeps its own NiceGUI file storage; the shared copy lives in the database
+            NICEGUI_STORAGE_PATH=str(Path(os.getenv('NICEGUI_STORAGE_PATH', '.nicegui')) / f'worker-{index}'),
+        )
+        # uvicorn reads WEB_CONCURRENCY as its own worker count, which NiceGUI rejects
+        env.pop('WEB_CONCURRENCY', None)
+        processes.append(subprocess.Popen([sys.executable, str(app_path)], env=env))
+        print(f'Worker {index} listening on port {BASE_PORT + index}')
+
+    def stop(signum, frame):
+        for process in processes:
+            process.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # If one worker dies, take the others down so the supervisor can restart us
+    while processes:
+        pid, _ = os.wait()
+        exited = [p for p in processes if p.pid == pid]
+        processes = [p for p in processes if p.pid != pid]
+        if exited and processes:
+            stop(None, None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Session and workflow state shared between several app processes."""
+import os
+import json
+import asyncio
+import logging
+from nicegui import app
+from dotenv import load_dotenv
+from database import get_shared_state_async, put_shared_states_async
+
+load_dotenv()
+
+# Off for a single process; serve.py turns it on for every worker it starts
+SHARED_STATE = os.getenv('SCULPTOR_SHARED_STATE', 'false').lower() in ('1', 'true', 'yes')
+FLUSH_INTERVAL = float(os.getenv('SHARED_STATE_FLUSH_MS', 250)) / 1000
+
+SESSION_NAMESPACE = 'session'
+WORKFLOW_NAMESPACE = 'workflow'
+
+logger = logging.getLogger(__name__)
+
+class SharedStore:
+    """
+    JSON values in the shared_state table, keyed by (namespace, key).
+    Writes are buffered and flushed in one transaction every flush_interval
+    seconds, so repeated updates of the same key cost a single write.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.writes = 0
+        self.flushes = 0
+        self._pending = {}
+        self._flush_task = None
+
+    async def get(self, namespace: str, key: str, default=None):
+        """Return a value, including writes that have not been flushed yet."""
+        if (namespace, key) in self._pending:
+            value = self._pending[(namespace, key)]
+        else:
+            value = await get_shared_state_async(namespace, key)
+        return default if value is None else json.loads(value)
+
+    def put(self, namespace: str, key: str, value):
+        """Queue a write; it reaches other processes after the next flush."""
+        self._pending[(namespace, key)] = json.dumps(value)
+        self.writes += 1
+        self._schedule_flush()
+
+    def delete(self, namespace: str, key: str):
+        self._pending[(namespace, key)] = None
+        self.writes += 1
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f'Could not flush shared state, retrying: {e}')
+            self._schedule_flush()
+
+    async def flush(self):
+        """Write all buffered values now."""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await put_shared_states_async(batch)
+        except BaseException:
+            # Keep anything that was not overwritten while we were writing
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+            raise
+        self.flushes += 1
+
+    def stats(self) -> dict:
+        return {'writes': self.writes, 'flushes': self.flushes, 'pending': len(self._pending)}
+
+shared_store = SharedStore()
+
+def _session_key() -> str:
+    # The browser ID lives in the signed session cookie, so every process agrees on it
+    return app.storage.browser['id']
+
+async def load_session():
+    """Replace this process's copy of app.storage.user with the shared session."""
+    if not SHARED_STATE:
+        return
+    data = await shared_store.get(SESSION_NAMESPACE, _session_key(), {})
+    if dict(app.storage.user) != data:
+        app.storage.user.clear()
+        app.storage.user.update(data)
+
+async def save_session(flush: bool = False):
+    """
+    Publish app.storage.user to the other processes.
+    Pass flush=True when the next request may land elsewhere, e.g. right after login.
+    """
+    if not SHARED_STATE:
+        return
+    data = dict(app.storage.user)
+    if data:
+        shared_store.put(SESSION_NAMESPACE, _session_key(), data)
+    else:
+        shared_store.delete(SESSION_NAMESPACE, _session_key())
+    if flush:
+        await shared_store.flush()
+
+async def load_workflow(user_id: int) -> dict | None:
+    """Return the user's last saved workflow, or None outside shared mode."""
+    if not SHARED_STATE:
+        return None
+    return await shared_store.get(WORKFLOW_NAMESPACE, str(user_id))
+
+def save_workflow(user_id: int, workflow: dict):
+    """Save the user's workflow so a reload on any process can restore it."""
+    if SHARED_STATE:
+        shared_store.put(WORKFLOW_NAMESPACE, str(user_id), workflow)
+
+async def shutdown():
+    """Flush buffered writes; call on application shutdown."""
+    await shared_store.flush()
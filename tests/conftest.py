@@ -0,0 +1,59 @@
+"""
+Shared fixtures. The app modules read their configuration when imported, so
+the environment is pointed at a scratch directory and the stub server before
+any test imports them; tests import app modules inside the test body.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
+
+WORKDIR = Path(tempfile.mkdtemp(prefix='sculptor-tests-'))
+
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{WORKDIR / "test.db"}',
+    'SCULPTOR_CACHE_DIR': str(WORKDIR / 'cache'),
+    'SCULPTOR_ARTIFACT_DIR': str(WORKDIR / 'artifacts'),
+    'SCULPTOR_JOBS_DIR': str(WORKDIR / 'jobs'),
+    'OPENAI_API_KEY': 'stub',
+    'STABILITY_API_KEY': 'stub',
+    'TOGETHER_API_KEY': 'stub',
+    'BCRYPT_ROUNDS': '4',
+    'LOOP_MONITOR': 'false',
+})
+
+@pytest.fixture(scope='session', autouse=True)
+def stub_server():
+    """Run benchmarks/stub_server.py for the whole session and point the providers at it."""
+    from load_test import start_stub
+
+    process, url = start_stub(time_scale=0.001, error_rate=0.0)
+    os.environ.update({
+        'OPENAI_BASE_URL': f'{url}/v1',
+        'STABILITY_BASE_URL': url,
+        'TOGETHER_BASE_URL': url,
+    })
+    try:
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+@pytest.fixture(scope='session')
+def db(stub_server):
+    import database
+
+    database.init_db()
+    return database
+
+@pytest.fixture
+def user(db):
+    """A fresh user with the 5 signup credits."""
+    import uuid
+
+    return db.create_user(f'test-{uuid.uuid4().hex[:12]}', 'not-a-hash')
@@ -0,0 +1,40 @@
+import uuid
+import pytest
+from artifacts import ArtifactStore
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(tmp_path / 'artifacts')
+
+def test_artifact_written_by_another_process_is_found(store):
+    artifact_id = f'image-{uuid.uuid4().hex}'
+    path = store.root / '7' / f'{artifact_id}.png'
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b'png')
+
+    artifact = store.get(7, artifact_id)
+    assert artifact is not None and artifact.path == path and artifact.size == 3
+    # Only its owner can see it
+    assert store.get(8, artifact_id) is None
+
+@pytest.mark.parametrize('artifact_id', [
+    '../secret',
+    '../7/image-' + '0' * 32,
+    'image-' + '0' * 31,
+    'IMAGE-' + '0' * 32,
+    'image-' + '0' * 32 + '/../../secret',
+    '',
+])
+def test_ids_outside_the_pattern_never_touch_the_disk(store, artifact_id):
+    # Plant files where a traversal would land
+    (store.root / '7').mkdir(parents=True)
+    (store.root / 'secret.png').write_bytes(b'secret')
+    (store.root / '7' / f'image-{"0" * 32}.png').write_bytes(b'png')
+
+    assert store.get(8, artifact_id) is None
+
+def test_re_put_replaces_without_double_counting(store):
+    artifact_id = f'image-{uuid.uuid4().hex}'
+    for _ in range(3):
+        store.put(1, b'x' * 100, 'image', '.png', artifact_id)
+    assert store._total_bytes == 100
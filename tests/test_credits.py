@@ -0,0 +1,37 @@
+def balance(db, user) -> int:
+    return db.get_user_by_id(user.id).credits
+
+def test_reserve_takes_credits_and_commit_keeps_them(db, user):
+    reservation_id = db.reserve_credits(user.id, 3, 'test')
+    assert reservation_id is not None
+    assert balance(db, user) == 2
+
+    assert db.commit_reservation(reservation_id)
+    assert balance(db, user) == 2
+    # A settled reservation can be neither committed nor refunded again
+    assert not db.commit_reservation(reservation_id)
+    assert not db.refund_reservation(reservation_id)
+    assert balance(db, user) == 2
+
+def test_refund_returns_credits_once(db, user):
+    reservation_id = db.reserve_credits(user.id, 2, 'test')
+    assert balance(db, user) == 3
+
+    assert db.refund_reservation(reservation_id)
+    assert not db.refund_reservation(reservation_id)
+    assert balance(db, user) == 5
+    assert not db.commit_reservation(reservation_id)
+
+def test_reserve_beyond_balance_is_rejected(db, user):
+    assert db.reserve_credits(user.id, 6, 'test') is None
+    assert balance(db, user) == 5
+
+    first = db.reserve_credits(user.id, 4, 'test')
+    assert first is not None
+    assert db.reserve_credits(user.id, 2, 'test') is None
+    assert balance(db, user) == 1
+
+def test_cached_user_sees_reservations(db, user):
+    assert db.get_cached_user(user.id).credits == 5
+    db.reserve_credits(user.id, 1, 'test')
+    assert db.get_cached_user(user.id).credits == 4
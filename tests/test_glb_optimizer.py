@@ -0,0 +1,76 @@
+from pathlib import Path
+import numpy as np
+import pytest
+from glb_optimizer import optimize_glb, parse_glb, read_accessor, _rotate
+
+SAMPLES = Path(__file__).resolve().parent.parent / 'samples'
+MODELS = ['generated_model.glb', 'custom_model.glb']
+
+def world_triangles(data: bytes) -> np.ndarray:
+    """Every triangle of every mesh node as a (triangles, 3, 3) array of world positions."""
+    gltf, bin_chunk = parse_glb(data)
+    triangles = []
+    for node in gltf['nodes']:
+        if 'mesh' not in node:
+            continue
+        assert 'matrix' not in node
+        for primitive in gltf['meshes'][node['mesh']]['primitives']:
+            positions = read_accessor(gltf, bin_chunk, primitive['attributes']['POSITION']).astype(np.float64)
+            indices = read_accessor(gltf, bin_chunk, primitive['indices']).reshape(-1)
+            assert indices.max() < len(positions)
+            positions = positions * node.get('scale', [1.0, 1.0, 1.0])
+            positions = _rotate(node.get('rotation', [0.0, 0.0, 0.0, 1.0]), positions)
+            positions = positions + node.get('translation', [0.0, 0.0, 0.0])
+            triangles.append(positions[indices].reshape(-1, 3, 3))
+    return np.concatenate(triangles)
+
+def canonical(triangles: np.ndarray) -> np.ndarray:
+    """Rotate each triangle to start at its smallest vertex (keeping the winding) and sort them."""
+    rows = []
+    for triangle in triangles:
+        keys = [tuple(vertex) for vertex in triangle]
+        start = keys.index(min(keys))
+        rows.append(sum((keys[(start + i) % 3] for i in range(3)), ()))
+    return np.array(sorted(rows))
+
+@pytest.mark.parametrize('name', MODELS)
+def test_output_is_a_valid_glb(name):
+    data = (SAMPLES / name).read_bytes()
+    optimized, report = optimize_glb(data)
+    assert report['optimized_bytes'] == len(optimized) < len(data)
+
+    gltf, bin_chunk = parse_glb(optimized)
+    assert 'KHR_mesh_quantization' in gltf['extensionsRequired']
+    assert gltf['buffers'][0]['byteLength'] <= len(bin_chunk)
+    for view in gltf['bufferViews']:
+        assert view.get('byteOffset', 0) + view['byteLength'] <= len(bin_chunk)
+    for index, accessor in enumerate(gltf['accessors']):
+        assert len(read_accessor(gltf, bin_chunk, index)) == accessor['count']
+
+def test_lossless_round_trip_keeps_every_triangle():
+    data = (SAMPLES / MODELS[0]).read_bytes()
+    optimized, report = optimize_glb(data, quantize=False)
+    assert report['vertices_after'] <= report['vertices_before']
+    np.testing.assert_array_equal(canonical(world_triangles(optimized)), canonical(world_triangles(data)))
+
+@pytest.mark.parametrize('name', MODELS)
+def test_quantized_geometry_stays_in_place(name):
+    data = (SAMPLES / name).read_bytes()
+    optimized, report = optimize_glb(data)
+    before, after = world_triangles(data), world_triangles(optimized)
+    # Only triangles whose corners quantized to the same point are dropped
+    assert len(after) == report['triangles']
+    assert len(before) - 10 <= len(after) <= len(before)
+    extent = before.reshape(-1, 3).max(axis=0) - before.reshape(-1, 3).min(axis=0)
+    # 16-bit positions: the bounding box moves by at most a quantization step
+    tolerance = extent.max() / 65535 * 2
+    np.testing.assert_allclose(after.reshape(-1, 3).min(axis=0), before.reshape(-1, 3).min(axis=0), atol=tolerance)
+    np.testing.assert_allclose(after.reshape(-1, 3).max(axis=0), before.reshape(-1, 3).max(axis=0), atol=tolerance)
+
+def test_unsupported_input_is_returned_unchanged():
+    data = (SAMPLES / MODELS[0]).read_bytes()
+    once, _ = optimize_glb(data)
+    # Already quantized: optimizing again must not touch it
+    twice, report = optimize_glb(once)
+    assert twice == once
+    assert report['skipped']
@@ -0,0 +1,41 @@
+import json
+import asyncio
+
+def run_next_job():
+    import jobs
+    from database import claim_next_job_async
+
+    async def run():
+        try:
+            await jobs._run_job(await claim_next_job_async())
+        finally:
+            # Each test runs its own event loop; drop the HTTP client bound to it
+            import http_client
+            await http_client.aclose()
+    asyncio.run(run())
+
+def test_image_job_commits_credits_and_cache_hit_is_free(db, user):
+    import uuid
+    import jobs
+
+    prompt = f'a brass owl {uuid.uuid4().hex}'
+    job_id = asyncio.run(jobs.enqueue_image_job(user.id, prompt, 1))
+    run_next_job()
+    job = db.get_job(job_id)
+    assert job.status == 'done', job.error
+    assert db.get_user_by_id(user.id).credits == 4
+
+    # The same prompt again is served from the image cache and refunded
+    job_id = asyncio.run(jobs.enqueue_image_job(user.id, prompt, 1))
+    run_next_job()
+    assert db.get_job(job_id).status == 'done'
+    assert db.get_user_by_id(user.id).credits == 4
+
+def test_failed_job_refunds_credits(db, user):
+    job = db.create_job(user.id, 'unknown', json.dumps({'reservation_id': db.reserve_credits(user.id, 2, 'test')}), 2)
+    assert db.get_user_by_id(user.id).credits == 3
+    run_next_job()
+    job = db.get_job(job.id)
+    assert job.status == 'failed'
+    assert 'Unknown job kind' in job.error
+    assert db.get_user_by_id(user.id).credits == 5
@@ -0,0 +1,112 @@
+"""Preview and WebP variants for generated images, rendered in a process pool."""
+import io
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from dotenv import load_dotenv
+from artifacts import artifact_store, Artifact
+from metrics import EXECUTOR_QUEUE_DEPTH
+
+load_dotenv()
+
+PREVIEW_SIZE = int(os.getenv('PREVIEW_SIZE', 512))
+PREVIEW_QUALITY = int(os.getenv('PREVIEW_QUALITY', 80))
+WEBP_QUALITY = int(os.getenv('WEBP_QUALITY', 90))
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+
+# Variant name -> file suffix
+VARIANTS = {
+    'preview': '.webp',
+    'webp': '.webp',
+}
+
+_executor = None
+_in_flight = {}
+
+def render_variants(path: str, preview_size: int = PREVIEW_SIZE) -> dict[str, bytes]:
+    """
+    Render all variants of the image at path.
+    Runs in a worker process, so it only takes and returns picklable values.
+    """
+    with Image.open(path) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+
+        full = io.BytesIO()
+        image.save(full, 'WEBP', quality=WEBP_QUALITY, method=4)
+
+        preview_image = image.copy()
+        preview_image.thumbnail((preview_size, preview_size), Image.Resampling.LANCZOS)
+        preview = io.BytesIO()
+        preview_image.save(preview, 'WEBP', quality=PREVIEW_QUALITY, method=4)
+
+    return {'preview': preview.getvalue(), 'webp': full.getvalue()}
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # The parent runs threads (database loop, auth pool, loop monitor) that may
+        # hold locks at fork time, so workers start from a clean forkserver instead
+        _executor = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context('forkserver')
+        )
+    return _executor
+
+async def _render(path: str) -> dict[str, bytes]:
+    """Render in the process pool, counting the render as queued until it finishes."""
+    EXECUTOR_QUEUE_DEPTH.inc(executor='thumbnails')
+    try:
+        return await asyncio.wrap_future(_get_executor().submit(render_variants, path))
+    finally:
+        EXECUTOR_QUEUE_DEPTH.dec(executor='thumbnails')
+
+def variant_id(artifact_id: str, variant: str) -> str:
+    """ID under which a variant of an artifact is stored."""
+    return f'{artifact_id}-{variant}'
+
+def get_variants(artifact: Artifact) -> dict[str, Artifact]:
+    """Return the variants that already exist for an artifact."""
+    variants = {}
+    for variant in VARIANTS:
+        stored = artifact_store.get(artifact.user_id, variant_id(artifact.id, variant))
+        if stored:
+            variants[variant] = stored
+    return variants
+
+async def ensure_variants(artifact: Artifact) -> dict[str, Artifact]:
+    """
+    Create the preview and WebP variants of an image artifact once.
+    Concurrent callers for the same artifact share one render.
+    """
+    variants = get_variants(artifact)
+    if len(variants) == len(VARIANTS):
+        return variants
+
+    key = (artifact.user_id, artifact.id)
+    if key not in _in_flight:
+        _in_flight[key] = asyncio.ensure_future(_render_and_store(artifact))
+    try:
+        return await asyncio.shield(_in_flight[key])
+    finally:
+        if _in_flight.get(key) is not None and _in_flight[key].done():
+            _in_flight.pop(key, None)
+
+async def _render_and_store(artifact: Artifact) -> dict[str, Artifact]:
+    rendered = await _render(str(artifact.path))
+    variants = {}
+    for variant, data in rendered.items():
+        variants[variant] = await asyncio.to_thread(
+            artifact_store.put, artifact.user_id, data, artifact.kind, VARIANTS[variant],
+            variant_id(artifact.id, variant)
+        )
+    return variants
+
+def shutdown():
+    """Stop the worker processes; call on application shutdown."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None